@@ -1,9 +1,11 @@
-import asyncio
+import queue
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from flask import Flask, request, jsonify
 import hmac
 import hashlib
-from post_extension import load_config, send_msg_to_group
+from post_extension import get_outbox, load_config, send_msg_to_group
 
 app = Flask(__name__)
 
@@ -13,10 +15,61 @@ webhook_host = config.get("webhook_host", "0.0.0.0")
 webhook_port = config.get("webhook_port", 60000)
 webhook_secret = config.get("webhook_secret", "")
 
+# 已验签的 push 事件先放入队列立即返回 202，由后台线程格式化并推送
+_event_queue = queue.Queue(maxsize=config.get("webhook_queue_size", 100))
+_worker_thread = None
+_worker_lock = threading.Lock()
+
+# 最近处理过的 X-GitHub-Delivery，GitHub 超时重发同一事件时直接忽略
+_recent_deliveries = OrderedDict()
+_deliveries_lock = threading.Lock()
+MAX_RECENT_DELIVERIES = 1000
+
+def _is_duplicate_delivery(delivery_id):
+    """记录 delivery id，已处理过时返回 True"""
+    if not delivery_id:
+        return False
+    with _deliveries_lock:
+        if delivery_id in _recent_deliveries:
+            return True
+        _recent_deliveries[delivery_id] = True
+        if len(_recent_deliveries) > MAX_RECENT_DELIVERIES:
+            _recent_deliveries.popitem(last=False)
+    return False
+
+def _forget_delivery(delivery_id):
+    with _deliveries_lock:
+        _recent_deliveries.pop(delivery_id, None)
+
+def _ensure_worker():
+    """启动后台推送线程（重复调用无副作用）"""
+    global _worker_thread
+    with _worker_lock:
+        if _worker_thread is None:
+            _worker_thread = threading.Thread(target=_delivery_worker, daemon=True, name="webhook-worker")
+            _worker_thread.start()
+
+def _delivery_worker():
+    while True:
+        delivery_id, data = _event_queue.get()
+        try:
+            handle_push_event(data)
+        except Exception as e:
+            print(f"处理推送事件 {delivery_id} 时出现异常：{e}")
+        finally:
+            _event_queue.task_done()
+
 @app.route('/gh')
 def index():
     return "GitHub Webhook Bot is running!", 200
 
+@app.route('/gh/outbox')
+def outbox_stats():
+    """积压情况：发件箱待投递/已完成/已放弃数量、最久待投递推送的等待秒数，以及待处理的事件数"""
+    stats = get_outbox().stats()
+    stats["queued_events"] = _event_queue.qsize()
+    return jsonify(stats), 200
+
 @app.route('/gh/webhook', methods=['POST'])
 def github_webhook():
     """
@@ -40,11 +93,27 @@ def github_webhook():
     if not hmac.compare_digest(local_signature, signature_header):
         return "Invalid signature", 403
     
-    data = request.json
     event = request.headers.get('X-GitHub-Event', '')
     if event != 'push':
         return jsonify({"msg": "not a push event"}), 200
-    
+
+    # 4. 按 X-GitHub-Delivery 去重，GitHub 重发的同一事件只处理一次
+    delivery_id = request.headers.get('X-GitHub-Delivery', '')
+    if _is_duplicate_delivery(delivery_id):
+        return jsonify({"msg": "duplicate delivery"}), 200
+
+    # 5. 放入队列后立即返回，格式化和推送在后台进行
+    _ensure_worker()
+    try:
+        _event_queue.put_nowait((delivery_id, request.get_json(silent=True) or {}))
+    except queue.Full:
+        _forget_delivery(delivery_id)  # 让 GitHub 稍后重发
+        return jsonify({"msg": "queue full"}), 503
+
+    return jsonify({"msg": "accepted"}), 202
+
+def handle_push_event(data):
+    """格式化 push 事件并推送到各群"""
     # 分支名
     ref = data.get('ref', 'refs/heads/???')
     branch = ref.split('/')[-1] if 'refs/heads/' in ref else ref
@@ -60,7 +129,8 @@ def github_webhook():
     pusher = data.get('pusher', {}).get('name', 'UnknownPusher')
     commits = data.get('commits', [])
     if not commits:
-        return jsonify({"msg": "no commits"}), 200
+        print(f"仓库 {repo_name} 的推送没有提交，已忽略")
+        return
 
     # 整理所有提交信息
     commit_messages = []
@@ -89,14 +159,15 @@ def github_webhook():
     # 时间字符串
     time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    # 调用发送函数；此处用 asyncio.to_thread 避免阻塞
-    asyncio.run(asyncio.to_thread(send_msg_to_group, final_text, time_str))
-
-    return jsonify({"msg": "ok"}), 200
+    # 以推送后的 head commit 作为幂等键，GitHub 重发同一事件时不会重复推送
+    idempotency_key = f"gh:{repo_name}:{ref}:{data.get('after') or commits[-1].get('id', '')}"
+    send_msg_to_group(final_text, time_str, idempotency_key)
 
 def run_server():
     app.run(host=webhook_host, port=webhook_port, debug=False)
 
 if __name__ == '__main__':
     print("✅ GitHub Webhook Bot 启动中...")
+    get_outbox()  # 启动发件箱，继续投递上次未成功的推送
+    _ensure_worker()
     run_server()
@@ -1,5 +1,16 @@
 import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+# 发件箱与 TelegramChannelPush 共用，位于仓库根目录的 common/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from outbox import Outbox
 
 def load_config(config_path='config.json'):
     """读取配置文件并返回字典对象"""
@@ -11,17 +22,77 @@ config = load_config()
 post_url = config.get("napcat_url", "")
 post_token = config.get("napcat_token", "")
 post_group_ids = config.get("napcat_group_ids", [])
+max_concurrency = config.get("napcat_max_concurrency", 5)  # 同时推送的群数
+group_interval = config.get("napcat_group_interval", 1.0)  # 同一个群两次推送的最小间隔（秒）
+request_timeout = config.get("napcat_timeout", 15)
 
-def send_msg_to_group(text, time_str):
-    """
-    将文本发送到配置的多个群。
-    - text:     文本信息
-    - time_str: 时间字符串（仅作附加说明）
-    """
+# 复用 keep-alive 连接；线程池负责向多个群并发推送
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=max(1, max_concurrency)))
+_session.mount("https://", HTTPAdapter(pool_maxsize=max(1, max_concurrency)))
+_executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="napcat-push")
+
+# 群号 -> 允许下一次推送的时间
+_group_next_send = {}
+_group_lock = threading.Lock()
+
+# 持久化发件箱，首次推送时创建并启动后台重试线程
+OUTBOX_PATH = config.get("outbox_path", "outbox.db")
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def _wait_for_group_slot(group_id):
+    """按群限速：同一个群的两次推送至少间隔 group_interval 秒"""
+    with _group_lock:
+        now = time.monotonic()
+        send_at = max(now, _group_next_send.get(group_id, 0.0))
+        _group_next_send[group_id] = send_at + group_interval
+    if send_at > now:
+        time.sleep(send_at - now)
+
+def _post_to_group(group_id, message_part):
+    """向单个群推送一次，返回是否成功；失败后的退避重试由发件箱负责"""
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {post_token}"
     }
+    body = {
+        "group_id": group_id,
+        "message": message_part
+    }
+    _wait_for_group_slot(group_id)
+    try:
+        resp = _session.post(post_url, headers=headers, data=json.dumps(body), timeout=request_timeout)
+    except requests.exceptions.RequestException as e:
+        print(f"发送到群 {group_id} 时出现异常：{e}")
+        return False
+    if not resp.ok:
+        print(f"发送到群 {group_id} 失败，返回码：{resp.status_code}，返回：{resp.text}")
+        return False
+    print(f"已向群 {group_id} 发送消息，返回码：{resp.status_code}，返回：{resp.text}")
+    return True
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(
+                OUTBOX_PATH, _post_to_group, executor=_executor,
+                max_attempts=config.get("outbox_max_attempts", 8),
+                base_delay=config.get("outbox_retry_base_delay", 10)
+            )
+            _outbox.start()
+        return _outbox
+
+def send_msg_to_group(text, time_str, idempotency_key=None):
+    """
+    将文本发送到配置的多个群。
+    - text:            文本信息
+    - time_str:        时间字符串（仅作附加说明）
+    - idempotency_key: 相同的推送对每个群只投递一次（如 commit sha）
+    推送先写入发件箱再立即投递，失败的由后台按指数退避重试。
+    返回本次立即投递的 群号 -> 是否发送成功
+    """
 
     # 构造要发送的文本
     message_part = [
@@ -33,14 +104,6 @@ def send_msg_to_group(text, time_str):
         }
     ]
 
-    # 依次发送到每个群
-    for group_id in post_group_ids:
-        body = {
-            "group_id": group_id,
-            "message": message_part
-        }
-        try:
-            resp = requests.post(post_url, headers=headers, data=json.dumps(body))
-            print(f"已向群 {group_id} 发送消息，返回码：{resp.status_code}，返回：{resp.text}")
-        except Exception as e:
-            print(f"发送到群 {group_id} 时出现异常：{e}")
+    # 写入发件箱后并发发送到每个群（每个群单独限速、重试）
+    outbox = get_outbox()
+    return outbox.process(outbox.enqueue(idempotency_key, post_group_ids, message_part))
@@ -0,0 +1,294 @@
+"""
+本地 LLM 桩服务：模拟 OpenAI 兼容的 /chat/completions 接口，不依赖第三方库。
+- 支持流式 (SSE) 与非流式响应；请求带 response_format = json_object 时返回 JSON 内容
+- 可配置首 token 延迟、抖动、token 速率，用于模拟真实模型的吞吐
+- 可按比例注入错误（429/500 等）和流式中途断开，用于观察失败时的行为
+- GET /stats 返回请求统计，POST /stats/reset 清零
+
+供 bench/replay.py 压测消息管线使用，也可以单独运行，
+把 LLMChat 的 ai.api_url 或 TelegramChannelPush 的 api_base 指向它：
+    python bench/mock_llm_server.py --port 8765 --token-rate 40 --first-token-latency 0.3 --error-rate 0.05
+    # LLMChat:              "api_url": "http://127.0.0.1:8765/chat/completions"
+    # TelegramChannelPush:  "api_base": "http://127.0.0.1:8765/v1"
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple
+
+DEFAULT_REPLY = "收到喵\n今天也要开心哦\n有什么想聊的吗？"
+# json_object 模式下的默认回复，同时满足 TelegramChannelPush 过滤（decision/reason）和摘要（summary）的解析
+DEFAULT_JSON_REPLY = {"decision": "yes", "reason": "桩服务默认放行", "summary": "桩服务生成的摘要"}
+
+ERROR_MESSAGES = {
+    400: ("invalid_request_error", "Mock bad request"),
+    401: ("authentication_error", "Mock invalid api key"),
+    429: ("rate_limit_exceeded", "Mock rate limit reached"),
+    500: ("server_error", "Mock internal server error"),
+    502: ("server_error", "Mock bad gateway"),
+    503: ("server_error", "Mock service unavailable"),
+}
+
+
+class MockStats:
+    """线程安全的请求计数"""
+
+    FIELDS = ("requests", "stream_requests", "json_requests", "image_requests",
+              "injected_errors", "disconnects", "completed", "completion_tokens")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {field: 0 for field in self.FIELDS}
+            self.errors_by_status = {}
+            self.in_flight = 0
+            self.max_in_flight = 0
+            self.started_at = time.time()
+
+    def incr(self, field: str, amount: int = 1):
+        with self._lock:
+            self.counters[field] += amount
+
+    def error(self, status: int):
+        with self._lock:
+            self.counters["injected_errors"] += 1
+            self.errors_by_status[status] = self.errors_by_status.get(status, 0) + 1
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = max(time.time() - self.started_at, 1e-9)
+            data = dict(self.counters)
+            data.update({
+                "errors_by_status": {str(k): v for k, v in self.errors_by_status.items()},
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "elapsed": round(elapsed, 3),
+                "requests_per_second": round(self.counters["requests"] / elapsed, 3),
+            })
+            return data
+
+
+def _has_image(messages) -> bool:
+    for message in messages or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list) and any(
+                isinstance(part, dict) and part.get("type") == "image_url" for part in content):
+            return True
+    return False
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass  # 压测时不输出访问日志
+
+    def _send_json(self, status: int, data: dict, extra_headers: Optional[dict] = None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.stats.snapshot())
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        path = self.path.split("?", 1)[0].rstrip("/")
+
+        if path.endswith("/stats/reset"):
+            self.server.stats.reset()
+            self._send_json(200, {"ok": True})
+            return
+        if not path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+
+        try:
+            request = json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            request = {}
+
+        stats = self.server.stats
+        stats.incr("requests")
+        stats.enter()
+        try:
+            self._handle_completion(request)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端超时或主动断开
+        finally:
+            stats.leave()
+
+    def _handle_completion(self, request: dict):
+        server = self.server
+        stats = server.stats
+        stream = bool(request.get("stream"))
+        json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+        if stream:
+            stats.incr("stream_requests")
+        if json_mode:
+            stats.incr("json_requests")
+        if _has_image(request.get("messages")):
+            stats.incr("image_requests")  # 图片内容本身被忽略
+
+        latency = server.first_token_latency
+        if server.latency_jitter:
+            latency += server.random.uniform(0, server.latency_jitter)
+
+        # 错误在首 token 延迟之后返回，模拟真实服务的失败耗时
+        if server.error_statuses and server.random.random() < server.error_rate:
+            status = server.random.choice(server.error_statuses)
+            time.sleep(latency)
+            stats.error(status)
+            error_type, message = ERROR_MESSAGES.get(status, ("server_error", f"Mock error {status}"))
+            headers = {"Retry-After": "1"} if status == 429 else None
+            self._send_json(status, {"error": {"message": message, "type": error_type, "code": status}}, headers)
+            return
+
+        reply = server.json_reply if json_mode else server.reply
+        chunks = [reply[i:i + server.chunk_size] for i in range(0, len(reply), server.chunk_size)] or [""]
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+        model = request.get("model") or "mock-model"
+        token_interval = 1.0 / server.token_rate if server.token_rate > 0 else server.chunk_delay
+
+        time.sleep(latency)
+
+        if not stream:
+            # 非流式：按 token 速率一次性等完整段生成时间
+            if token_interval:
+                time.sleep(token_interval * len(chunks))
+            stats.incr("completion_tokens", len(chunks))
+            stats.incr("completed")
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(chunks), "total_tokens": len(chunks)},
+            })
+            return
+
+        # 流式中途断开：发送一部分分片后直接关闭连接，不发送 [DONE]
+        cut_at = None
+        if server.disconnect_rate and server.random.random() < server.disconnect_rate:
+            cut_at = server.random.randint(0, max(len(chunks) - 1, 0))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for index, text in enumerate(chunks):
+            if index == cut_at:
+                stats.incr("disconnects")
+                return
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            stats.incr("completion_tokens")
+            if token_interval and index < len(chunks) - 1:
+                time.sleep(token_interval)
+        final = {"id": completion_id, "object": "chat.completion.chunk", "model": model,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        stats.incr("completed")
+
+
+def start_server(host: str = "127.0.0.1", port: int = 0, reply: str = DEFAULT_REPLY,
+                 chunk_size: int = 4, chunk_delay: float = 0.0,
+                 json_reply: Optional[dict] = None, token_rate: float = 0.0,
+                 first_token_latency: float = 0.0, latency_jitter: float = 0.0,
+                 error_rate: float = 0.0, error_statuses: Tuple[int, ...] = (429, 500),
+                 disconnect_rate: float = 0.0, seed: Optional[int] = None) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    在后台线程启动桩服务，返回 (server, 接口地址)。port 为 0 时自动分配端口。
+    chunk_size 个字符视为一个 token；token_rate > 0 时按每秒 token 数发送分片，否则使用 chunk_delay。
+    """
+    server = ThreadingHTTPServer((host, port), MockLLMHandler)
+    server.daemon_threads = True
+    server.reply = reply
+    server.json_reply = json.dumps(json_reply if json_reply is not None else DEFAULT_JSON_REPLY, ensure_ascii=False)
+    server.chunk_size = max(1, chunk_size)
+    server.chunk_delay = chunk_delay
+    server.token_rate = token_rate
+    server.first_token_latency = first_token_latency
+    server.latency_jitter = latency_jitter
+    server.error_rate = error_rate
+    server.error_statuses = tuple(error_statuses)
+    server.disconnect_rate = disconnect_rate
+    server.random = random.Random(seed)
+    server.stats = MockStats()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{host}:{server.server_address[1]}/chat/completions"
+    return server, url
+
+
+def main(argv: Optional[list] = None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 LLM 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="普通模式下的固定回复")
+    parser.add_argument("--json-reply", default=None, help="json_object 模式下返回的 JSON 字符串")
+    parser.add_argument("--chunk-size", type=int, default=4, help="每个 SSE 分片（一个 token）的字符数")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="分片之间的间隔（秒），设置 --token-rate 时忽略")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="每秒生成的 token 数，0 表示不限速")
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="首 token 延迟（秒）")
+    parser.add_argument("--latency-jitter", type=float, default=0.0, help="首 token 延迟的随机抖动上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误响应的概率 (0-1)")
+    parser.add_argument("--error-status", type=int, action="append", default=None,
+                        help="注入错误时使用的状态码，可重复指定，默认 429 和 500")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="流式响应中途断开的概率 (0-1)")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子，便于复现")
+    args = parser.parse_args(argv)
+
+    json_reply = json.loads(args.json_reply) if args.json_reply else None
+    server, url = start_server(
+        args.host, args.port, reply=args.reply, chunk_size=args.chunk_size, chunk_delay=args.chunk_delay,
+        json_reply=json_reply, token_rate=args.token_rate,
+        first_token_latency=args.first_token_latency, latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate, error_statuses=tuple(args.error_status or (429, 500)),
+        disconnect_rate=args.disconnect_rate, seed=args.seed,
+    )
+    print(f"[INFO] Mock LLM 服务已启动: {url}")
+    print(f"[INFO] 统计信息: http://{args.host}:{server.server_address[1]}/stats")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""
+消息管线回放压测
+把录制的 OneBot 事件（JSONL，每行一个 WebSocket 收到的原始事件）按顺序送入
+handle_incoming_message，LLM 请求打到本地桩服务，消息发送走 RecordingSender，
+统计吞吐量、各阶段 p50/p99 延迟，以及可选的内存分配情况。
+
+阶段：
+  event          单个事件从进入 handle_incoming_message 到其派生的线程全部结束
+  dispatch       handle_incoming_message 本身（私聊回复在线程中进行，不含在内）
+  command        process_command
+  group_handler  handle_group_message
+  llm            process_conversation 生成器从开始到耗尽；llm.first_segment 为首个分段的延迟
+  parse          parse_ai_message_to_segments
+  send           RecordingSender 的发送调用
+
+用法（在 LLMChat 目录下）：
+    python bench/replay.py --events bench/sample_events.jsonl --repeat 20
+    python bench/replay.py --save-baseline bench/baseline.json
+    python bench/replay.py --baseline bench/baseline.json --max-regression 0.2
+    python bench/replay.py --allocations
+
+运行时会复制 config/ 到临时目录并在其中运行，不会改动真实的 data/ 和配置。
+"""
+import argparse
+import contextlib
+import functools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Callable, DefaultDict, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+LLMCHAT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, LLMCHAT_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from mock_llm_server import start_server  # noqa: E402
+
+DEFAULT_EVENTS = os.path.join(BENCH_DIR, "sample_events.jsonl")
+THREAD_JOIN_TIMEOUT = 30.0
+
+# 阶段名 -> 耗时样本（秒）
+timings: DefaultDict[str, List[float]] = defaultdict(list)
+_timings_lock = threading.Lock()
+
+
+def record(stage: str, seconds: float):
+    with _timings_lock:
+        timings[stage].append(seconds)
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+# ---------------------------------------------------------------- 运行环境
+
+def prepare_workdir(api_url: str) -> str:
+    """在临时目录中准备 config/，把 LLM 地址指向桩服务并关闭会拖慢回放的延迟"""
+    workdir = tempfile.mkdtemp(prefix="arcbot_bench_")
+    shutil.copytree(os.path.join(LLMCHAT_DIR, "config"), os.path.join(workdir, "config"))
+    config_path = os.path.join(workdir, "config", "config.json")
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    config["debug"] = False
+    for section in ("ai", "image_ai"):
+        config.setdefault(section, {})
+        config[section]["api_url"] = api_url
+        config[section]["token"] = "bench"
+    qqbot = config.setdefault("qqbot", {})
+    qqbot["admin_qq"] = ["10001"]
+    qqbot["qq_list_mode"] = "black"
+    qqbot["group_list_mode"] = "black"
+    qqbot["rate_limit"] = {"enabled": False}
+    batching = dict(qqbot.get("batching") or {})
+    batching["typing_delay"] = [0, 0]
+    qqbot["batching"] = batching
+    config.setdefault("dragon", {})["follow_probability"] = 1.0
+
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return workdir
+
+
+def load_events(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+# ---------------------------------------------------------------- 计时包装
+
+def wrap_sync(module, name: str, stage: str):
+    original = getattr(module, name)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            record(stage, time.perf_counter() - start)
+
+    setattr(module, name, wrapper)
+
+
+def wrap_async(module, name: str, stage: str):
+    original = getattr(module, name)
+
+    @functools.wraps(original)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            record(stage, time.perf_counter() - start)
+
+    setattr(module, name, wrapper)
+
+
+def wrap_generator(module, name: str, stage: str):
+    original = getattr(module, name)
+
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        first = True
+        try:
+            for item in original(*args, **kwargs):
+                if first:
+                    record(f"{stage}.first_segment", time.perf_counter() - start)
+                    first = False
+                yield item
+        finally:
+            record(stage, time.perf_counter() - start)
+
+    setattr(module, name, wrapper)
+
+
+class _ThreadTracker:
+    """记录回放期间新启动的线程，用于等待单个事件派生的所有工作完成"""
+
+    def __init__(self):
+        self.started: List[threading.Thread] = []
+        self._original_start = threading.Thread.start
+
+    def install(self):
+        tracker = self
+
+        def start(thread_self):
+            # 写盘定时器（WriteBehindFlusher）会延迟数秒执行，不计入事件耗时
+            if not isinstance(thread_self, threading.Timer):
+                tracker.started.append(thread_self)
+            tracker._original_start(thread_self)
+
+        threading.Thread.start = start
+
+    def wait_all(self, timeout: float = THREAD_JOIN_TIMEOUT) -> int:
+        """等待已记录的线程结束（等待期间新启动的线程也会被等待），返回超时未结束的线程数"""
+        deadline = time.monotonic() + timeout
+        while self.started:
+            thread = self.started.pop(0)
+            thread.join(max(0.0, deadline - time.monotonic()))
+            if thread.is_alive():
+                return len(self.started) + 1
+        return 0
+
+
+def install_pipeline(tracker: _ThreadTracker):
+    """导入管线模块，替换发送端并挂上各阶段计时"""
+    from logger import init_db
+    import napcat.post as post
+    import napcat.get as get
+    import napcat.chat_logic as chat_logic
+    from napcat.message_sender import IMessageSender
+    from utils.event_manager import event_registry
+
+    init_db()
+    sent: List[Dict] = []
+
+    class RecordingSender(IMessageSender):
+        def _record(self, action: str, target: int, message):
+            start = time.perf_counter()
+            sent.append({"action": action, "target": target, "message": message})
+            record("send", time.perf_counter() - start)
+
+        def send_private_msg(self, user_id, message, priority=None):
+            self._record("send_private_msg", user_id, message)
+
+        def send_group_msg(self, group_id, message, priority=None):
+            self._record("send_group_msg", group_id, message)
+
+        def send_poke(self, group_id, user_id, priority=None):
+            self._record("group_poke", group_id, user_id)
+
+        def set_input_status(self, user_id):
+            pass
+
+        def set_friend_add_request(self, flag, approve, remark=""):
+            sent.append({"action": "set_friend_add_request", "flag": flag, "approve": approve})
+
+    # 没有真实连接，WebSocket 动作（输入状态、获取好友列表等）直接丢弃
+    post.send_ws_message = lambda data: None
+    get.WebSocketSender = RecordingSender
+
+    wrap_sync(get, "process_command", "command")
+    wrap_async(get, "handle_group_message", "group_handler")
+    wrap_generator(chat_logic, "process_conversation", "llm")
+    wrap_async(chat_logic, "parse_ai_message_to_segments", "parse")
+
+    # 提前启动常驻线程，避免被当成某个事件派生的线程
+    event_registry.wheel._ensure_thread()
+    tracker.install()
+    return get.handle_incoming_message, sent
+
+
+# ---------------------------------------------------------------- 回放
+
+def replay(handle: Callable[[str], None], events: List[str], repeat: int, tracker: _ThreadTracker) -> Dict:
+    timed_out = 0
+    wall_start = time.perf_counter()
+    for _ in range(repeat):
+        for raw in events:
+            start = time.perf_counter()
+            handle(raw)
+            record("dispatch", time.perf_counter() - start)
+            timed_out += tracker.wait_all()
+            record("event", time.perf_counter() - start)
+    wall = time.perf_counter() - wall_start
+    total_events = len(events) * repeat
+    return {
+        "events": total_events,
+        "wall_seconds": wall,
+        "throughput_eps": total_events / wall if wall else 0.0,
+        "timed_out_threads": timed_out,
+    }
+
+
+def summarize() -> Dict[str, Dict[str, float]]:
+    with _timings_lock:
+        return {
+            stage: {
+                "count": len(samples),
+                "mean_ms": sum(samples) / len(samples) * 1000,
+                "p50_ms": percentile(samples, 0.5) * 1000,
+                "p99_ms": percentile(samples, 0.99) * 1000,
+                "max_ms": max(samples) * 1000,
+            }
+            for stage, samples in sorted(timings.items()) if samples
+        }
+
+
+def compare_with_baseline(result: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """返回超出允许退化比例的阶段说明列表"""
+    regressions = []
+    for stage, current in result["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous:
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            before, after = previous.get(key, 0.0), current.get(key, 0.0)
+            if before > 0 and after > before * (1 + max_regression):
+                regressions.append(f"{stage}.{key}: {before:.2f}ms -> {after:.2f}ms (+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def print_report(result: Dict):
+    run = result["run"]
+    print(f"事件数: {run['events']}  总耗时: {run['wall_seconds']:.2f}s  吞吐量: {run['throughput_eps']:.1f} events/s")
+    if run["timed_out_threads"]:
+        print(f"[WARNING] 有 {run['timed_out_threads']} 个线程在 {THREAD_JOIN_TIMEOUT:.0f}s 内未结束")
+    print(f"发送消息数: {result['sent_messages']}")
+    llm = result.get("llm")
+    if llm:
+        print(f"LLM 请求: {llm['requests']} (完成 {llm['completed']}, 注入错误 {llm['injected_errors']}, "
+              f"中途断开 {llm['disconnects']}, 最大并发 {llm['max_in_flight']})")
+    print(f"{'stage':<20}{'count':>8}{'mean':>10}{'p50':>10}{'p99':>10}{'max':>10}  (ms)")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:<20}{stats['count']:>8}{stats['mean_ms']:>10.2f}{stats['p50_ms']:>10.2f}"
+              f"{stats['p99_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+    if "allocations" in result:
+        alloc = result["allocations"]
+        print(f"内存分配: 峰值 {alloc['peak_kib']:.1f} KiB, 回放后净增 {alloc['net_kib']:.1f} KiB")
+        for line in alloc["top"]:
+            print(f"  {line}")
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="ArcBot 消息管线回放压测")
+    parser.add_argument("--events", default=DEFAULT_EVENTS, help="OneBot 事件 JSONL 文件")
+    parser.add_argument("--repeat", type=int, default=10, help="事件文件重复回放的次数")
+    parser.add_argument("--warmup", type=int, default=1, help="正式计时前的预热轮数")
+    parser.add_argument("--allocations", action="store_true", help="用 tracemalloc 统计内存分配（会拖慢计时）")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="桩服务 SSE 分片间隔（秒）")
+    parser.add_argument("--token-rate", type=float, default=0.0, help="桩服务每秒生成的 token 数，0 表示不限速")
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="桩服务首 token 延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务注入 429/500 错误的概率")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="桩服务流式响应中途断开的概率")
+    parser.add_argument("--output", help="把结果写入 JSON 文件")
+    parser.add_argument("--save-baseline", help="把结果保存为基线文件")
+    parser.add_argument("--baseline", help="与基线比较，超出允许退化比例时返回非零退出码")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="允许的 p50/p99 退化比例")
+    parser.add_argument("--verbose", action="store_true", help="保留管线自身的日志输出")
+    args = parser.parse_args(argv)
+
+    events_path = os.path.abspath(args.events)
+    output_paths = [os.path.abspath(p) if p else None for p in (args.output, args.save_baseline, args.baseline)]
+    events = load_events(events_path)
+
+    server, api_url = start_server(
+        chunk_delay=args.chunk_delay, token_rate=args.token_rate, first_token_latency=args.first_token_latency,
+        error_rate=args.error_rate, disconnect_rate=args.disconnect_rate, seed=0,
+    )
+    workdir = prepare_workdir(api_url)
+    original_cwd = os.getcwd()
+    os.chdir(workdir)
+    tracker = _ThreadTracker()
+    quiet = open(os.devnull, "w", encoding="utf-8")
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(quiet))
+            handle, sent = install_pipeline(tracker)
+            if args.warmup:
+                replay(handle, events, args.warmup, tracker)
+                timings.clear()
+                sent.clear()
+                server.stats.reset()
+
+            if args.allocations:
+                tracemalloc.start()
+                before = tracemalloc.take_snapshot()
+            run = replay(handle, events, args.repeat, tracker)
+            result = {"run": run, "stages": summarize(), "sent_messages": len(sent), "llm": server.stats.snapshot()}
+            if args.allocations:
+                after = tracemalloc.take_snapshot()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                stats = after.compare_to(before, "lineno")
+                result["allocations"] = {
+                    "peak_kib": peak / 1024,
+                    "net_kib": sum(s.size_diff for s in stats) / 1024,
+                    "top": [str(s) for s in stats[:10]],
+                }
+    finally:
+        os.chdir(original_cwd)
+        server.shutdown()
+        quiet.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    output_path, save_baseline_path, baseline_path = output_paths
+    for path in (output_path, save_baseline_path):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if baseline_path:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(result, baseline, args.max_regression)
+        if regressions:
+            print(f"[ERROR] 以下阶段相对基线退化超过 {args.max_regression * 100:.0f}%:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("[INFO] 与基线相比没有明显退化")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,9 +2,9 @@ import json
 import requests
 
 from config import CONFIG
-from utils.files import load_conversation_history, save_conversation_history, get_latest_system_content
+from utils.files import load_conversation_history, save_conversation_history, get_latest_system_content, get_base_system_prompt
 from utils.text import estimate_tokens
-from llm_api import get_ai_response
+from llm_api import get_ai_response, get_ai_completion
 from context_utils import build_context_within_limit
 import utils.role_manager as role_manager
 from utils.notebook import DEFAULT_ROLE_KEY
@@ -51,7 +51,9 @@ def process_conversation(chat_id, user_input, chat_type="private"):
         active_role_name = role_manager.get_active_role(chat_id, chat_type)
         role_key_for_context = active_role_name if active_role_name else DEFAULT_ROLE_KEY
 
-        system_prompt_content = get_latest_system_content(chat_id, chat_type)
+        # 每轮只检索一次笔记，加载历史时复用同一份系统内容
+        latest_system_content = get_latest_system_content(chat_id, chat_type, query=user_input)
+        system_prompt_content = latest_system_content
 
         if active_role_name:
              print(f"[DEBUG] 获取到角色 '{active_role_name}' 的系统内容 (含笔记)")
@@ -87,7 +89,7 @@ def process_conversation(chat_id, user_input, chat_type="private"):
             print(f"[DEBUG] Role was just switched. Starting with clean history for role '{role_key_for_context}'.")
         else:
             # 角色未切换（或切换信号已处理），加载现有历史
-            full_history = load_conversation_history(chat_id, chat_type)
+            full_history = load_conversation_history(chat_id, chat_type, system_content=latest_system_content)
             print(f"[DEBUG] Role not switched or flag already cleared. Loading history for role '{role_key_for_context}'. Total {len(full_history)} messages loaded.")
             # load_conversation_history 内部已确保 system prompt 是最新的
             if not isinstance(full_history, list) or not full_history:
@@ -120,7 +122,8 @@ def process_conversation(chat_id, user_input, chat_type="private"):
         print(f"[DEBUG] 开始调用AI接口")
         for segment in get_ai_response(context_to_send):
             print(f"[DEBUG] 收到AI回复片段: {segment[:100]}...")
-            response_segments.append(segment)
+            if segment:  # 空的 HardBoundary 只是 [send] 断开标记，不计入回复内容
+                response_segments.append(segment)
             yield segment
 
         full_response = "\n".join(response_segments)
@@ -139,3 +142,33 @@ def process_conversation(chat_id, user_input, chat_type="private"):
         print(f"[DEBUG] 已保存对话历史，包含AI回复，标记角色: {role_key_for_context}")
     except Exception as e:
         print(f"[ERROR] 保存对话历史时出错: {e}")
+
+def generate_oneshot(prompt, chat_id=None, chat_type="group", system_prompt=None, max_tokens=120, temperature=None):
+    """
+    轻量的一次性生成，适合接龙打乱等短小的辅助任务。
+    与 process_conversation 不同：不加载也不保存对话历史，不注入笔记、事件和角色切换说明，
+    只带上人设 Prompt（或调用方给出的 system_prompt）和本次 prompt，并限制回复长度。
+
+    参数:
+      prompt: 本次任务的指令
+      chat_id / chat_type: 用于选取当前激活角色的人设；为 None 时不带人设
+      system_prompt: 显式指定的系统提示，优先于人设
+      max_tokens: 回复的最大 token 数
+    返回:
+      去除首尾空白的回复文本；出错时返回空字符串。
+    """
+    if system_prompt is None and chat_id is not None:
+        system_prompt = get_base_system_prompt(chat_id, chat_type)
+
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": prompt})
+
+    try:
+        reply = get_ai_completion(messages, max_tokens=max_tokens, temperature=temperature)
+        print(f"[DEBUG] 一次性生成完成，长度: {len(reply)}")
+        return reply.strip()
+    except Exception as e:
+        print(f"[ERROR] 一次性生成失败: {e}")
+        return ""
@@ -2,6 +2,7 @@ import json
 import requests
 import base64
 from config import CONFIG
+from utils.segment_batcher import HardBoundary
 
 def get_ai_response(conversation):
     """
@@ -69,7 +70,9 @@ def get_ai_response(conversation):
 
                     if "[send]" in buffer:
                         part, buffer = buffer.split("[send]", 1)
-                        part_to_yield = part.strip()
+                        # [send] 处必须断开，不与后续分段合并；
+                        # [send] 前的内容已随换行发出时 part 为空，仍需发出空的 HardBoundary 作为断开标记
+                        part_to_yield = HardBoundary(part.strip())
                         processed_something = True
                     elif "\n" in buffer:
                         potential_part = buffer.split("\n", 1)[0]
@@ -95,6 +98,9 @@ def get_ai_response(conversation):
                          if part_to_yield:
                             print(f"[DEBUG] 发送回复片段: {part_to_yield[:50]}...")
                             yield part_to_yield
+                         elif isinstance(part_to_yield, HardBoundary):
+                            print("[DEBUG] 发送 [send] 断开标记")
+                            yield part_to_yield
                     elif not processed_something:
                         break
         elif line == "[DONE]":
@@ -109,6 +115,41 @@ def get_ai_response(conversation):
     
     print("[DEBUG] AI接口调用完成")
 
+def get_ai_completion(messages, max_tokens=None, temperature=None, timeout=30):
+    """
+    非流式调用 AI 接口，一次性返回完整回复文本，适合短小的一次性任务。
+    参数:
+      messages: 对话消息列表
+      max_tokens: 回复的最大 token 数，None 表示使用接口默认值
+      temperature: 采样温度，None 表示使用接口默认值
+      timeout: 请求超时时间（秒）
+    返回:
+      回复文本；如果遇到错误则抛出异常。
+    """
+    headers = {
+        "Authorization": f"Bearer {CONFIG['ai']['token']}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": CONFIG["ai"]["model"],
+        "messages": messages,
+        "stream": False
+    }
+    if max_tokens is not None:
+        payload["max_tokens"] = max_tokens
+    if temperature is not None:
+        payload["temperature"] = temperature
+
+    response = requests.post(CONFIG["ai"]["api_url"], headers=headers, json=payload, timeout=timeout)
+    if response.status_code != 200:
+        error_msg = f"AI接口调用失败, 状态码：{response.status_code}, {response.text}"
+        print(f"[ERROR] {error_msg}")
+        raise Exception(error_msg)
+
+    data = response.json()
+    content = data.get("choices", [{}])[0].get("message", {}).get("content") or ""
+    return content.replace("\r\n", "\n")
+
 def get_ai_response_with_image(conversation, image=None, image_type="url"):
     """
     自动判断API类型：
@@ -1,5 +1,6 @@
 from logger import init_db
 from napcat.post import init_ws
+from napcat.message_sender import WebSocketSender
 from utils.group_activity import group_activity_manager
 from llm import process_conversation
 import time
@@ -19,7 +20,7 @@ def main():
     
     # 初始化群活跃度管理器
     print("🚀 初始化群活跃度管理器...")
-    group_activity_manager.init_process_conversation(process_conversation)
+    group_activity_manager.init_process_conversation(process_conversation, sender=WebSocketSender())
     
     print("✅ 初始化完成，主程序运行中...")
     while True:
@@ -1,6 +1,5 @@
 import time
 import threading
-import random
 import re
 import asyncio
 from typing import List
@@ -9,36 +8,17 @@ from collections import deque
 from config import CONFIG
 from llm import process_conversation
 from logger import log_message
-from utils.blacklist import is_blacklisted
+from utils.access_control import check_access
 from utils.text import extract_text_from_message
-from utils.whitelist import is_whitelisted
 from napcat.message_sender import IMessageSender
 from napcat.message_types import MessageSegment
 from utils.message_content import parse_group_message_content
 from utils.ai_message_parser import parse_ai_message_to_segments
+from utils.segment_batcher import batch_segments, typing_delay
 from utils.group_activity import group_activity_manager
-from . import post
 from utils.dragon_handler import update_message_history, handle_dragon_logic
 
 
-def check_access(sender_id, is_group=False):
-    """
-    根据配置的名单模式过滤消息：
-      - 黑名单模式：如果目标在黑名单中，则返回 False
-      - 白名单模式：如果目标不在白名单中，则返回 False
-      - 其它情况返回 True
-    参数 is_group 为 True 时，表示检查群聊名单，False 时为用户消息名单
-    """
-    mode_key = "group_list_mode" if is_group else "qq_list_mode"
-    if CONFIG["debug"]: print(f"检查 {mode_key} 模式")
-    mode = CONFIG["qqbot"].get(mode_key, "black").lower()
-    if CONFIG["debug"]: print(f"当前模式: {mode}")
-    if mode == "black":
-        return not is_blacklisted(sender_id, is_group)
-    elif mode == "white":
-        return is_whitelisted(sender_id, is_group)
-    return True
-
 def handle_private_message(msg_dict, sender: IMessageSender):
     """
     处理私聊消息：
@@ -68,9 +48,10 @@ def handle_private_message(msg_dict, sender: IMessageSender):
 
         # 异步处理回复消息，实现流式发送效果
         async def process_and_send():
-            for segment in process_conversation(user_id, content_with_time, chat_type="private"):
+            # 合并连续的短分段，减少发送次数和打字等待
+            for segment in batch_segments(process_conversation(user_id, content_with_time, chat_type="private")):
                 sender.set_input_status(user_id)
-                time.sleep(random.uniform(1.0, 3.0))
+                time.sleep(typing_delay())
                 msg_segments = await parse_ai_message_to_segments(
                     segment, 
                     message_id,
@@ -176,7 +157,8 @@ async def handle_group_message(msg_dict, sender: IMessageSender):
         # 异步处理回复消息，实现流式发送效果
         try:
             # 使用 ai_input_content 作为 AI 输入
-            for segment_text in process_conversation(group_id, ai_input_content, chat_type="group"):
+            # 合并连续的短分段，减少发送次数和打字等待
+            for segment_text in batch_segments(process_conversation(group_id, ai_input_content, chat_type="group")):
                 try:
                     print(f"[DEBUG] 收到AI回复片段: {segment_text}")
                     msg_segments = await parse_ai_message_to_segments(
@@ -196,10 +178,10 @@ async def handle_group_message(msg_dict, sender: IMessageSender):
                         else:
                             non_poke_segments.append(seg)
 
-                    # 立即执行所有戳一戳动作
+                    # 先发送所有戳一戳动作（与消息一样经过出站限速）
                     for poke_group_id, poke_user_id in poke_actions:
                         try:
-                            post.send_poke(poke_group_id, poke_user_id)
+                            sender.send_poke(int(poke_group_id), int(poke_user_id))
                         except Exception as poke_err:
                             print(f"[ERROR] 发送戳一戳失败: {poke_err}")
 
@@ -207,7 +189,7 @@ async def handle_group_message(msg_dict, sender: IMessageSender):
                     if non_poke_segments:
                         print(f"[DEBUG] 发送非戳一戳消息片段到群 {group_id}")
                         sender.send_group_msg(int(group_id), non_poke_segments)
-                        await asyncio.sleep(random.uniform(1.0, 3.0)) # 模拟打字延迟
+                        await asyncio.sleep(typing_delay()) # 模拟打字延迟
 
                 except Exception as e:
                     print(f"[ERROR] 处理群消息段时出错: {e}")
@@ -3,12 +3,14 @@ import os
 from config import CONFIG, save_config
 from utils.blacklist import add_blacklist, remove_blacklist
 from utils.files import get_history_file
-from utils.text import extract_text_from_message
 from utils.whitelist import add_whitelist, remove_whitelist
+from utils.notebook import notebook, DEFAULT_ROLE_KEY
 from napcat.message_sender import IMessageSender
+from napcat.command_registry import CommandContext, CommandRegistry
+from napcat.rate_limiter import PRIORITY_COMMAND, outbound_limiter
 import utils.role_manager as role_manager
 from typing import Dict, Any
-from napcat.post import get_friend_list, FRIEND_LIST
+from napcat.friend_cache import friend_cache
 
 # 角色添加状态跟踪
 # key: (user_id: str, chat_id: str), value: Dict[str, Any] (e.g., {'state': 'awaiting_prompt', 'type': 'private'})
@@ -22,52 +24,38 @@ def send_reply(msg_dict, reply, sender: IMessageSender):
     根据消息类型构造回复 payload 并发送回复消息。
     """
     if msg_dict.get("message_type") == "private":
-        sender.send_private_msg(int(msg_dict["sender"]["user_id"]), reply)
+        sender.send_private_msg(int(msg_dict["sender"]["user_id"]), reply, priority=PRIORITY_COMMAND)
     else:
-        sender.send_group_msg(int(msg_dict.get("group_id")), reply)
+        sender.send_group_msg(int(msg_dict.get("group_id")), reply, priority=PRIORITY_COMMAND)
+
+
+# 命令注册表：新增命令只需用 @registry.command 注册处理函数
+registry = CommandRegistry(send_reply)
 
 
 def process_command(msg_dict, sender: IMessageSender):
-    text = extract_text_from_message(msg_dict)
-    sender_qq = str(msg_dict["sender"]["user_id"])
-    admin_qq_list = CONFIG["qqbot"].get("admin_qq", [])
-
-    if text.startswith("/arcreset"):
-        return process_reset_command(msg_dict, sender)
-    elif text.startswith("/archelp"):
-        return process_help_command(msg_dict, sender)
-    elif text.startswith("/arcblack") or text.startswith("/arcwhite"):
-        return process_listmod_command(msg_dict, sender)
-    elif text.startswith("/arcqqlist"):
-        return process_msg_list_command(msg_dict, sender)
-    elif text.startswith("/arcgrouplist"):
-        return process_group_list_command(msg_dict, sender)
-    elif text.startswith("/role"):
-        # 在处理 /role 命令之前，确保好友列表已加载（如果功能开启）
-        if ROLE_FRIENDS_ONLY and not FRIEND_LIST:
-            # 尝试自动更新一次，如果管理员开启了这个功能但列表为空
-            if sender_qq in admin_qq_list: # 仅管理员触发自动更新
-                get_friend_list()
-                send_reply(msg_dict, "检测到好友限制已开启但列表为空，已尝试自动更新好友列表。请稍后再试。", sender)
-            else:
-                send_reply(msg_dict, "好友列表尚未加载，请稍后重试或联系管理员使用 /updatefriends 更新列表。", sender)
-            return True
-        
-        # 原有的 /role 路由逻辑
-        tokens = text.split()
-        sub_command = tokens[1].lower() if len(tokens) > 1 else "list"
-        if sub_command in ["pending", "approve", "reject"]:
-            return process_role_admin_command(msg_dict, sender)
+    """按命令注册表路由消息，返回消息是否已被当作命令处理"""
+    return registry.dispatch(msg_dict, sender)
+
+
+def _ensure_friend_list_for_role(ctx: CommandContext, sender: IMessageSender) -> bool:
+    """
+    /role 系列命令的前置检查：好友限制开启但好友列表为空时尝试更新并提示用户。
+    返回 False 表示已回复提示，命令不再继续处理。
+    """
+    if ROLE_FRIENDS_ONLY and not friend_cache.loaded:
+        # 尝试自动更新一次，如果管理员开启了这个功能但列表为空
+        if ctx.is_admin: # 仅管理员触发自动更新
+            friend_cache.request_refresh()
+            send_reply(ctx.msg_dict, "检测到好友限制已开启但列表为空，已尝试自动更新好友列表。请稍后再试。", sender)
         else:
-            return process_role_command(msg_dict, sender) # 普通用户的 /role 命令
-    elif text.startswith("/rolefriendonly"):
-        return process_role_friend_only_command(msg_dict, sender)
-    elif text.startswith("/updatefriends"):
-        return process_update_friends_command(msg_dict, sender)
-    return False
+            send_reply(ctx.msg_dict, "好友列表尚未加载，请稍后重试或联系管理员使用 /updatefriends 更新列表。", sender)
+        return False
+    return True
 
 
-def process_help_command(msg_dict, sender: IMessageSender):
+@registry.command("/archelp")
+def process_help_command(ctx: CommandContext, sender: IMessageSender):
     """
     处理菜单指令 /archelp，显示管理员相关命令使用方法：
     """
@@ -84,35 +72,31 @@ def process_help_command(msg_dict, sender: IMessageSender):
         "=====名单模式切换=====\n"
         "| /arcqqlist [white/black] - 切换QQ名单模式\n"
         "| /arcgrouplist [white/black] - 切换群聊名单模式\n"
+        "=====笔记管理=====\n"
+        "| /notepin [笔记ID] [角色] - 置顶笔记，按需检索时始终注入\n"
+        "| /noteunpin [笔记ID] [角色] - 取消置顶笔记\n"
+        "| /notestats - 查看笔记按需检索的统计\n"
+        "=====运行状态=====\n"
+        "| /ratestats - 查看出站消息限速队列的统计\n"
     )
 
-    send_reply(msg_dict, help_text, sender)
+    send_reply(ctx.msg_dict, help_text, sender)
     return True
 
 
-def process_reset_command(msg_dict, sender: IMessageSender):
+@registry.command("/arcreset")
+def process_reset_command(ctx: CommandContext, sender: IMessageSender):
     """
     处理 /arcreset 命令：
       - 私聊：任何人发送 /arcreset 重置自己的对话记录
       - 群聊：必须以 "/arcreset [群号]" 形式，并且只有管理员（admin_qq）才能重置对应群组记录
-    执行后回复提示信息，并返回 True；若不是 /arcreset 命令返回 False。
+    执行后回复提示信息，并返回 True。
     """
-    # 私聊消息中文本来自 message 数组；群聊直接取 raw_message
-    if msg_dict.get("message_type") == "group":
-        text = msg_dict.get("raw_message", "")
-    else:
-        text = "".join(
-            seg.get("data", {}).get("text", "")
-            for seg in msg_dict.get("message", [])
-            if seg.get("type") == "text"
-        )
-
-    sender_qq = str(msg_dict["sender"]["user_id"])
-    if msg_dict.get("message_type") == "group":
-        tokens = text.split()
+    tokens = ctx.tokens
+    if ctx.msg_dict.get("message_type") == "group":
         if len(tokens) >= 2:
             target_group = tokens[1].strip()
-            if sender_qq not in CONFIG["qqbot"].get("admin_qq", []):
+            if not ctx.is_admin:
                 reply = "只有管理员才能重置群聊记录。"
             else:
                 history_file = get_history_file(target_group, chat_type="group")
@@ -125,18 +109,20 @@ def process_reset_command(msg_dict, sender: IMessageSender):
             reply = "命令格式错误，请使用：/arcreset [群号]"
     else:
         # 私聊重置自己的聊天记录
-        history_file = get_history_file(sender_qq, chat_type="private")
+        history_file = get_history_file(ctx.sender_qq, chat_type="private")
         if os.path.exists(history_file):
             os.remove(history_file)
             reply = "你的聊天记录已重置。"
         else:
             reply = "你没有聊天记录。"
 
-    send_reply(msg_dict, reply, sender)
+    send_reply(ctx.msg_dict, reply, sender)
     return True
 
 
-def process_listmod_command(msg_dict, sender: IMessageSender):
+@registry.command("/arcblack", admin_only=True)
+@registry.command("/arcwhite", admin_only=True)
+def process_listmod_command(ctx: CommandContext, sender: IMessageSender):
     """
     处理黑白名单管理相关指令：
       命令格式统一支持两类对象：QQ 或 群
@@ -150,24 +136,13 @@ def process_listmod_command(msg_dict, sender: IMessageSender):
       "msg" 表示用户消息黑白名单，
       "group" 表示群聊黑白名单。
       
-      仅允许配置中的 admin_qq 执行相关命令。命令处理完毕后直接回复提示信息，并返回 True；
-      如果不是名单管理命令，则返回 False。
+      仅允许配置中的 admin_qq 执行相关命令（由命令注册表校验）。命令处理完毕后直接回复提示信息，并返回 True。
     """
-    text = extract_text_from_message(msg_dict)
-    sender_qq = str(msg_dict["sender"]["user_id"])
     reply = None
-    admin_list = CONFIG["qqbot"].get("admin_qq", [])
-
-    # 判断管理员权限
-    if sender_qq not in admin_list:
-        reply = "无权限执行该命令。"
-        send_reply(msg_dict, reply, sender)
-        return True
-
-    tokens = text.split()
+    tokens = ctx.tokens
     if len(tokens) < 4:
         reply = "命令格式错误，请使用：/arcblack add/remove [QQ/Q群] [msg/group] 或 /arcwhite add/remove [QQ/Q群] [msg/group]"
-        send_reply(msg_dict, reply, sender)
+        send_reply(ctx.msg_dict, reply, sender)
         return True
     # tokens[0] 为命令，如 /arcblack 或 /arcwhite
     # tokens[1] 为 add 或 remove
@@ -177,7 +152,7 @@ def process_listmod_command(msg_dict, sender: IMessageSender):
     list_type = tokens[3].lower()
 
     # 根据命令分支和名单类型选择处理逻辑：
-    if text.startswith("/arcblack"):
+    if ctx.command == "/arcblack":
         if tokens[1].lower() == "add":
             if list_type == "msg":
                 if add_blacklist(target_id, is_group=False):
@@ -207,7 +182,7 @@ def process_listmod_command(msg_dict, sender: IMessageSender):
         else:
             reply = "无效的命令操作，请使用 add 或 remove。"
 
-    elif text.startswith("/arcwhite"):
+    elif ctx.command == "/arcwhite":
         if tokens[1].lower() == "add":
             if list_type == "msg":
                 if add_whitelist(target_id, is_group=False):
@@ -239,20 +214,19 @@ def process_listmod_command(msg_dict, sender: IMessageSender):
     else:
         reply = "无效的命令。"
 
-    send_reply(msg_dict, reply, sender)
+    send_reply(ctx.msg_dict, reply, sender)
     return True
 
 
-def process_msg_list_command(msg_dict, sender: IMessageSender):
+@registry.command("/arcqqlist", admin_only=True)
+def process_msg_list_command(ctx: CommandContext, sender: IMessageSender):
     """
     处理修改用户消息名单模式指令：
       - /arcqqlist [white/black]
       
-    仅允许管理员执行，命令处理后直接回复提示信息，并返回 True；
-    如果不是该命令，则返回 False。
+    仅允许管理员执行，命令处理后直接回复提示信息，并返回 True。
     """
-    text = extract_text_from_message(msg_dict)
-    tokens = text.split()
+    tokens = ctx.tokens
     if len(tokens) < 2 or tokens[1].lower() not in ("white", "black"):
         reply = "命令格式错误，请使用：/arcqqlist [white/black]"
     else:
@@ -262,19 +236,18 @@ def process_msg_list_command(msg_dict, sender: IMessageSender):
         save_config()
         reply = f"私聊名单模式已切换为 {new_mode}。"
     
-    send_reply(msg_dict, reply, sender)
+    send_reply(ctx.msg_dict, reply, sender)
     return True
 
-def process_group_list_command(msg_dict, sender: IMessageSender):
+@registry.command("/arcgrouplist", admin_only=True)
+def process_group_list_command(ctx: CommandContext, sender: IMessageSender):
     """
     处理修改群聊名单模式指令：
       - /arcgrouplist [white/black]
       
-    仅允许管理员执行，命令处理后直接回复提示信息，并返回 True；
-    如果不是该命令，则返回 False。
+    仅允许管理员执行，命令处理后直接回复提示信息，并返回 True。
     """
-    text = extract_text_from_message(msg_dict)
-    tokens = text.split()
+    tokens = ctx.tokens
     if len(tokens) < 2 or tokens[1].lower() not in ("white", "black"):
         reply = "命令格式错误，请使用：/arcgrouplist [white/black]"
     else:
@@ -284,29 +257,31 @@ def process_group_list_command(msg_dict, sender: IMessageSender):
         save_config()
         reply = f"群聊名单模式已切换为 {new_mode}。"
     
-    send_reply(msg_dict, reply, sender)
+    send_reply(ctx.msg_dict, reply, sender)
     return True
 
-def process_role_command(msg_dict, sender: IMessageSender):
+@registry.command("/role")
+def process_role_command(ctx: CommandContext, sender: IMessageSender):
     """
     处理用户 /role 相关命令 (非管理员)
     """
-    global ROLE_FRIENDS_ONLY, FRIEND_LIST, user_add_role_state
-    sender_qq = str(msg_dict["sender"]["user_id"])
+    global ROLE_FRIENDS_ONLY, user_add_role_state
+    if not _ensure_friend_list_for_role(ctx, sender):
+        return True
+    msg_dict = ctx.msg_dict
+    sender_qq = ctx.sender_qq
 
     # 好友校验逻辑放在最前面
-    if ROLE_FRIENDS_ONLY and sender_qq not in FRIEND_LIST:
+    if ROLE_FRIENDS_ONLY and sender_qq not in friend_cache:
         if sender_qq not in CONFIG["qqbot"].get("whitelist", []):
              send_reply(msg_dict, "这个功能只对已经添加我好友的人开放喵。", sender)
              return True
     
-    text = extract_text_from_message(msg_dict).strip() # 获取纯文本命令
-    sender_info = msg_dict["sender"]
-    user_id = str(sender_info["user_id"])
+    user_id = ctx.sender_qq
     message_type = msg_dict.get("message_type")
     chat_id = str(msg_dict.get("group_id") if message_type == "group" else user_id)
 
-    tokens = text.split()
+    tokens = ctx.tokens
     # 第一个 token 应该是 /role, 第二个是子命令 (如果存在)
     sub_command = tokens[1].lower() if len(tokens) > 1 else "list" # 默认为 list
 
@@ -376,24 +351,15 @@ def process_role_command(msg_dict, sender: IMessageSender):
     return True # 表示命令已被处理
 
 # +++ 新增管理员审核处理函数 +++
-def process_role_admin_command(msg_dict, sender: IMessageSender):
-    """处理 /role pending, approve, reject 命令"""
-    text = extract_text_from_message(msg_dict).strip()
-    sender_info = msg_dict["sender"]
-    user_id = str(sender_info["user_id"])
-    message_type = msg_dict.get("message_type")
-    chat_id = str(msg_dict.get("group_id") if message_type == "group" else user_id)
-
-    # 检查管理员权限
-    admin_qq_list = CONFIG["qqbot"].get("admin_qq", [])
-    if user_id not in admin_qq_list:
-        send_reply(msg_dict, "抱歉，只有管理员才能执行此操作喵。", sender)
-        return True # 明确拒绝
-
-    tokens = text.split()
-    if len(tokens) < 2:
-        send_reply(msg_dict, "无效的管理命令。请使用 /role pending, /role approve <ID>, 或 /role reject <ID>", sender)
+@registry.command("/role pending", admin_only=True)
+@registry.command("/role approve", admin_only=True)
+@registry.command("/role reject", admin_only=True)
+def process_role_admin_command(ctx: CommandContext, sender: IMessageSender):
+    """处理 /role pending, approve, reject 命令（管理员权限由命令注册表校验）"""
+    if not _ensure_friend_list_for_role(ctx, sender):
         return True
+    msg_dict = ctx.msg_dict
+    tokens = ctx.tokens
 
     admin_sub_command = tokens[1].lower()
     reply = ""
@@ -422,9 +388,9 @@ def process_role_admin_command(msg_dict, sender: IMessageSender):
                     requester_chat_type = approved_info.get("requester_chat_type")
                     requester_chat_id = approved_info.get("requester_chat_id")
                     if requester_chat_type == "private":
-                        sender.send_private_msg(int(requester_chat_id), notify_msg)
+                        sender.send_private_msg(int(requester_chat_id), notify_msg, priority=PRIORITY_COMMAND)
                     elif requester_chat_type == "group":
-                        sender.send_group_msg(int(requester_chat_id), notify_msg)
+                        sender.send_group_msg(int(requester_chat_id), notify_msg, priority=PRIORITY_COMMAND)
                 except Exception as notify_err:
                     print(f"[WARN] 批准角色后通知申请人失败: {notify_err}")
             elif approved_info:
@@ -446,10 +412,10 @@ def process_role_admin_command(msg_dict, sender: IMessageSender):
                     requester_chat_type = rejected_info.get("requester_chat_type")
                     requester_chat_id = rejected_info.get("requester_chat_id")
                     if requester_chat_type == "private":
-                        sender.send_private_msg(int(requester_chat_id), notify_msg)
+                        sender.send_private_msg(int(requester_chat_id), notify_msg, priority=PRIORITY_COMMAND)
                     elif requester_chat_type == "group":
                          # 在群里通知有点奇怪，可以选择私聊通知申请人
-                         sender.send_private_msg(int(rejected_info.get("requester_user_id")), notify_msg)
+                         sender.send_private_msg(int(rejected_info.get("requester_user_id")), notify_msg, priority=PRIORITY_COMMAND)
                 except Exception as notify_err:
                     print(f"[WARN] 拒绝角色后通知申请人失败: {notify_err}")
             else:
@@ -462,21 +428,14 @@ def process_role_admin_command(msg_dict, sender: IMessageSender):
 
     return True # 表示命令已被处理
 
-def process_role_friend_only_command(msg_dict, sender: IMessageSender):
+@registry.command("/rolefriendonly", admin_only=True)
+def process_role_friend_only_command(ctx: CommandContext, sender: IMessageSender):
     """
     处理 /rolefriendonly [on/off] 命令，切换 /role 命令是否仅好友可用。
     仅限管理员。
     """
     global ROLE_FRIENDS_ONLY
-    text = extract_text_from_message(msg_dict).strip()
-    sender_qq = str(msg_dict["sender"]["user_id"])
-    admin_qq_list = CONFIG["qqbot"].get("admin_qq", [])
-
-    if sender_qq not in admin_qq_list:
-        send_reply(msg_dict, "抱歉，您没有权限执行此命令。", sender)
-        return True
-
-    tokens = text.split()
+    tokens = ctx.tokens
     reply_text = ""
 
     if len(tokens) == 2:
@@ -485,8 +444,8 @@ def process_role_friend_only_command(msg_dict, sender: IMessageSender):
             ROLE_FRIENDS_ONLY = True
             reply_text = "`/role` 命令已设置为仅好友可用喵。"
             # 如果开启，尝试获取一次好友列表
-            if not FRIEND_LIST:
-                get_friend_list() # 发起获取好友列表的请求
+            if not friend_cache.loaded:
+                friend_cache.request_refresh() # 发起获取好友列表的请求（不阻塞）
                 reply_text += "\n正在尝试获取好友列表，请稍后检查 `/updatefriends` 的输出或直接使用 `/role`。"
         elif mode == "off":
             ROLE_FRIENDS_ONLY = False
@@ -497,19 +456,89 @@ def process_role_friend_only_command(msg_dict, sender: IMessageSender):
         current_status = "开启" if ROLE_FRIENDS_ONLY else "关闭"
         reply_text = f"当前 `/role` 命令好友限制状态：{current_status}。\n使用 `/rolefriendonly on` 或 `/rolefriendonly off` 进行更改。"
 
-    send_reply(msg_dict, reply_text, sender)
+    send_reply(ctx.msg_dict, reply_text, sender)
     return True
 
-def process_update_friends_command(msg_dict, sender: IMessageSender):
+@registry.command("/updatefriends", admin_only=True)
+def process_update_friends_command(ctx: CommandContext, sender: IMessageSender):
     """
-    处理 /updatefriends 命令，手动触发更新好友列表。
+    处理 /updatefriends 命令，手动触发更新好友列表（仅限管理员）。
     """
-    sender_qq = str(msg_dict["sender"]["user_id"])
-    admin_qq_list = CONFIG["qqbot"].get("admin_qq", [])
-        
-    get_friend_list() # 调用 post.py 中的函数
-    reply_text = "更新好了喵。"
-    if FRIEND_LIST:
-        reply_text += f"\n当前已缓存 {len(FRIEND_LIST)} 个好友。"
-    send_reply(msg_dict, reply_text, sender)
-    return True
\ No newline at end of file
+    def on_refreshed(friends, error):
+        if error is not None:
+            send_reply(ctx.msg_dict, f"更新好友列表失败：{error}。\n当前仍使用已缓存的 {len(friend_cache)} 个好友。", sender)
+            return
+        send_reply(ctx.msg_dict, f"更新好了喵。\n当前已缓存 {len(friends)} 个好友。", sender)
+
+    # 异步刷新，好友列表返回后再回复，不阻塞消息处理
+    friend_cache.request_refresh(callback=on_refreshed)
+    return True
+
+
+@registry.command("/notepin", admin_only=True)
+@registry.command("/noteunpin", admin_only=True)
+def process_note_pin_command(ctx: CommandContext, sender: IMessageSender):
+    """
+    处理 /notepin 和 /noteunpin [笔记ID] [角色] 命令，置顶或取消置顶笔记（仅限管理员）。
+    不指定角色时操作全局笔记。
+    """
+    tokens = ctx.tokens
+    pinned = ctx.command == "/notepin"
+    if len(tokens) < 2 or not tokens[1].isdigit():
+        send_reply(ctx.msg_dict, f"命令格式错误，请使用：{ctx.command} [笔记ID] [角色]", sender)
+        return True
+
+    note_id = int(tokens[1])
+    role = " ".join(tokens[2:]) or DEFAULT_ROLE_KEY
+    role_display = "全局" if role == DEFAULT_ROLE_KEY else role
+    action = "置顶" if pinned else "取消置顶"
+    if notebook.pin_note(note_id, role=role, pinned=pinned):
+        reply = f"已{action}{role_display}笔记 (ID: {note_id})。"
+    else:
+        reply = f"未找到{role_display}笔记 (ID: {note_id})。"
+    send_reply(ctx.msg_dict, reply, sender)
+    return True
+
+
+@registry.command("/notestats", admin_only=True)
+def process_note_stats_command(ctx: CommandContext, sender: IMessageSender):
+    """
+    处理 /notestats 命令，回复笔记按需检索的累计统计（仅限管理员）。
+    """
+    stats = notebook.retrieval_stats
+    if not stats["requests"]:
+        reply = "暂无笔记检索记录（notebook.retrieval_mode 需设置为 relevant）。"
+    else:
+        saved_ratio = stats["tokens_saved"] / stats["tokens_full"] * 100 if stats["tokens_full"] else 0.0
+        reply = (
+            "笔记检索统计\n"
+            f"| 检索次数：{stats['requests']}\n"
+            f"| 注入笔记：{stats['notes_injected']}/{stats['notes_total']} 条\n"
+            f"| 注入 tokens：{stats['tokens_injected']}/{stats['tokens_full']}\n"
+            f"| 累计节省：{stats['tokens_saved']} tokens ({saved_ratio:.1f}%)"
+        )
+    send_reply(ctx.msg_dict, reply, sender)
+    return True
+
+
+@registry.command("/ratestats", admin_only=True)
+def process_rate_stats_command(ctx: CommandContext, sender: IMessageSender):
+    """
+    处理 /ratestats 命令，回复出站限速队列的长度、丢弃数和各优先级的排队时间（仅限管理员）。
+    """
+    if not outbound_limiter.enabled:
+        send_reply(ctx.msg_dict, "出站限速未启用（qqbot.rate_limit.enabled）。", sender)
+        return True
+    stats = outbound_limiter.get_stats()
+    lines = [
+        "出站限速统计",
+        f"| 当前排队：{stats['queue_size']} 条",
+        f"| 已丢弃主动消息：{stats['dropped']} 条",
+    ]
+    for name, queue_time in stats["queue_time"].items():
+        lines.append(
+            f"| {name}：{queue_time['count']} 条，排队 平均 {queue_time['avg']:.2f}s / "
+            f"p50 {queue_time['p50']:.2f}s / p99 {queue_time['p99']:.2f}s / 最长 {queue_time['max']:.2f}s"
+        )
+    send_reply(ctx.msg_dict, "\n".join(lines), sender)
+    return True
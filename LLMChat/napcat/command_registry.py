@@ -0,0 +1,98 @@
+"""
+命令注册表
+- 命令名（可以包含子命令，如 "/role approve"）存放在字符前缀树中，路由只需按字符走一遍命令前缀
+- 总是选择最长的匹配，并且要求命令名后面是空白或消息结尾，/role 不会再遮挡 /rolefriendonly
+- 每条命令带权限元数据，admin_only 的命令在调用处理函数之前统一校验
+- 消息文本只提取、切分一次，通过 CommandContext 传给处理函数
+"""
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from config import CONFIG
+from utils.text import extract_text_from_message
+
+
+class CommandContext(NamedTuple):
+    msg_dict: dict
+    text: str  # 去除首尾空白后的纯文本消息
+    tokens: List[str]  # text.split() 的结果，tokens[0] 为命令本身
+    command: str  # 匹配到的命令名
+    sender_qq: str
+    is_admin: bool
+
+
+class CommandSpec(NamedTuple):
+    name: str
+    handler: Callable
+    admin_only: bool
+    description: str
+
+
+class _TrieNode:
+    __slots__ = ("children", "spec")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.spec: Optional[CommandSpec] = None
+
+
+class CommandRegistry:
+    def __init__(self, reply_func: Callable, denied_reply: str = "无权限执行该命令。"):
+        # reply_func(msg_dict, reply, sender)：用于回复权限不足等提示
+        self.reply_func = reply_func
+        self.root = _TrieNode()
+        self.commands: Dict[str, CommandSpec] = {}
+        # 最长命令名包含的单词数，匹配时只需拼接消息开头的这几个 token
+        self.max_words = 1
+        self.denied_reply = denied_reply
+
+    def register(self, name: str, handler: Callable, admin_only: bool = False, description: str = ""):
+        """注册命令；name 中的多个单词用单个空格分隔，匹配时不区分大小写"""
+        name = " ".join(name.lower().split())
+        if name in self.commands:
+            raise ValueError(f"命令 {name} 重复注册")
+        spec = CommandSpec(name, handler, admin_only, description)
+        node = self.root
+        for char in name:
+            node = node.children.setdefault(char, _TrieNode())
+        node.spec = spec
+        self.commands[name] = spec
+        self.max_words = max(self.max_words, name.count(" ") + 1)
+        return spec
+
+    def command(self, name: str, admin_only: bool = False, description: str = ""):
+        """装饰器形式的 register"""
+        def decorator(handler: Callable):
+            self.register(name, handler, admin_only, description)
+            return handler
+        return decorator
+
+    def match(self, normalized_text: str) -> Optional[CommandSpec]:
+        """返回与文本开头匹配的最长命令；normalized_text 需为单空格分隔的小写文本"""
+        node = self.root
+        best = None
+        length = len(normalized_text)
+        for i, char in enumerate(normalized_text):
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.spec is not None and (i + 1 == length or normalized_text[i + 1] == " "):
+                best = node.spec
+        return best
+
+    def dispatch(self, msg_dict: dict, sender) -> bool:
+        """匹配并执行命令，返回消息是否已被当作命令处理"""
+        text = extract_text_from_message(msg_dict).strip()
+        if not text.startswith("/"):
+            return False
+        tokens = text.split()
+        spec = self.match(" ".join(tokens[:self.max_words]).lower())
+        if spec is None:
+            return False
+
+        sender_qq = str(msg_dict["sender"]["user_id"])
+        is_admin = sender_qq in CONFIG["qqbot"].get("admin_qq", [])
+        ctx = CommandContext(msg_dict, text, tokens, spec.name, sender_qq, is_admin)
+        if spec.admin_only and not is_admin:
+            self.reply_func(msg_dict, self.denied_reply, sender)
+            return True
+        return spec.handler(ctx, sender)
@@ -0,0 +1,160 @@
+"""
+好友列表缓存
+- 好友 QQ 号保存在 frozenset 中，任何线程都可以无锁、O(1) 地判断某人是否为好友
+- 通过 WebSocket 发送 get_friend_list 请求后立即返回，响应到达时由 post.on_message 交给缓存更新
+- 后台线程定期刷新；WebSocket 连接建立、收到 friend_add 通知时也会触发刷新
+"""
+import random
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from config import CONFIG
+
+ECHO_PREFIX = "friend_cache_"
+
+# 刷新请求发出后多久未收到响应视为超时（秒）
+REQUEST_TIMEOUT = 30.0
+
+# 刷新结束回调，参数为 (最新的好友 QQ 号列表, 失败原因)；成功时失败原因为 None，失败或超时时好友列表为 None
+RefreshCallback = Callable[[Optional[List[str]], Optional[str]], None]
+
+
+class FriendListCache:
+    def __init__(self, refresh_interval: float = 1800.0):
+        self.refresh_interval = refresh_interval
+        # 整体替换而不是原地修改，读取方无需加锁
+        self._friends: frozenset = frozenset()
+        self.loaded = False
+        self.updated_at = 0.0
+        # echo -> (发出时间, 回调列表)
+        self._pending: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+
+    def __contains__(self, user_id) -> bool:
+        return str(user_id) in self._friends
+
+    def __len__(self) -> int:
+        return len(self._friends)
+
+    def snapshot(self) -> frozenset:
+        return self._friends
+
+    def request_refresh(self, callback: Optional[RefreshCallback] = None) -> Optional[str]:
+        """
+        发出一次异步刷新请求并立即返回 echo。
+        已有未超时的请求在途时不重复发送，callback 会挂到该请求上。
+        无论成功、失败还是超时，callback 都会被调用一次。
+        """
+        from napcat import post
+
+        now = time.time()
+        expired = []
+        in_flight = None
+        with self._lock:
+            for echo, (sent_at, callbacks) in list(self._pending.items()):
+                if now - sent_at > REQUEST_TIMEOUT:
+                    expired.append((echo, self._pending.pop(echo)[1]))
+                elif in_flight is None:
+                    in_flight = echo
+                    if callback:
+                        callbacks.append(callback)
+            if in_flight is None:
+                echo = f"{ECHO_PREFIX}{now}_{random.randint(0, 100000)}"
+                self._pending[echo] = (now, [callback] if callback else [])
+
+        for expired_echo, callbacks in expired:
+            self._fail(expired_echo, callbacks, "请求超时")
+        if in_flight is not None:
+            return in_flight
+
+        # 响应一直不到（如 WebSocket 未连接）时也要按时通知回调
+        timer = threading.Timer(REQUEST_TIMEOUT, self._expire, args=(echo,))
+        timer.daemon = True
+        timer.start()
+        print(f"[INFO] 请求好友列表 (echo: {echo})...")
+        post.send_ws_message({"action": "get_friend_list", "params": {}, "echo": echo})
+        return echo
+
+    def _expire(self, echo: str):
+        """请求超时仍未收到响应时移除该请求并通知回调"""
+        with self._lock:
+            pending = self._pending.pop(echo, None)
+        if pending is not None:
+            self._fail(echo, pending[1], "请求超时")
+
+    def _fail(self, echo: str, callbacks: List[RefreshCallback], reason: str):
+        print(f"[WARN] 获取好友列表失败 (echo: {echo}): {reason}")
+        self._run_callbacks(callbacks, None, reason)
+
+    @staticmethod
+    def _run_callbacks(callbacks: List[RefreshCallback], friends: Optional[List[str]], error: Optional[str]):
+        for callback in callbacks:
+            try:
+                callback(friends, error)
+            except Exception as e:
+                print(f"[ERROR] 好友列表刷新回调出错: {e}")
+
+    def wait_until_refreshed(self, since: float, timeout: float) -> bool:
+        """阻塞等待 since 之后的一次刷新完成，仅供需要同步结果的旧接口使用"""
+        deadline = time.time() + timeout
+        with self._refreshed:
+            while self.updated_at < since:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._refreshed.wait(remaining)
+        return True
+
+    def handle_response(self, msg_data: dict) -> bool:
+        """处理 WebSocket 响应；是本缓存发出的请求时返回 True"""
+        echo = msg_data.get("echo")
+        if not isinstance(echo, str) or not echo.startswith(ECHO_PREFIX):
+            return False
+        with self._lock:
+            pending = self._pending.pop(echo, None)
+        if pending is None:
+            return True
+        if msg_data.get("status") != "ok":
+            reason = msg_data.get("message") or msg_data.get("wording") or f"status={msg_data.get('status')}"
+            self._fail(echo, pending[1], reason)
+            return True
+
+        friends = [str(friend.get("user_id", friend.get("qid")))
+                   for friend in msg_data.get("data") or [] if friend.get("user_id") or friend.get("qid")]
+        with self._refreshed:
+            self._friends = frozenset(friends)
+            self.loaded = True
+            self.updated_at = time.time()
+            self._refreshed.notify_all()
+        print(f"[INFO] 好友列表已更新 (echo: {echo}), 共 {len(friends)} 个好友.")
+
+        self._run_callbacks(pending[1], friends, None)
+        return True
+
+    def add(self, user_id):
+        """收到 friend_add 通知时立即加入缓存，再异步刷新一次完整列表"""
+        with self._lock:
+            self._friends = self._friends | {str(user_id)}
+        self.request_refresh()
+
+    def start(self):
+        """启动定期刷新线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.request_refresh()
+            except Exception as e:
+                print(f"[ERROR] 定期刷新好友列表失败: {e}")
+
+
+friend_cache = FriendListCache(CONFIG["qqbot"].get("friend_list_refresh_interval", 1800))
@@ -5,6 +5,8 @@ from config import CONFIG
 from napcat.chat_logic import handle_group_message, handle_private_message
 from napcat.command_handler import process_command, user_add_role_state, send_reply
 from napcat.message_sender import WebSocketSender
+from napcat.friend_cache import friend_cache
+from napcat.rate_limiter import PRIORITY_COMMAND
 from utils.emoji_storage import emoji_storage
 import utils.role_manager as role_manager
 from utils.text import extract_text_from_message
@@ -25,6 +27,11 @@ def handle_incoming_message(message):
         if post_type == "request" and msg.get("request_type") == "friend":
             handle_friend_request(msg, sender) # 调用好友请求处理函数
             return # 请求消息不需要后续处理
+
+        # 新增好友通知：更新好友列表缓存
+        if post_type == "notice" and msg.get("notice_type") == "friend_add":
+            friend_cache.add(msg.get("user_id"))
+            return
         
         # 主人好友请求决策处理
         if post_type == "message" and msg.get("message_type") == "private":
@@ -107,7 +114,7 @@ def handle_incoming_message(message):
                             # 给每个管理员都发送私聊
                             for admin_qq in admin_qq_list:
                                 try:
-                                    sender.send_private_msg(int(admin_qq), approval_msg)
+                                    sender.send_private_msg(int(admin_qq), approval_msg, priority=PRIORITY_COMMAND)
                                 except Exception as send_err:
                                     print(f"[ERROR] 发送审核通知给管理员 {admin_qq} 失败: {send_err}")
                     else:
@@ -193,7 +200,7 @@ def handle_friend_request(data: dict, sender: WebSocketSender):
 
     # 发送通知给主人
     try:
-        sender.send_private_msg(int(master_qq), notification_message)
+        sender.send_private_msg(int(master_qq), notification_message, priority=PRIORITY_COMMAND)
         print(f"[Info] 已发送好友请求通知给主人 {master_qq}")
     except Exception as e:
         print(f"[Error] 发送好友请求通知给主人 {master_qq} 失败: {e}")
@@ -205,7 +212,7 @@ def process_friend_request_decision(flag: str, action: str, sender: WebSocketSen
     if flag not in pending_friend_requests:
         print(f"[Warning] 收到未知或已处理的好友请求决策: flag={flag}")
         try:
-            sender.send_private_msg(int(master_qq), f"未找到待处理的请求标记: {flag}，可能已被处理或标识错误。")
+            sender.send_private_msg(int(master_qq), f"未找到待处理的请求标记: {flag}，可能已被处理或标识错误。", priority=PRIORITY_COMMAND)
         except Exception as e:
             print(f"[Error] 回复主人未找到请求标记失败: {e}")
         return
@@ -227,11 +234,11 @@ def process_friend_request_decision(flag: str, action: str, sender: WebSocketSen
         del pending_friend_requests[flag]
         
         # 回复主人确认
-        sender.send_private_msg(int(master_qq), f"已 {action} 来自 {user_id} 的好友请求 (flag: {flag})。")
+        sender.send_private_msg(int(master_qq), f"已 {action} 来自 {user_id} 的好友请求 (flag: {flag})。", priority=PRIORITY_COMMAND)
         
     except Exception as e:
         print(f"[Error] 处理好友请求 {flag} 时发生错误: {e}")
         try:
-            sender.send_private_msg(int(master_qq), f"处理好友请求 {flag} 时发生错误: {e}")
+            sender.send_private_msg(int(master_qq), f"处理好友请求 {flag} 时发生错误: {e}", priority=PRIORITY_COMMAND)
         except Exception as e_reply:
             print(f"[Error] 回复主人处理错误信息失败: {e_reply}")
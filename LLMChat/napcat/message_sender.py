@@ -1,14 +1,19 @@
 from abc import ABC, abstractmethod
 from typing import Union, List
 from napcat.message_types import MessageSegment
+from napcat.rate_limiter import PRIORITY_CHAT
 
 class IMessageSender(ABC):
     @abstractmethod
-    def send_private_msg(self, user_id: int, message: Union[str, List[MessageSegment]]):
+    def send_private_msg(self, user_id: int, message: Union[str, List[MessageSegment]], priority: int = PRIORITY_CHAT):
         pass
 
     @abstractmethod
-    def send_group_msg(self, group_id: int, message: Union[str, List[MessageSegment]]):
+    def send_group_msg(self, group_id: int, message: Union[str, List[MessageSegment]], priority: int = PRIORITY_CHAT):
+        pass
+
+    @abstractmethod
+    def send_poke(self, group_id: int, user_id: int, priority: int = PRIORITY_CHAT):
         pass
 
     @abstractmethod
@@ -22,6 +27,7 @@ class IMessageSender(ABC):
 # WebSocketSender实现
 import json
 from . import post
+from .rate_limiter import outbound_limiter
 
 def _normalize_message(message: Union[str, List[MessageSegment]]) -> List[MessageSegment]:
     if isinstance(message, str):
@@ -29,7 +35,7 @@ def _normalize_message(message: Union[str, List[MessageSegment]]) -> List[Messag
     return message
 
 class WebSocketSender(IMessageSender):
-    def send_private_msg(self, user_id: int, message: Union[str, List[MessageSegment]]):
+    def send_private_msg(self, user_id: int, message: Union[str, List[MessageSegment]], priority: int = PRIORITY_CHAT):
         payload = {
             "action": "send_private_msg",
             "params": {
@@ -37,9 +43,9 @@ class WebSocketSender(IMessageSender):
                 "message": _normalize_message(message)
             }
         }
-        post.send_ws_message(payload)
+        outbound_limiter.submit(f"private:{user_id}", lambda: post.send_ws_message(payload), priority)
 
-    def send_group_msg(self, group_id: int, message: Union[str, List[MessageSegment]]):
+    def send_group_msg(self, group_id: int, message: Union[str, List[MessageSegment]], priority: int = PRIORITY_CHAT):
         payload = {
             "action": "send_group_msg",
             "params": {
@@ -47,7 +53,11 @@ class WebSocketSender(IMessageSender):
                 "message": _normalize_message(message)
             }
         }
-        post.send_ws_message(payload)
+        outbound_limiter.submit(f"group:{group_id}", lambda: post.send_ws_message(payload), priority)
+
+    def send_poke(self, group_id: int, user_id: int, priority: int = PRIORITY_CHAT):
+        """群聊戳一戳，和群消息共用同一个限速目标"""
+        outbound_limiter.submit(f"group:{group_id}", lambda: post.send_poke(group_id, user_id), priority)
 
     def set_input_status(self, user_id: int):
         post.set_input_status(user_id)
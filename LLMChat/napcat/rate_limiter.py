@@ -0,0 +1,213 @@
+"""
+出站消息限速
+- 每个发送目标（群/私聊）一个令牌桶，整个账号再共用一个全局令牌桶，避免触发 QQ 风控
+- 消息按优先级排队：命令回复 > 聊天回复 > 主动消息（冷群提醒、接龙复读等）
+- 统计每个优先级的排队时间，排队过久时输出警告
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from config import CONFIG
+
+# 优先级，数值越小越先发送
+PRIORITY_COMMAND = 0
+PRIORITY_CHAT = 1
+PRIORITY_PROACTIVE = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_COMMAND: "command",
+    PRIORITY_CHAT: "chat",
+    PRIORITY_PROACTIVE: "proactive",
+}
+
+DEFAULT_RATE_LIMIT = {
+    "enabled": True,
+    "global_rate": 2.0,  # 全账号每秒最多发送的消息数
+    "global_burst": 5,  # 全账号允许的突发条数
+    "target_rate": 1.0,  # 单个群/私聊每秒最多发送的消息数
+    "target_burst": 3,  # 单个群/私聊允许的突发条数
+    "max_queue_size": 200,  # 队列超过该长度时丢弃新的主动消息
+    "slow_queue_warning": 10.0,  # 排队超过该秒数时输出警告
+}
+
+
+class TokenBucket:
+    """令牌桶：以 rate 个/秒的速度补充令牌，最多积攒 capacity 个"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """返回还需等待多少秒才有可用令牌，0 表示现在就可以发送"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _QueueTimeStats:
+    """单个优先级的排队时间统计，保留最近的样本用于计算分位数"""
+
+    def __init__(self, sample_size: int = 1000):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples: Deque[float] = deque(maxlen=sample_size)
+
+    def record(self, queue_time: float):
+        self.count += 1
+        self.total += queue_time
+        self.max = max(self.max, queue_time)
+        self.samples.append(queue_time)
+
+    def to_dict(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+
+        def percentile(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+        return {
+            "count": self.count,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": percentile(0.5),
+            "p99": percentile(0.99),
+            "max": self.max,
+        }
+
+
+# 队列条目: (优先级, 序号, 入队时间, 目标, 发送函数)
+_QueueItem = Tuple[int, int, float, str, Callable[[], None]]
+
+
+class OutboundRateLimiter:
+    """带优先级的出站消息调度器，由单独的后台线程按令牌桶节奏调用发送函数"""
+
+    def __init__(self, options: Optional[Dict] = None):
+        self.options = dict(DEFAULT_RATE_LIMIT)
+        self.options.update(options or {})
+        self.global_bucket = TokenBucket(self.options["global_rate"], self.options["global_burst"])
+        self.target_buckets: Dict[str, TokenBucket] = {}
+        # 可以立即尝试发送的消息
+        self._ready: List[_QueueItem] = []
+        # 目标令牌桶暂时耗尽的消息: (可重试时间, 队列条目)
+        self._deferred: List[Tuple[float, _QueueItem]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self.stats: Dict[int, _QueueTimeStats] = {p: _QueueTimeStats() for p in PRIORITY_NAMES}
+        self.dropped = 0
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.options.get("enabled", True))
+
+    def queue_size(self) -> int:
+        with self._cond:
+            return len(self._ready) + len(self._deferred)
+
+    def submit(self, target: str, send_func: Callable[[], None], priority: int = PRIORITY_CHAT) -> bool:
+        """
+        将发送动作加入队列，返回是否已入队。
+        未启用限速时直接发送；队列已满时丢弃主动消息，命令和聊天回复始终入队。
+        """
+        if not self.enabled:
+            send_func()
+            return True
+        with self._cond:
+            if priority >= PRIORITY_PROACTIVE and \
+                    len(self._ready) + len(self._deferred) >= self.options["max_queue_size"]:
+                self.dropped += 1
+                print(f"[WARNING] 出站消息队列已满，丢弃发往 {target} 的主动消息")
+                return False
+            heapq.heappush(self._ready, (priority, next(self._seq), time.monotonic(), target, send_func))
+            self._cond.notify()
+        self._ensure_thread()
+        return True
+
+    def get_stats(self) -> Dict:
+        """返回各优先级的排队时间统计（秒）和当前队列长度"""
+        with self._cond:
+            return {
+                "queue_size": len(self._ready) + len(self._deferred),
+                "dropped": self.dropped,
+                "queue_time": {PRIORITY_NAMES[p]: s.to_dict() for p, s in self.stats.items()},
+            }
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._cond:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, daemon=True)
+                    self._thread.start()
+
+    def _target_bucket(self, target: str) -> TokenBucket:
+        bucket = self.target_buckets.get(target)
+        if bucket is None:
+            bucket = self.target_buckets[target] = TokenBucket(
+                self.options["target_rate"], self.options["target_burst"]
+            )
+        return bucket
+
+    def _next_item(self) -> _QueueItem:
+        """阻塞直到有一条消息的目标令牌桶和全局令牌桶都允许发送，并消耗对应令牌"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                # 目标令牌桶已恢复的消息放回就绪队列
+                while self._deferred and self._deferred[0][0] <= now:
+                    heapq.heappush(self._ready, heapq.heappop(self._deferred)[1])
+
+                if not self._ready:
+                    timeout = self._deferred[0][0] - now if self._deferred else None
+                    self._cond.wait(timeout)
+                    continue
+
+                global_wait = self.global_bucket.wait_time(now)
+                if global_wait > 0:
+                    self._cond.wait(global_wait)
+                    continue
+
+                item = heapq.heappop(self._ready)
+                target_bucket = self._target_bucket(item[3])
+                target_wait = target_bucket.wait_time(now)
+                if target_wait > 0:
+                    # 序号保持不变，同一目标的消息恢复后仍按原顺序发送
+                    heapq.heappush(self._deferred, (now + target_wait, item))
+                    continue
+
+                target_bucket.consume(now)
+                self.global_bucket.consume(now)
+                self.stats[item[0]].record(now - item[2])
+                return item
+
+    def _run(self):
+        while True:
+            priority, _, enqueued_at, target, send_func = self._next_item()
+            queue_time = time.monotonic() - enqueued_at
+            if queue_time >= self.options["slow_queue_warning"]:
+                print(f"[WARNING] 发往 {target} 的{PRIORITY_NAMES[priority]}消息排队了 {queue_time:.1f} 秒")
+            try:
+                send_func()
+            except Exception as e:
+                print(f"[ERROR] 发送限速队列中的消息失败: {target}, Error: {e}")
+
+
+# 全局出站限速器，配置来自 config.json 的 qqbot.rate_limit
+outbound_limiter = OutboundRateLimiter(CONFIG["qqbot"].get("rate_limit"))
@@ -0,0 +1,99 @@
+import sys
+import os
+import asyncio
+import shutil
+import tempfile
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import CONFIG
+from utils.notebook import AINotebook, DEFAULT_ROLE_KEY
+import utils.notebook as notebook_module
+import napcat.post  # 与 main.py 相同的导入顺序，避免 napcat 包内的循环导入
+import utils.ai_message_parser as ai_message_parser
+import napcat.command_handler as command_handler
+import utils.files as files
+import llm
+
+# 使用临时笔记本文件，避免改动 data/ 下的真实笔记
+test_notebook = AINotebook(os.path.join(tempfile.mkdtemp(), "notebook_by_role.json"))
+notebook_module.notebook = test_notebook
+ai_message_parser.notebook = test_notebook
+command_handler.notebook = test_notebook
+files.notebook = test_notebook
+
+CONFIG["notebook"] = {"retrieval_mode": "relevant", "top_k": 1, "max_tokens": 1200}
+ADMIN_QQ = (CONFIG["qqbot"].get("admin_qq") or ["10000"])[0]
+CONFIG["qqbot"]["admin_qq"] = [str(ADMIN_QQ)]
+TEST_CHAT_ID = "notebook_pin_test"
+
+
+def run_conversation(user_input):
+    """走完整的 process_conversation 流程（AI 接口用替身代替），返回发送给 AI 的系统提示"""
+    sent = {}
+
+    def fake_get_ai_response(conversation):
+        sent["system"] = conversation[0]["content"]
+        yield "好的"
+
+    llm.get_ai_response = fake_get_ai_response
+    list(llm.process_conversation(TEST_CHAT_ID, user_input, chat_type="private"))
+    return sent["system"]
+
+
+class RecordingSender:
+    """只记录回复内容的 IMessageSender 替身"""
+    def __init__(self):
+        self.replies = []
+
+    def send_private_msg(self, user_id, message, priority=None):
+        self.replies.append(message)
+
+    def send_group_msg(self, group_id, message, priority=None):
+        self.replies.append(message)
+
+
+def run_command(text, sender):
+    msg_dict = {
+        "message_type": "private",
+        "sender": {"user_id": ADMIN_QQ},
+        "message": [{"type": "text", "data": {"text": text}}],
+    }
+    command_handler.process_command(msg_dict, sender)
+    return sender.replies[-1]
+
+
+if __name__ == "__main__":
+    # 1. AI 通过笔记标记记录笔记，再用 [note:ID:pin] 置顶（不传 chat_id 时写入全局笔记）
+    asyncio.run(ai_message_parser.parse_ai_message_to_segments("[note:用户喜欢猫]好的[note:用户住在上海]"))
+    asyncio.run(ai_message_parser.parse_ai_message_to_segments("[note:1:pin]记住啦"))
+    notes = {note["id"]: note for note in test_notebook.get_notes_for_role(DEFAULT_ROLE_KEY)}
+    assert len(notes) == 2, notes
+    assert notes[1].get("pinned") and not notes[2].get("pinned"), notes
+
+    # 2. 置顶笔记即使与当前对话无关也会注入；每轮对话只检索、统计一次
+    context = run_conversation("上海天气怎么样")
+    assert "用户喜欢猫" in context and "用户住在上海" in context, context
+    assert test_notebook.retrieval_stats["requests"] == 1, test_notebook.retrieval_stats
+
+    # 3. 管理员命令取消置顶 / 置顶 / 查看检索统计
+    sender = RecordingSender()
+    print(run_command("/noteunpin 1", sender))
+    assert not notes[1].get("pinned")
+    context = run_conversation("上海天气怎么样")
+    assert "用户喜欢猫" not in context, context
+    print(run_command("/notepin 2", sender))
+    assert notes[2].get("pinned")
+    print(run_command("/notepin 99", sender))
+
+    # 4. token 上限只约束相关笔记，多条置顶笔记即使超出上限也全部注入
+    CONFIG["notebook"]["max_tokens"] = 1
+    print(run_command("/notepin 1", sender))
+    context = test_notebook.get_notes_as_context(DEFAULT_ROLE_KEY, query="上海天气怎么样", record_stats=False)
+    assert "用户喜欢猫" in context and "用户住在上海" in context, context
+    CONFIG["notebook"]["max_tokens"] = 1200
+
+    stats_reply = run_command("/notestats", sender)
+    print(stats_reply)
+    assert "检索次数：2" in stats_reply, stats_reply
+    shutil.rmtree(os.path.dirname(files.get_history_file(TEST_CHAT_ID)), ignore_errors=True)
+    print("笔记置顶与检索统计测试通过。")
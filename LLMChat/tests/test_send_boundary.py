@@ -0,0 +1,42 @@
+import sys
+import os
+import json
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import llm_api
+from utils.segment_batcher import batch_segments
+
+
+class FakeStreamResponse:
+    """按给定的 delta 列表返回 SSE 行的流式响应替身"""
+    status_code = 200
+    text = ""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def iter_lines(self, decode_unicode=True):
+        for chunk in self.chunks:
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": chunk}}]}, ensure_ascii=False)
+        yield "data: [DONE]"
+
+
+def stream_and_batch(chunks):
+    llm_api.requests.post = lambda *args, **kwargs: FakeStreamResponse(chunks)
+    options = {"enabled": True, "max_chars": 200, "short_chars": 60, "max_delay": 5.0}
+    return list(batch_segments(llm_api.get_ai_response([{"role": "user", "content": "hi"}]), options))
+
+
+if __name__ == "__main__":
+    cases = [
+        # [send] 紧跟在已经随换行发出的内容之后，仍然必须断开
+        (['第一句', '\n', '[send]', '\n', '第二句', '\n'], ['第一句', '第二句']),
+        # [send] 前还有未发出的内容
+        (['第一句[send]第二句\n'], ['第一句', '第二句']),
+        # 没有 [send] 时连续短句照常合并
+        (['第一句\n', '第二句\n'], ['第一句\n第二句']),
+    ]
+    for chunks, expected in cases:
+        result = stream_and_batch(chunks)
+        assert result == expected, f"{chunks!r} -> {result!r}，预期 {expected!r}"
+    print("[send] 断开测试通过。")
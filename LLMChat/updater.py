@@ -174,6 +174,12 @@ def write_current_version(version_str):
 def restart_program():
     """重启当前程序"""
     print("准备重启程序...")
+    # os.execv 不会触发 atexit，先把延迟写入的数据落盘
+    try:
+        from utils.persistence import flush_all
+        flush_all()
+    except Exception as e:
+        log_warning(f"重启前写入待保存数据失败: {e}")
     try:
         os.execv(sys.executable, ['python'] + sys.argv)
     except Exception as e:
@@ -0,0 +1,149 @@
+"""
+黑白名单访问控制
+- 黑名单/白名单常驻内存（按插入顺序保存的集合），消息热路径上的检查为 O(1) 且不读盘
+- 后台线程按 mtime 监视名单文件，手动编辑文件后自动重新加载
+- 增删操作通过临时文件原子替换的方式落盘
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import CONFIG
+from utils.persistence import atomic_write_json
+
+BLACKLIST_FILE = os.path.join("config", "blacklist.json")
+WHITELIST_FILE = os.path.join("config", "whitelist.json")
+
+# 名单文件变化的检查间隔（秒）
+WATCH_INTERVAL = 5.0
+
+
+class AccessList:
+    """单个名单文件的内存镜像，包含用户消息名单 (msg) 和群聊名单 (group)"""
+
+    def __init__(self, name: str, file_path: str):
+        self.name = name
+        self.file_path = file_path
+        # 使用 dict 作为有序集合：O(1) 查询，同时保留写回文件时的顺序
+        self.msg: Dict[str, None] = {}
+        self.group: Dict[str, None] = {}
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+        self.load()
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.file_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        """从文件重新加载名单。如果文件不存在或格式错误则视为空名单"""
+        data = {"msg": [], "group": []}
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if isinstance(loaded, dict):
+                    data.update(loaded)
+            except Exception as e:
+                print(f"加载{self.name}出错:", e)
+        with self._lock:
+            self.msg = dict.fromkeys(str(t) for t in data.get("msg") or [])
+            self.group = dict.fromkeys(str(t) for t in data.get("group") or [])
+            self._mtime = self._file_mtime()
+
+    def reload_if_changed(self) -> bool:
+        """文件 mtime 变化时重新加载，返回是否发生了重新加载"""
+        if self._file_mtime() == self._mtime:
+            return False
+        self.load()
+        print(f"[INFO] 检测到{self.name}文件变化，已重新加载 (msg: {len(self.msg)}, group: {len(self.group)})")
+        return True
+
+    def _save_locked(self):
+        try:
+            atomic_write_json(self.file_path, self.to_dict())
+            self._mtime = self._file_mtime()
+        except Exception as e:
+            print(f"保存{self.name}出错:", e)
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        """返回与名单文件相同结构的字典 {"msg": [...], "group": [...]}"""
+        return {"msg": list(self.msg), "group": list(self.group)}
+
+    def contains(self, target, is_group: bool = False) -> bool:
+        """判断目标是否在名单中（纯内存查询）"""
+        return str(target) in (self.group if is_group else self.msg)
+
+    def add(self, target, is_group: bool = False) -> bool:
+        """加入名单并落盘；已存在时返回 False"""
+        target = str(target)
+        with self._lock:
+            entries = self.group if is_group else self.msg
+            if target in entries:
+                return False
+            entries[target] = None
+            self._save_locked()
+            return True
+
+    def remove(self, target, is_group: bool = False) -> bool:
+        """从名单移除并落盘；不存在时返回 False"""
+        target = str(target)
+        with self._lock:
+            entries = self.group if is_group else self.msg
+            if target not in entries:
+                return False
+            del entries[target]
+            self._save_locked()
+            return True
+
+    def replace(self, data: Dict[str, List[str]]):
+        """用完整的名单数据覆盖当前名单并落盘"""
+        with self._lock:
+            self.msg = dict.fromkeys(str(t) for t in data.get("msg") or [])
+            self.group = dict.fromkeys(str(t) for t in data.get("group") or [])
+            self._save_locked()
+
+
+blacklist = AccessList("黑名单", BLACKLIST_FILE)
+whitelist = AccessList("白名单", WHITELIST_FILE)
+
+
+def reload_access_lists():
+    """立即检查并重新加载发生变化的名单文件"""
+    blacklist.reload_if_changed()
+    whitelist.reload_if_changed()
+
+
+def _watch_access_lists():
+    """后台监视名单文件的变化"""
+    while True:
+        time.sleep(WATCH_INTERVAL)
+        try:
+            reload_access_lists()
+        except Exception as e:
+            print(f"[ERROR] 检查名单文件变化时出错: {e}")
+
+
+threading.Thread(target=_watch_access_lists, daemon=True).start()
+
+
+def check_access(sender_id, is_group=False):
+    """
+    根据配置的名单模式过滤消息：
+      - 黑名单模式：如果目标在黑名单中，则返回 False
+      - 白名单模式：如果目标不在白名单中，则返回 False
+      - 其它情况返回 True
+    参数 is_group 为 True 时，表示检查群聊名单，False 时为用户消息名单
+    """
+    mode_key = "group_list_mode" if is_group else "qq_list_mode"
+    mode = CONFIG["qqbot"].get(mode_key, "black").lower()
+    if CONFIG["debug"]: print(f"检查 {mode_key} 模式，当前模式: {mode}，目标: {sender_id}")
+    if mode == "black":
+        return not blacklist.contains(sender_id, is_group)
+    elif mode == "white":
+        return whitelist.contains(sender_id, is_group)
+    return True
@@ -29,6 +29,7 @@ async def parse_ai_message_to_segments(
       - [note:内容] 或 [note:内容:context]：静默记录笔记（不会发送任何消息）
         如果带有:context参数，会自动保存最近5条对话作为上下文
       - [note:笔记ID:delete]：删除指定ID的笔记
+      - [note:笔记ID:pin] / [note:笔记ID:unpin]：置顶/取消置顶指定ID的笔记（置顶笔记在按需检索时始终注入）
       - [poke:QQ号]：群聊中戳一戳某人（仅限群聊）
       - [emoji:表情包ID]：发送表情包
       - [setrole:角色]：设置角色
@@ -48,7 +49,7 @@ async def parse_ai_message_to_segments(
         r"|(?P<at1>\[@qq\s*:\s*(?P<at_qq1>\d+)\])"
         r"|(?P<at2>\[CQ:at,qq=(?P<at_qq2>\d+)\])"
         r"|(?P<music>\[music\s*:\s*(?P<music_query>[^\]]+?)\s*\])"
-        r"|(?P<note>\[note\s*:\s*(?P<note_content>.*?)(?:\\s*:\\s*(?P<note_action>delete))?\\s*\])"
+        r"|(?P<note>\[note\s*:\s*(?P<note_content>.*?)(?:\s*:\s*(?P<note_action>delete|pin|unpin))?\s*\])"
         r"|(?P<poke>\[poke\s*:\s*(?P<poke_qq>\d+)\])"
         r"|(?P<emoji>\[emoji\s*:\s*(?P<emoji_id>[^\]]+?)\s*\])"
         r"|(?P<setrole>\[setrole\s*:\s*(?P<setrole_target>[^\]]+?)\s*\])"
@@ -100,6 +101,15 @@ async def parse_ai_message_to_segments(
                             print(f"[Debug] Failed to delete note for role '{current_role_key}': ID {note_id} not found")
                     except ValueError:
                         print(f"[Debug] Invalid note ID for deletion: {note_content}")
+                elif note_action in ("pin", "unpin"):
+                    try:
+                        note_id = int(note_content)
+                        if notebook.pin_note(note_id, role=current_role_key, pinned=note_action == "pin"):
+                            print(f"[Debug] Note {note_action}ned for role '{current_role_key}': ID {note_id}")
+                        else:
+                            print(f"[Debug] Failed to {note_action} note for role '{current_role_key}': ID {note_id} not found")
+                    except ValueError:
+                        print(f"[Debug] Invalid note ID for {note_action}: {note_content}")
                 else:
                     new_note_id = notebook.add_note(note_content, role=current_role_key)
                     if new_note_id != -1:
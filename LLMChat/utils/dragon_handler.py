@@ -1,100 +1,170 @@
 import time
 import random
 import asyncio
-from collections import deque
-from typing import Dict
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Optional
 
-from llm import process_conversation
+from config import CONFIG
+from llm import generate_oneshot
 from utils.ai_message_parser import parse_ai_message_to_segments
 from napcat.message_sender import IMessageSender
+from napcat.rate_limiter import PRIORITY_PROACTIVE
+
+_dragon_config = CONFIG.get("dragon", {})
+DRAGON_CHAIN_LENGTH = max(2, int(_dragon_config.get("chain_length", 3)))  # 连续多少个不同的人发送相同内容视为接龙
+DRAGON_FOLLOW_PROBABILITY = float(_dragon_config.get("follow_probability", 0.5))  # 直接 +1 的概率，其余情况调用 AI 打乱
+DRAGON_MAX_GROUPS = int(_dragon_config.get("max_groups", 1000))  # 最多跟踪的群数，超出时淘汰最久没有消息的群
+
+
+def _content_hash(text: str) -> int:
+    """64 位内容哈希，0 保留给空格子"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big") or 1
+
+
+def _user_number(user_id: str) -> int:
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return _content_hash(str(user_id))
+
+
+class RepeatRing:
+    """
+    单个群最近 chain_length 条文本消息的 (内容哈希, 发送者) 环形缓冲。
+    只保存最新一条消息的原文，用于直接 +1。
+    """
+    __slots__ = ("hashes", "users", "pos", "last_text", "handled_hash")
+
+    def __init__(self, size: int = DRAGON_CHAIN_LENGTH):
+        self.hashes = array("Q", [0] * size)
+        self.users = array("Q", [0] * size)
+        self.pos = 0
+        self.last_text = ""
+        # 机器人已经参与（+1 或打乱）过的接龙内容，同一轮接龙不重复参与
+        self.handled_hash = 0
+
+    def record(self, user_id: str, text_content: str):
+        content_hash = _content_hash(text_content)
+        self.hashes[self.pos] = content_hash
+        self.users[self.pos] = _user_number(user_id)
+        self.pos = (self.pos + 1) % len(self.hashes)
+        if content_hash != self.handled_hash:
+            self.handled_hash = 0
+        self.last_text = text_content
+
+    def detect_chain(self, self_id: str) -> Optional[str]:
+        """最近 chain_length 条消息内容相同、发送者各不相同且都不是机器人时返回接龙内容"""
+        first_hash = self.hashes[0]
+        if not first_hash or first_hash == self.handled_hash:
+            return None
+        if any(h != first_hash for h in self.hashes):
+            return None
+        users = set(self.users)
+        if len(users) != len(self.users) or _user_number(self_id) in users:
+            return None
+        return self.last_text
+
+
+# 每个群的接龙检测环 (group_id -> RepeatRing)，按最近活跃排序，用于 LRU 淘汰
+group_repeat_rings: "OrderedDict[str, RepeatRing]" = OrderedDict()
+_rings_lock = threading.Lock()
 
-# 存储每个群组最近消息历史 (group_id -> deque of (user_id, text_content))
-group_message_history: Dict[str, deque] = {}
-DRAGON_HISTORY_LENGTH = 5 # 存储最近5条消息用于检测
 
 def update_message_history(group_id: str, user_id: str, text_content: str):
     """更新指定群组的消息历史记录"""
-    if group_id not in group_message_history:
-        group_message_history[group_id] = deque(maxlen=DRAGON_HISTORY_LENGTH)
     # 只记录非空文本消息
-    if text_content:
-        group_message_history[group_id].append((user_id, text_content))
+    if not text_content:
+        return
+    with _rings_lock:
+        ring = group_repeat_rings.get(group_id)
+        if ring is None:
+            ring = group_repeat_rings[group_id] = RepeatRing()
+            if len(group_repeat_rings) > DRAGON_MAX_GROUPS:
+                group_repeat_rings.popitem(last=False)
+        else:
+            group_repeat_rings.move_to_end(group_id)
+        ring.record(user_id, text_content)
+
+
+def _claim_chain(group_id: str, self_id: str) -> Optional[str]:
+    """检测接龙，检测到时标记该轮接龙已被处理并返回接龙内容"""
+    with _rings_lock:
+        ring = group_repeat_rings.get(group_id)
+        if ring is None:
+            return None
+        text = ring.detect_chain(self_id)
+        if text is not None:
+            ring.handled_hash = ring.hashes[0]
+        return text
+
+
+async def _disrupt_dragon(group_id: str, last_text: str, sender: IMessageSender):
+    # 更新的 Prompt，要求简洁、单句、无特殊标记
+    disrupt_prompt = f'请针对以下群聊中正在复读的内容："{last_text}"，回复一句非常简短、且能出其不意打断当前复读队形的话（或者玩梗）。你的回复必须精炼，只包含这句话本身，不准添加任何其他无关文字、解释或使用特殊格式标记。'
+
+    message_id = str(int(time.time()))
+
+    # 只带人设的一次性生成，不加载/写入群聊历史
+    full_ai_response_text = generate_oneshot(disrupt_prompt, chat_id=group_id, chat_type="group", max_tokens=60)
+
+    if full_ai_response_text:
+        print(f"[DEBUG] AI 打乱完整回复: {full_ai_response_text}")
+        # 对合并后的完整文本进行一次解析和发送
+        msg_segments = await parse_ai_message_to_segments(
+            full_ai_response_text,
+            message_id,
+            chat_id=group_id,
+            chat_type="group"
+        )
+        if msg_segments:
+            sender.send_group_msg(int(group_id), msg_segments, priority=PRIORITY_PROACTIVE) # 只发送一次
+    else:
+        print("[DEBUG] AI打乱接龙未返回有效内容。")
+
+
+def _run_disrupt_in_background(group_id: str, last_text: str, sender: IMessageSender):
+    """在独立线程和事件循环中调用 AI 打乱接龙，不阻塞当前消息处理"""
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(_disrupt_dragon(group_id, last_text, sender))
+        except Exception as ai_err:
+            print(f"[ERROR] 调用 AI 打乱接龙时出错: {ai_err}")
+        finally:
+            loop.close()
+
+    threading.Thread(target=run, daemon=True).start()
+
 
 async def handle_dragon_logic(group_id: str, self_id: str, sender: IMessageSender) -> bool:
     """
     检查并处理群聊中的接龙行为。完全处理接龙情况（+1 或 AI 打乱）。
+    +1 直接发送，不经过 AI；AI 打乱在后台线程中进行，本函数立即返回。
     返回 True 表示已处理接龙，False 表示未检测到或未处理。
     """
-    if group_id not in group_message_history:
-        return False
-
-    history = group_message_history[group_id]
-    if len(history) < 3:
-        return False # 消息不足三条，无法判断接龙
-
-    # 获取最后三条消息
-    last_user_id, last_text = history[-1]
-    prev_user_id, prev_text = history[-2]
-    prev_prev_user_id, prev_prev_text = history[-3]
-
-    # 接龙条件判断 (确保内容非空)
-    is_dragon = (
-        last_text == prev_text and last_text == prev_prev_text and # 内容相同
-        last_text and
-        last_user_id != prev_user_id and last_user_id != prev_prev_user_id and prev_user_id != prev_prev_user_id and # 三个发送者都不同
-        last_user_id != self_id and
-        prev_user_id != self_id and
-        prev_prev_user_id != self_id # 三个发送者都不是机器人
-    )
-
-    if is_dragon:
-        print(f"[DEBUG] 检测到群 {group_id} 接龙: '{last_text}' by {prev_user_id} -> {last_user_id}")
-        # 50%概率接龙，50%概率打乱
-        if random.random() < 0.5:
-            # --- 方式 A: 直接接龙 (+1) ---
-            try:
-                print(f"[DEBUG] 机器人决定接龙: +1 '{last_text}'")
-                dragon_segment = [{"type": "text", "data": {"text": last_text}}]
-                sender.send_group_msg(int(group_id), dragon_segment)
-                # 更新历史记录机器人接龙
-                update_message_history(group_id, self_id, last_text)
-                return True # 已处理
-            except Exception as e:
-                print(f"[ERROR] 机器人接龙失败: {e}")
-                return False # 未处理
-        else:
-            # --- 方式 B: 调用 AI 打乱接龙 ---
-            try:
-                print(f"[DEBUG] 机器人决定调用 AI 打乱接龙: '{last_text}'")
-                # 更新的 Prompt，要求简洁、单句、无特殊标记
-                disrupt_prompt = f'请针对以下群聊中正在复读的内容："{last_text}"，回复一句非常简短、且能出其不意打断当前复读队形的话（或者玩梗）。你的回复必须精炼，只包含这句话本身，不准添加任何其他无关文字、解释或使用特殊格式标记。'
-
-                message_id = str(int(time.time()))
-                
-                # 收集AI返回的所有片段，合并为单个字符串
-                ai_response_parts = []
-                for segment_text_part in process_conversation(group_id, disrupt_prompt, chat_type="group"):
-                    ai_response_parts.append(segment_text_part)
-                
-                full_ai_response_text = "".join(ai_response_parts).strip()
-
-                if full_ai_response_text:
-                    print(f"[DEBUG] AI 打乱完整回复: {full_ai_response_text}")
-                    # 对合并后的完整文本进行一次解析和发送
-                    msg_segments = await parse_ai_message_to_segments(
-                        full_ai_response_text,
-                        message_id,
-                        chat_id=group_id,
-                        chat_type="group"
-                    )
-                    if msg_segments:
-                        sender.send_group_msg(int(group_id), msg_segments) # 只发送一次
-                else:
-                    print("[DEBUG] AI打乱接龙未返回有效内容。")
-
-                return True # AI 打乱流程完成
-            except Exception as ai_err:
-                print(f"[ERROR] 调用 AI 打乱接龙时出错: {ai_err}")
-                return False # AI 处理失败
-
-    return False # 未检测到接龙 
\ No newline at end of file
+    last_text = _claim_chain(group_id, self_id)
+    if last_text is None:
+        return False # 未检测到接龙
+
+    print(f"[DEBUG] 检测到群 {group_id} 接龙: '{last_text}'")
+    if random.random() < DRAGON_FOLLOW_PROBABILITY:
+        # --- 方式 A: 直接接龙 (+1) ---
+        try:
+            print(f"[DEBUG] 机器人决定接龙: +1 '{last_text}'")
+            dragon_segment = [{"type": "text", "data": {"text": last_text}}]
+            sender.send_group_msg(int(group_id), dragon_segment, priority=PRIORITY_PROACTIVE)
+            # 更新历史记录机器人接龙
+            update_message_history(group_id, self_id, last_text)
+            return True # 已处理
+        except Exception as e:
+            print(f"[ERROR] 机器人接龙失败: {e}")
+            return False # 未处理
+
+    # --- 方式 B: 调用 AI 打乱接龙（后台进行） ---
+    print(f"[DEBUG] 机器人决定调用 AI 打乱接龙: '{last_text}'")
+    _run_disrupt_in_background(group_id, last_text, sender)
+    return True
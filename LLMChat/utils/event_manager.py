@@ -2,11 +2,16 @@ import json
 import os
 import time
 import uuid
-from typing import Dict, List, Any, Optional
+import threading
+from collections import defaultdict
+from typing import Callable, DefaultDict, Dict, List, Any, Optional, Set, Tuple
 
 # 文件路径
 ACTIVE_EVENTS_FILE = os.path.join("data", "active_events.json")
 
+# 事件默认存活时间（秒），超时后自动结束，不依赖模型输出 [event_end:]
+DEFAULT_EVENT_TTL = 6 * 3600
+
 def _ensure_file(file_path: str, default_content: Any = {}):
     """确保 JSON 文件和目录存在"""
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
@@ -17,27 +22,229 @@ def _ensure_file(file_path: str, default_content: Any = {}):
         except IOError as e:
             print(f"[ERROR] 创建文件失败: {file_path}, Error: {e}")
 
-def _load_events() -> Dict[str, Dict]:
+def _load_events(file_path: str = ACTIVE_EVENTS_FILE) -> Dict[str, Dict]:
     """加载所有活动事件，返回一个 event_id -> event_info 的字典"""
-    _ensure_file(ACTIVE_EVENTS_FILE, default_content={})
+    _ensure_file(file_path, default_content={})
     try:
-        with open(ACTIVE_EVENTS_FILE, "r", encoding="utf-8") as f:
+        with open(file_path, "r", encoding="utf-8") as f:
             data = json.load(f)
             return data if isinstance(data, dict) else {}
     except (json.JSONDecodeError, IOError) as e:
-        print(f"[ERROR] 加载活动事件文件失败: {ACTIVE_EVENTS_FILE}, Error: {e}")
+        print(f"[ERROR] 加载活动事件文件失败: {file_path}, Error: {e}")
         return {}
 
-def _save_events(events: Dict[str, Dict]):
+def _save_events(events: Dict[str, Dict], file_path: str = ACTIVE_EVENTS_FILE):
     """保存活动事件字典到文件"""
-    _ensure_file(ACTIVE_EVENTS_FILE, default_content={})
+    _ensure_file(file_path, default_content={})
     try:
-        with open(ACTIVE_EVENTS_FILE, "w", encoding="utf-8") as f:
+        with open(file_path, "w", encoding="utf-8") as f:
             json.dump(events, f, ensure_ascii=False, indent=2)
     except IOError as e:
-        print(f"[ERROR] 保存活动事件文件失败: {ACTIVE_EVENTS_FILE}, Error: {e}")
+        print(f"[ERROR] 保存活动事件文件失败: {file_path}, Error: {e}")
+
+
+class _TimerWheel:
+    """
+    单层时间轮：每个 tick 推进一格，只处理当前格内的定时器。
+    超过一圈的延迟用剩余圈数表示，调度和取消都是 O(1)。
+    """
+
+    def __init__(self, on_expire: Callable[[str], None], tick_seconds: float = 1.0, slot_count: int = 3600):
+        self.on_expire = on_expire
+        self.tick_seconds = tick_seconds
+        self.slot_count = slot_count
+        # 每个格子: key -> 剩余圈数
+        self.slots: List[Dict[str, int]] = [{} for _ in range(slot_count)]
+        # key -> 所在格子下标，用于 O(1) 取消
+        self.positions: Dict[str, int] = {}
+        self.cursor = 0
+        self.lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, key: str, delay_seconds: float):
+        """在 delay_seconds 秒后触发 key 的过期回调，重复调度会覆盖旧的定时器"""
+        ticks = max(1, int(delay_seconds / self.tick_seconds + 0.999))
+        with self.lock:
+            self._cancel_locked(key)
+            slot = (self.cursor + ticks) % self.slot_count
+            self.slots[slot][key] = (ticks - 1) // self.slot_count
+            self.positions[key] = slot
+        self._ensure_thread()
+
+    def cancel(self, key: str):
+        """取消 key 的定时器，不存在时忽略"""
+        with self.lock:
+            self._cancel_locked(key)
+
+    def _cancel_locked(self, key: str):
+        slot = self.positions.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.tick_seconds
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+            expired: List[str] = []
+            with self.lock:
+                self.cursor = (self.cursor + 1) % self.slot_count
+                slot = self.slots[self.cursor]
+                for key, rounds in list(slot.items()):
+                    if rounds > 0:
+                        slot[key] = rounds - 1
+                    else:
+                        del slot[key]
+                        self.positions.pop(key, None)
+                        expired.append(key)
+            for key in expired:
+                try:
+                    self.on_expire(key)
+                except Exception as e:
+                    print(f"[ERROR] 处理定时器过期回调失败: {key}, Error: {e}")
+
+
+class EventRegistry:
+    """
+    常驻内存的活动事件注册表。
+    - 按 (chat_id, chat_type) 和参与者建立索引，查询无需读盘和线性扫描
+    - 变更时同步写回 active_events.json（write-through）
+    - 每个事件带 TTL，由时间轮到期自动移除
+    """
+
+    def __init__(self, events_file: str = ACTIVE_EVENTS_FILE):
+        self.events_file = events_file
+        self.events: Dict[str, Dict] = {}
+        # (chat_id, chat_type) -> event_id，同一聊天同时只允许一个活动事件
+        self.by_chat: Dict[Tuple[str, str], str] = {}
+        # participant_qq -> {event_id, ...}
+        self.by_participant: DefaultDict[str, Set[str]] = defaultdict(set)
+        self.lock = threading.RLock()
+        self.wheel = _TimerWheel(self._on_expire)
+        self._load()
+
+    def _load(self):
+        """启动时从文件恢复事件，丢弃已过期的事件并为其余事件重新调度"""
+        now = int(time.time())
+        loaded = _load_events(self.events_file)
+        expired_count = 0
+        with self.lock:
+            for event_id, event_info in loaded.items():
+                if not isinstance(event_info, dict):
+                    continue
+                # 旧版本数据没有 expires_at，按默认 TTL 补齐
+                expires_at = event_info.setdefault(
+                    "expires_at", int(event_info.get("start_time", now)) + DEFAULT_EVENT_TTL
+                )
+                if expires_at <= now:
+                    expired_count += 1
+                    continue
+                self._index(event_id, event_info)
+                self.wheel.schedule(event_id, expires_at - now)
+            if expired_count:
+                print(f"[INFO] 启动时清理了 {expired_count} 个已过期的活动事件")
+                self._persist()
+
+    def _index(self, event_id: str, event_info: Dict):
+        self.events[event_id] = event_info
+        self.by_chat[(event_info.get("chat_id"), event_info.get("chat_type"))] = event_id
+        for participant in event_info.get("participants", []):
+            self.by_participant[participant].add(event_id)
+
+    def _unindex(self, event_id: str) -> Optional[Dict]:
+        event_info = self.events.pop(event_id, None)
+        if event_info is None:
+            return None
+        chat_key = (event_info.get("chat_id"), event_info.get("chat_type"))
+        if self.by_chat.get(chat_key) == event_id:
+            del self.by_chat[chat_key]
+        for participant in event_info.get("participants", []):
+            event_ids = self.by_participant.get(participant)
+            if event_ids:
+                event_ids.discard(event_id)
+                if not event_ids:
+                    del self.by_participant[participant]
+        return event_info
+
+    def _persist(self):
+        _save_events(self.events, self.events_file)
+
+    def _on_expire(self, event_id: str):
+        with self.lock:
+            event_info = self._unindex(event_id)
+            if event_info is None:
+                return
+            self._persist()
+        print(f"[INFO] 活动事件已超时结束: ID {event_id}, Type {event_info.get('type')}, Chat ({event_info.get('chat_id')}, {event_info.get('chat_type')})")
 
-def register_event(event_type: str, participants: List[str], prompt_content: str, chat_id: str, chat_type: str) -> Optional[str]:
+    def register(self, event_type: str, participants: List[str], prompt_content: str, chat_id: str, chat_type: str, ttl_seconds: Optional[int] = None) -> Optional[str]:
+        ttl = ttl_seconds if ttl_seconds and ttl_seconds > 0 else DEFAULT_EVENT_TTL
+        with self.lock:
+            existing_event_id = self.by_chat.get((chat_id, chat_type))
+            if existing_event_id:
+                print(f"[WARNING] Chat ({chat_id}, {chat_type}) 已有活动事件 {existing_event_id}，新事件注册失败。")
+                return None # 已有活动事件，注册失败
+
+            event_id = str(uuid.uuid4()) # 生成唯一的事件 ID
+            start_time = int(time.time())
+            event_info = {
+                "id": event_id,
+                "type": event_type,
+                "participants": participants,
+                "prompt_content": prompt_content,
+                "chat_id": chat_id,
+                "chat_type": chat_type,
+                "start_time": start_time,
+                "expires_at": start_time + ttl,
+                "status": "active" # 可以添加状态字段
+            }
+            self._index(event_id, event_info)
+            self._persist()
+            self.wheel.schedule(event_id, ttl)
+        print(f"[INFO] 已注册新的活动事件: ID {event_id}, Type {event_type}, Chat ({chat_id}, {chat_type}), Participants {participants}, TTL {ttl}s")
+        return event_id
+
+    def get_active(self, chat_id: str, chat_type: str, user_id: Optional[str]) -> Optional[Dict]:
+        with self.lock:
+            event_id = self.by_chat.get((chat_id, chat_type))
+            if not event_id:
+                return None
+            event_info = self.events[event_id]
+            # 对于群聊，检查用户是否是参与者；对于私聊，chat_id 就是 user_id，注册时已确保一致
+            if chat_type == "group":
+                return event_info if event_id in self.by_participant.get(user_id, ()) else None
+            elif chat_type == "private":
+                return event_info # 私聊直接返回该聊天下的事件
+            return None
+
+    def get_for_participant(self, user_id: str) -> List[Dict]:
+        with self.lock:
+            return [self.events[event_id] for event_id in self.by_participant.get(user_id, ())]
+
+    def remove(self, event_id: str) -> bool:
+        with self.lock:
+            if self._unindex(event_id) is None:
+                print(f"[WARNING] 尝试移除不存在的活动事件: ID {event_id}")
+                return False
+            self.wheel.cancel(event_id)
+            self._persist()
+        print(f"[INFO] 已移除活动事件: ID {event_id}")
+        return True
+
+    def list_all(self) -> Dict[str, Dict]:
+        with self.lock:
+            return dict(self.events)
+
+
+# 全局事件注册表实例
+event_registry = EventRegistry()
+
+def register_event(event_type: str, participants: List[str], prompt_content: str, chat_id: str, chat_type: str, ttl_seconds: Optional[int] = None) -> Optional[str]:
     """
     注册一个新的活动事件。
 
@@ -46,30 +253,10 @@ def register_event(event_type: str, participants: List[str], prompt_content: str
     :param prompt_content: 需要注入到 Systemprompt 中的事件描述和规则。
     :param chat_id: 发生事件的聊天 ID。
     :param chat_type: 发生事件的聊天类型 ('private'/'group').
+    :param ttl_seconds: 事件存活时间（秒），到期自动结束。默认为 DEFAULT_EVENT_TTL。
     :return: 新事件的唯一 ID，如果注册失败则为 None。
     """
-    events = _load_events()
-    event_id = str(uuid.uuid4()) # 生成唯一的事件 ID
-
-    # 检查是否已有相同聊天/参与者的活动事件
-    for existing_event_id, existing_event in events.items():
-        if existing_event.get("chat_id") == chat_id and existing_event.get("chat_type") == chat_type:
-             print(f"[WARNING] Chat ({chat_id}, {chat_type}) 已有活动事件 {existing_event_id}，新事件注册失败。")
-             return None # 已有活动事件，注册失败
-
-    events[event_id] = {
-        "id": event_id,
-        "type": event_type,
-        "participants": participants,
-        "prompt_content": prompt_content,
-        "chat_id": chat_id,
-        "chat_type": chat_type,
-        "start_time": int(time.time()),
-        "status": "active" # 可以添加状态字段
-    }
-    _save_events(events)
-    print(f"[INFO] 已注册新的活动事件: ID {event_id}, Type {event_type}, Chat ({chat_id}, {chat_type}), Participants {participants}")
-    return event_id
+    return event_registry.register(event_type, participants, prompt_content, chat_id, chat_type, ttl_seconds)
 
 def get_active_event(chat_id: str, chat_type: str, user_id: str) -> Optional[Dict]:
     """
@@ -80,20 +267,16 @@ def get_active_event(chat_id: str, chat_type: str, user_id: str) -> Optional[Dic
     :param user_id: 当前用户的 QQ 号。
     :return: 活动事件字典，如果没有则为 None。
     """
-    events = _load_events()
-    for event_id, event_info in events.items():
-        # 检查聊天 ID 和类型是否匹配
-        if event_info.get("chat_id") == chat_id and event_info.get("chat_type") == chat_type:
-            # 对于群聊，检查用户是否是参与者；对于私聊，chat_id 就是 user_id，注册时已确保一致
-            if chat_type == "group":
-                if user_id in event_info.get("participants", []):
-                    return event_info
-            elif chat_type == "private":
-                 # 私聊时，参与者列表应该只包含 user_id，或者直接检查 chat_id == user_id
-                 # 注册时已确保 chat_id == user_id 且 user_id 在 participants 中
-                 return event_info # 私聊直接返回该聊天下的事件
+    return event_registry.get_active(chat_id, chat_type, user_id)
 
-    return None # 未找到相关活动事件
+def get_events_for_participant(user_id: str) -> List[Dict]:
+    """
+    获取指定用户参与的所有活动事件。
+
+    :param user_id: 用户的 QQ 号。
+    :return: 活动事件字典列表。
+    """
+    return event_registry.get_for_participant(user_id)
 
 def remove_event(event_id: str) -> bool:
     """
@@ -102,15 +285,7 @@ def remove_event(event_id: str) -> bool:
     :param event_id: 要移除的事件 ID。
     :return: 如果成功移除则为 True，否则为 False。
     """
-    events = _load_events()
-    if event_id in events:
-        del events[event_id]
-        _save_events(events)
-        print(f"[INFO] 已移除活动事件: ID {event_id}")
-        return True
-    else:
-        print(f"[WARNING] 尝试移除不存在的活动事件: ID {event_id}")
-        return False
+    return event_registry.remove(event_id)
 
 def list_active_events() -> Dict[str, Dict]:
     """
@@ -118,4 +293,4 @@ def list_active_events() -> Dict[str, Dict]:
 
     :return: 活动事件字典。
     """
-    return _load_events()
+    return event_registry.list_all()
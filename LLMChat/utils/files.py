@@ -1,5 +1,6 @@
 import os
 import json
+from typing import Optional
 from utils.notebook import notebook, DEFAULT_ROLE_KEY
 from utils.emoji_storage import emoji_storage
 import utils.role_manager as role_manager
@@ -10,35 +11,38 @@ DEFAULT_ROLE_FILENAME = "default.json"
 os.makedirs(PRIVATE_DIR, exist_ok=True)
 os.makedirs(GROUP_DIR, exist_ok=True)
 
-def get_latest_system_content(chat_id: str, chat_type: str) -> str:
-    """获取最新的系统提示。优先使用激活角色的专属Prompt，若无则用通用Prompt，并结合对应角色的笔记内容和表情包提示。"""
+def get_base_system_prompt(chat_id: str, chat_type: str) -> str:
+    """
+    获取不含笔记和表情包提示的基础人设 Prompt：优先使用激活角色的专属 Prompt，若无则用通用 system_prompt.txt。
+    供一次性生成等只需要人设、不需要完整上下文的场景使用。
+    """
+    role_specific_prompt = role_manager.get_active_role_prompt(chat_id, chat_type)
+    if role_specific_prompt:
+        return role_specific_prompt.strip()
+    try:
+        with open(os.path.join("config", "system_prompt.txt"), "r", encoding="utf-8") as sp:
+            return sp.read().strip()
+    except Exception as e_sp:
+        print(f"读取通用 system_prompt.txt 失败: {e_sp}")
+        return ""
+
+def get_latest_system_content(chat_id: str, chat_type: str, query: Optional[str] = None, record_stats: bool = True) -> str:
+    """
+    获取最新的系统提示。优先使用激活角色的专属Prompt，若无则用通用Prompt，并结合对应角色的笔记内容和表情包提示。
+    query 为当前轮次的用户输入，笔记检索模式下用于挑选相关笔记。
+    record_stats 为 False 时本次笔记检索不计入 notebook.retrieval_stats（如保存历史时刷新系统提示）。
+    """
     base_system_prompt = ""
     try:
-        # 1. 获取激活角色的专属 Prompt
+        # 1/2. 激活角色的专属 Prompt，若无则使用通用 system_prompt.txt
         active_role_name = role_manager.get_active_role(chat_id, chat_type)
-        role_specific_prompt = None
-        if active_role_name:
-            role_specific_prompt = role_manager.get_active_role_prompt(chat_id, chat_type)
-            print(f"[Debug] files.py: Active role '{active_role_name}' has specific prompt: {'Yes' if role_specific_prompt else 'No'}")
-
-        # 2. 如果角色专属 Prompt 存在且非空，则使用它作为基础
-        if role_specific_prompt:
-            base_system_prompt = role_specific_prompt.strip()
-        else:
-            # 否则，读取通用的 system_prompt.txt
-            try:
-                with open(os.path.join("config", "system_prompt.txt"), "r", encoding="utf-8") as sp:
-                    base_system_prompt = sp.read().strip()
-                print(f"[Debug] files.py: Using general system_prompt.txt as base.")
-            except Exception as e_sp:
-                print(f"读取通用 system_prompt.txt 失败: {e_sp}")
-                # 即使通用prompt读取失败，也继续尝试加载笔记等
+        base_system_prompt = get_base_system_prompt(chat_id, chat_type)
 
         # 3. 获取并追加对应角色的笔记内容
         # role_key 用于笔记，如果激活了角色就用角色名，否则用默认key
         role_key_for_notes = active_role_name if active_role_name else DEFAULT_ROLE_KEY
         print(f"[Debug] files.py: Getting notes context for role_key: {role_key_for_notes}")
-        notes_context = notebook.get_notes_as_context(role=role_key_for_notes)
+        notes_context = notebook.get_notes_as_context(role=role_key_for_notes, query=query, record_stats=record_stats)
         if notes_context:
             base_system_prompt = f"{base_system_prompt}\n\n{notes_context}"
             
@@ -74,14 +78,18 @@ def get_history_file(id_str: str, chat_type="private") -> str:
     os.makedirs(os.path.dirname(history_file), exist_ok=True)
     return history_file
 
-def load_conversation_history(id_str, chat_type="private"):
+def load_conversation_history(id_str, chat_type="private", query: Optional[str] = None, system_content: Optional[str] = None):
     """
     加载对话历史，并确保系统提示是最新的
-    每次加载时都会更新系统提示和对应角色的笔记内容
+    每次加载时都会更新系统提示和对应角色的笔记内容（query 用于检索相关笔记）
+    调用方已生成本轮的系统内容时通过 system_content 传入，避免重复检索笔记
     """
     history_file = get_history_file(id_str, chat_type)
-    # 获取最新的系统内容，传递 chat_id 和 chat_type
-    latest_system_content = get_latest_system_content(id_str, chat_type)
+    if system_content is not None:
+        latest_system_content = system_content
+    else:
+        # 获取最新的系统内容，传递 chat_id 和 chat_type
+        latest_system_content = get_latest_system_content(id_str, chat_type, query=query)
 
     try:
         if os.path.exists(history_file):
@@ -118,7 +126,7 @@ def save_conversation_history(id_str, history, chat_type="private"):
         # 确保保存前系统提示是最新的
         if history and isinstance(history, list) and len(history) > 0 and isinstance(history[0], dict) and history[0].get("role") == "system":
             # 获取最新的系统内容，传递 chat_id 和 chat_type
-            latest_system_content = get_latest_system_content(id_str, chat_type)
+            latest_system_content = get_latest_system_content(id_str, chat_type, record_stats=False)
             history[0]["content"] = latest_system_content
             
         with open(history_file, "w", encoding="utf-8") as f:
@@ -1,21 +1,110 @@
+import asyncio
+import heapq
 import json
 import os
 import time
 import threading
-from typing import Dict, Optional, Callable, List
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Dict, Optional, Callable, List, Tuple
 from datetime import datetime, timedelta
 
+from utils.persistence import atomic_write_json, WriteBehindFlusher
+from utils.segment_batcher import batch_segments, typing_delay
+
+if TYPE_CHECKING:
+    # napcat.message_sender -> napcat.post -> chat_logic 会反向导入本模块，这里只用于类型标注
+    from napcat.message_sender import IMessageSender
+
+
+def _local_hour_number(timestamp: Optional[float] = None) -> int:
+    """返回本地时区下从纪元开始计算的小时序号，对 24 取余即为当天的小时"""
+    ts = int(time.time() if timestamp is None else timestamp)
+    return (ts + time.localtime(ts).tm_gmtoff) // 3600
+
+
+class HourlyActivityRing:
+    """
+    最近 168 小时（7 天）的逐小时消息计数环。
+    下标为 小时序号 % 168，每个格子同时记录它对应的小时序号，
+    写入时发现格子属于更早的一轮就先清零，因此记录一次消息是 O(1)。
+    """
+
+    SIZE = 168
+    __slots__ = ("counts", "hours")
+
+    def __init__(self):
+        self.counts = array("I", [0] * self.SIZE)
+        self.hours = array("q", [-1] * self.SIZE)
+
+    def record(self, hour_number: int, count: int = 1):
+        idx = hour_number % self.SIZE
+        if self.hours[idx] != hour_number:
+            self.hours[idx] = hour_number
+            self.counts[idx] = 0
+        self.counts[idx] += count
+
+    def hour_of_day_histogram(self, now_hour_number: int) -> Tuple[List[int], int]:
+        """返回 (最近 7 天按一天 24 个小时段汇总的消息数, 最近 7 天的消息总数)"""
+        histogram = [0] * 24
+        oldest = now_hour_number - self.SIZE
+        for idx in range(self.SIZE):
+            hour_number = self.hours[idx]
+            if oldest < hour_number <= now_hour_number:
+                histogram[hour_number % 24] += self.counts[idx]
+        return histogram, sum(histogram)
+
+    def to_dict(self) -> Dict[str, List[int]]:
+        return {"counts": list(self.counts), "hours": list(self.hours)}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, List[int]]) -> "HourlyActivityRing":
+        ring = cls()
+        counts = data.get("counts", [])
+        hours = data.get("hours", [])
+        if len(counts) == cls.SIZE and len(hours) == cls.SIZE:
+            ring.counts = array("I", counts)
+            ring.hours = array("q", hours)
+        return ring
+
+    @classmethod
+    def from_legacy_pattern(cls, pattern: List[int], now_hour_number: int) -> "HourlyActivityRing":
+        """把旧版 activity_pattern（按消息记录的小时列表）折算到最近一次出现的对应小时上"""
+        ring = cls()
+        for hour_of_day in pattern:
+            if isinstance(hour_of_day, int) and 0 <= hour_of_day < 24:
+                ring.record(now_hour_number - (now_hour_number - hour_of_day) % 24)
+        return ring
+
+
 class GroupActivityManager:
     def __init__(self):
         self.activity_file = os.path.join("data", "group_activity.json")
+        # 保护 self.data / self.activity_rings，消息线程与刷新线程会并发访问
+        self._lock = threading.Lock()
+        # 每个群的逐小时活跃计数环: group_id -> HourlyActivityRing
+        self.activity_rings: Dict[str, HourlyActivityRing] = {}
         self._ensure_activity_file()
         self.data = self._load_activity()
         self.process_conversation: Optional[Callable] = None
+        self.sender: Optional["IMessageSender"] = None
+
+        # 冷群调度：(提醒时间, 群号) 小根堆 + 每个群当前有效的提醒时间
+        self._schedule_heap: List[Tuple[float, str]] = []
+        self._scheduled: Dict[str, float] = {}
+        self._schedule_cond = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._last_dispatch = 0.0
+
+        # 活跃度数据只在内存中更新，每 flush_interval 秒合并写盘一次，退出时再写一次
+        self.flush_interval = 30
+        self._flusher = WriteBehindFlusher("群活跃度数据", self._save_activity, delay=self.flush_interval)
         
         # 基础配置
         self.cold_threshold = 2400  # 40分钟无消息视为冷群
-        self.check_interval = 1800   # 每30分钟检查一次
         self.min_reminder_interval = 3600 * 12  # 同一个群12小时内不重复提醒
+        self.max_concurrent_nudges = 3  # 同时生成/发送提醒的群数上限
+        self.nudge_spacing = 10  # 任意两个群的提醒之间至少间隔的秒数
         
         # 免打扰时段 (24小时制)
         self.quiet_hours = {
@@ -23,9 +112,10 @@ class GroupActivityManager:
             'end': 8,    # 早上8点
         }
         
-    def init_process_conversation(self, process_conversation_func: Callable):
-        """初始化处理对话的函数"""
+    def init_process_conversation(self, process_conversation_func: Callable, sender: Optional["IMessageSender"] = None):
+        """初始化处理对话的函数和发送提醒消息使用的 sender"""
         self.process_conversation = process_conversation_func
+        self.sender = sender
         self._start_check_thread()
         print("[Info] 群活跃度检查线程已启动")
     
@@ -52,62 +142,74 @@ class GroupActivityManager:
                     data["settings"] = {}
                 if "last_reminder" not in data:
                     data["last_reminder"] = {}
-                return data
+                rings_data = data.pop("activity_rings", {})
         except Exception as e:
             print(f"加载群活跃度数据出错: {e}")
             return {"groups": {}, "settings": {}, "last_reminder": {}}
-    
+
+        now_hour_number = _local_hour_number()
+        for group_id, ring_data in rings_data.items():
+            self.activity_rings[group_id] = HourlyActivityRing.from_dict(ring_data)
+        # 迁移旧版按消息记录的 activity_pattern
+        for group_id, settings in data["settings"].items():
+            legacy_pattern = settings.pop("activity_pattern", None)
+            if legacy_pattern and group_id not in self.activity_rings:
+                self.activity_rings[group_id] = HourlyActivityRing.from_legacy_pattern(legacy_pattern, now_hour_number)
+        return data
+
+    def _snapshot(self) -> Dict:
+        """生成用于写盘的数据快照"""
+        with self._lock:
+            return {
+                "groups": dict(self.data["groups"]),
+                "settings": {gid: dict(settings) for gid, settings in self.data["settings"].items()},
+                "last_reminder": dict(self.data["last_reminder"]),
+                "activity_rings": {gid: ring.to_dict() for gid, ring in self.activity_rings.items()},
+            }
+
     def _save_activity(self):
-        """保存群活跃度数据"""
-        try:
-            with open(self.activity_file, "w", encoding="utf-8") as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存群活跃度数据出错: {e}")
+        """保存群活跃度数据（由 WriteBehindFlusher 在后台调用）"""
+        atomic_write_json(self.activity_file, self._snapshot(), indent=None)
+
+    def flush(self):
+        """立即写入尚未落盘的活跃度数据"""
+        self._flusher.flush()
     
     def update_group_activity(self, group_id: str):
-        """更新群活跃时间和活跃度数据"""
+        """更新群活跃时间和活跃度数据（仅修改内存，不同步写盘）"""
         current_time = int(time.time())
-        
-        # 初始化群数据（如果不存在）
-        if group_id not in self.data["groups"]:
+
+        with self._lock:
+            # 初始化群设置（如果不存在）
+            if group_id not in self.data["settings"]:
+                self.data["settings"][group_id] = {
+                    "custom_threshold": None,  # 自定义冷群阈值
+                    "custom_quiet_hours": None,  # 自定义免打扰时段
+                    "is_enabled": True,  # 是否启用活跃度检查
+                }
+                self.data["last_reminder"].setdefault(group_id, 0)
+
+            # 更新最后活跃时间
             self.data["groups"][group_id] = current_time
-        
-        # 初始化群设置（如果不存在）
-        if group_id not in self.data["settings"]:
-            self.data["settings"][group_id] = {
-                "custom_threshold": None,  # 自定义冷群阈值
-                "custom_quiet_hours": None,  # 自定义免打扰时段
-                "is_enabled": True,  # 是否启用活跃度检查
-                "activity_pattern": []  # 活跃模式记录
-            }
-        
-        if group_id not in self.data["last_reminder"]:
-            self.data["last_reminder"][group_id] = 0
-        
-        # 更新最后活跃时间
-        self.data["groups"][group_id] = current_time
-        
-        # 更新活跃模式（记录最近7天的活跃时段）
-        hour = datetime.now().hour
-        settings = self.data["settings"][group_id]
-        activity_pattern = settings["activity_pattern"]
-        activity_pattern.append(hour)
-        
-        # 只保留最近168个小时（7天）的数据
-        if len(activity_pattern) > 168:
-            activity_pattern = activity_pattern[-168:]
-        settings["activity_pattern"] = activity_pattern
-        
-        self._save_activity()
-    
-    def _is_quiet_hours(self, group_id: str) -> bool:
-        """检查当前是否是免打扰时段"""
-        current_hour = datetime.now().hour
+
+            # 更新活跃模式（最近7天的逐小时计数）
+            ring = self.activity_rings.get(group_id)
+            if ring is None:
+                ring = self.activity_rings[group_id] = HourlyActivityRing()
+            ring.record(_local_hour_number(current_time))
+
+        self._flusher.mark_dirty()
+        # 新出现的群加入调度；已在调度中的群在截止时间到达时会按最新活跃时间重新计算
+        if group_id not in self._scheduled:
+            self._schedule(group_id, current_time + self._get_group_threshold(group_id))
+
+    def _is_quiet_hours(self, group_id: str, timestamp: Optional[float] = None) -> bool:
+        """检查指定时间（默认当前）是否是免打扰时段"""
+        current_hour = datetime.fromtimestamp(time.time() if timestamp is None else timestamp).hour
         settings = self.data["settings"].get(group_id, {})
         
-        # 使用群自定义免打扰时段或默认时段
-        quiet_hours = settings.get("custom_quiet_hours", self.quiet_hours)
+        # 使用群自定义免打扰时段或默认时段（未设置时存储的是 None）
+        quiet_hours = settings.get("custom_quiet_hours") or self.quiet_hours
         start_hour = quiet_hours["start"]
         end_hour = quiet_hours["end"]
         
@@ -123,104 +225,166 @@ class GroupActivityManager:
         # 如果 custom_threshold 为 None 或无效值，返回默认阈值
         return custom_threshold if isinstance(custom_threshold, int) and custom_threshold > 0 else self.cold_threshold
     
-    def _can_send_reminder(self, group_id: str) -> bool:
-        """检查是否可以发送提醒"""
-        current_time = int(time.time())
-        last_reminder = self.data["last_reminder"].get(group_id, 0)
-        
-        # 检查是否启用了活跃度检查
-        settings = self.data["settings"].get(group_id, {})
-        if not settings.get("is_enabled", True):
-            return False
-            
-        # 检查是否在免打扰时段
-        if self._is_quiet_hours(group_id):
-            return False
-            
-        # 检查距离上次提醒是否足够长
-        if current_time - last_reminder < self.min_reminder_interval:
-            return False
-            
-        return True
-    
-    def _is_typically_active_hour(self, group_id: str) -> bool:
-        """检查当前是否是群的典型活跃时段"""
-        current_hour = datetime.now().hour
-        settings = self.data["settings"].get(group_id, {})
-        activity_pattern = settings.get("activity_pattern", [])
-        
-        if not activity_pattern:
+    def _is_typically_active_hour(self, group_id: str, timestamp: Optional[float] = None) -> bool:
+        """检查指定时间（默认当前）是否是群的典型活跃时段"""
+        with self._lock:
+            ring = self.activity_rings.get(group_id)
+            if ring is None:
+                return True
+            histogram, total = ring.hour_of_day_histogram(_local_hour_number())
+        return self._is_active_in_histogram(histogram, total, _local_hour_number(timestamp) % 24)
+
+    @staticmethod
+    def _is_active_in_histogram(histogram: List[int], total: int, hour_of_day: int) -> bool:
+        if not total:
             return True
-            
-        # 统计该小时的活跃频率
-        hour_frequency = activity_pattern.count(current_hour)
-        total_days = len(activity_pattern) / 24  # 根据记录计算天数
-        
+        total_days = total / 24  # 与旧逻辑一致：按消息总数折算天数
         # 如果该小时的活跃频率低于平均每天一次，认为不是典型活跃时段
-        return hour_frequency >= total_days * 0.5
-    
-    def _check_cold_groups(self):
-        """检查并处理冷群"""
+        return histogram[hour_of_day] >= total_days * 0.5
+
+    def _next_nudge_time(self, group_id: str, now: Optional[float] = None) -> Optional[float]:
+        """
+        计算群下一次可以发送冷群提醒的时间戳，群未启用活跃度检查时返回 None。
+        最早时间为 max(最后活跃 + 冷群阈值, 上次提醒 + 最小提醒间隔)，
+        若该时刻处于免打扰时段或不是群的典型活跃时段，则顺延到下一个合适的整点。
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            settings = self.data["settings"].get(group_id, {})
+            if not settings.get("is_enabled", True):
+                return None
+            last_active = self.data["groups"].get(group_id, now)
+            last_reminder = self.data["last_reminder"].get(group_id, 0)
+            ring = self.activity_rings.get(group_id)
+            histogram, total = ring.hour_of_day_histogram(_local_hour_number(now)) if ring else ([0] * 24, 0)
+
+        candidate = max(
+            last_active + self._get_group_threshold(group_id),
+            last_reminder + self.min_reminder_interval,
+            now,
+        )
+        # 最多向后查找一周的整点，找不到合适时段时一天后再重新评估
+        for _ in range(HourlyActivityRing.SIZE):
+            if not self._is_quiet_hours(group_id, candidate) and \
+                    self._is_active_in_histogram(histogram, total, _local_hour_number(candidate) % 24):
+                return candidate
+            candidate = (int(candidate) // 3600 + 1) * 3600
+        return now + 86400
+
+    def _schedule(self, group_id: str, deadline: float):
+        """设置群的提醒时间；堆中该群旧的条目会在弹出时因时间不匹配而被丢弃"""
+        with self._schedule_cond:
+            self._scheduled[group_id] = deadline
+            heapq.heappush(self._schedule_heap, (deadline, group_id))
+            # 新的截止时间可能早于调度线程当前等待的时间，唤醒它重新计算
+            if self._schedule_heap[0][1] == group_id:
+                self._schedule_cond.notify()
+
+    def _reschedule(self, group_id: str):
+        deadline = self._next_nudge_time(group_id)
+        if deadline is None:
+            with self._schedule_cond:
+                self._scheduled.pop(group_id, None)
+        else:
+            self._schedule(group_id, deadline)
+
+    def _pop_due_group(self) -> str:
+        """阻塞直到堆顶群的截止时间到达，返回该群号"""
+        with self._schedule_cond:
+            while True:
+                if not self._schedule_heap:
+                    self._schedule_cond.wait()
+                    continue
+                deadline, group_id = self._schedule_heap[0]
+                delay = deadline - time.time()
+                if delay > 0:
+                    self._schedule_cond.wait(delay)
+                    continue
+                heapq.heappop(self._schedule_heap)
+                if self._scheduled.get(group_id) != deadline:
+                    continue  # 已被更新的截止时间取代
+                del self._scheduled[group_id]
+                return group_id
+
+    def _run_scheduler(self):
+        """冷群调度循环：只在最早的截止时间到达时醒来"""
         while True:
             try:
-                current_time = int(time.time())
-                
-                for group_id, last_active in self.data["groups"].items():
-                    # 获取群特定的冷群阈值
-                    threshold = self._get_group_threshold(group_id)
-                    
-                    if current_time - last_active >= threshold:
-                        # 只在群的典型活跃时段发送提醒
-                        if not self._is_typically_active_hour(group_id):
-                            continue
-                            
-                        # 检查是否可以发送提醒
-                        if not self._can_send_reminder(group_id):
-                            continue
-                            
-                        try:
-                            inactive_hours = (current_time - last_active) // 3600
-                            # 构建更自然的提醒消息
-                            system_message = {
-                                "role": "system",
-                                "content": (
-                                    f"这个群已经 {inactive_hours} 小时没有互动了。"
-                                    f"现在是群里较活跃的时段，建议找个话题活跃一下气氛。比如戳一戳、@一下谁，总之不要让人觉得你很怪异。"
-                                    f"注意要自然，避免机械化的提醒。可以根据当前时间段（{datetime.now().hour}点）"
-                                    f"选择合适 简短的话题。"
-                                )
-                            }
-                            
-                            # 调用对话处理函数发送消息
-                            if self.process_conversation:
-                                for segment in self.process_conversation(
-                                    group_id,
-                                    system_message["content"],
-                                    chat_type="group"
-                                ):
-                                    pass
-                                
-                                # 记录本次提醒时间
-                                self.data["last_reminder"][group_id] = current_time
-                                self._save_activity()
-                                
-                        except Exception as e:
-                            print(f"处理冷群 {group_id} 时出错: {e}")
-                            continue
-                
-                # 等待到下一个检查周期
-                time.sleep(self.check_interval)
-                
+                group_id = self._pop_due_group()
+                now = time.time()
+                # 截止时间是入堆时算的，期间群可能又活跃过或修改了设置，弹出时重新计算
+                deadline = self._next_nudge_time(group_id, now)
+                if deadline is None:
+                    continue
+                if deadline > now + 1:
+                    self._schedule(group_id, deadline)
+                    continue
+
+                # 全局限速：两次提醒之间至少间隔 nudge_spacing 秒
+                next_slot = self._last_dispatch + self.nudge_spacing
+                if next_slot > now:
+                    self._schedule(group_id, next_slot)
+                    continue
+                self._last_dispatch = now
+
+                with self._lock:
+                    last_active = self.data["groups"].get(group_id, int(now))
+                    self.data["last_reminder"][group_id] = int(now)
+                self._flusher.mark_dirty()
+                self._executor.submit(self._send_nudge, group_id, int(now - last_active) // 3600)
+                self._reschedule(group_id)
             except Exception as e:
-                print(f"群活跃度检查循环出错: {e}")
+                print(f"群活跃度调度循环出错: {e}")
                 time.sleep(60)  # 发生错误时等待1分钟后继续
-    
+
+    def _send_nudge(self, group_id: str, inactive_hours: int):
+        """在线程池中为冷群生成并发送活跃气氛的消息"""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._send_nudge_async(group_id, inactive_hours))
+        except Exception as e:
+            print(f"处理冷群 {group_id} 时出错: {e}")
+        finally:
+            loop.close()
+
+    async def _send_nudge_async(self, group_id: str, inactive_hours: int):
+        from napcat.rate_limiter import PRIORITY_PROACTIVE
+        from utils.ai_message_parser import parse_ai_message_to_segments
+
+        prompt = (
+            f"这个群已经 {inactive_hours} 小时没有互动了。"
+            f"现在是群里较活跃的时段，建议找个话题活跃一下气氛。比如戳一戳、@一下谁，总之不要让人觉得你很怪异。"
+            f"注意要自然，避免机械化的提醒。可以根据当前时间段（{datetime.now().hour}点）"
+            f"选择合适 简短的话题。"
+        )
+        print(f"[INFO] 群 {group_id} 已冷却 {inactive_hours} 小时，发送活跃提醒")
+        for segment_text in batch_segments(self.process_conversation(group_id, prompt, chat_type="group")):
+            msg_segments = await parse_ai_message_to_segments(segment_text, None, chat_id=group_id, chat_type="group")
+            non_poke_segments = []
+            for seg in msg_segments:
+                if seg["type"] == "poke":
+                    try:
+                        self.sender.send_poke(int(group_id), int(seg["data"]["qq"]), priority=PRIORITY_PROACTIVE)
+                    except Exception as poke_err:
+                        print(f"[ERROR] 发送戳一戳失败: {poke_err}")
+                else:
+                    non_poke_segments.append(seg)
+            if non_poke_segments:
+                self.sender.send_group_msg(int(group_id), non_poke_segments, priority=PRIORITY_PROACTIVE)
+                await asyncio.sleep(typing_delay())  # 模拟打字延迟
+
     def _start_check_thread(self):
-        """启动群活跃度检查线程"""
-        if not self.process_conversation:
-            print("[Warning] 群活跃度检查线程未启动：process_conversation 未初始化")
+        """为所有已知群计算提醒时间并启动调度线程"""
+        if not self.process_conversation or not self.sender:
+            print("[Warning] 群活跃度检查线程未启动：process_conversation 或 sender 未初始化")
             return
-        threading.Thread(target=self._check_cold_groups, daemon=True).start()
+        with self._lock:
+            group_ids = list(self.data["groups"])
+        for group_id in group_ids:
+            self._reschedule(group_id)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_nudges, thread_name_prefix="cold-group")
+        threading.Thread(target=self._run_scheduler, daemon=True).start()
 
     def set_group_settings(self, group_id: str, settings: Dict):
         """设置群的自定义配置"""
@@ -228,8 +392,11 @@ class GroupActivityManager:
             self.data["settings"][group_id] = {}
         
         # 更新设置
-        self.data["settings"][group_id].update(settings)
-        self._save_activity()
+        with self._lock:
+            self.data["settings"][group_id].update(settings)
+        self._flusher.mark_dirty()
+        # 阈值、免打扰时段或开关可能变化，立即重新计算提醒时间
+        self._reschedule(group_id)
 
 # 创建全局单例实例
 group_activity_manager = GroupActivityManager() 
\ No newline at end of file
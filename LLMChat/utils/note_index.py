@@ -0,0 +1,76 @@
+"""
+笔记检索索引：对角色笔记做 BM25 相关度排序，只把与当前对话相关的笔记注入系统提示。
+- 分词：英文/数字按单词切分（小写），中文按单字 + 相邻二元组切分，不依赖额外的分词库
+- 可选：通过 AINotebook.set_embedding_function 注入本地向量模型，与 BM25 分数加权融合
+"""
+import math
+import re
+from collections import Counter
+from typing import Callable, List, Sequence
+
+# 向量化函数：输入文本，返回定长向量
+EmbeddingFunction = Callable[[str], Sequence[float]]
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+|[\u4e00-\u9fff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """将中英文混合文本切分为检索用的词项列表"""
+    tokens: List[str] = []
+    if not isinstance(text, str):
+        return tokens
+    for chunk in _TOKEN_RE.findall(text.lower()):
+        if "\u4e00" <= chunk[0] <= "\u9fff":
+            # 中文：单字保证召回，二元组提升短语匹配的精度
+            tokens.extend(chunk)
+            tokens.extend(chunk[i:i + 2] for i in range(len(chunk) - 1))
+        else:
+            tokens.append(chunk)
+    return tokens
+
+
+def cosine_similarity(a: Sequence[float], b: Sequence[float]) -> float:
+    """计算两个向量的余弦相似度，任一向量为零向量时返回 0"""
+    dot = sum(x * y for x, y in zip(a, b))
+    norm_a = math.sqrt(sum(x * x for x in a))
+    norm_b = math.sqrt(sum(y * y for y in b))
+    if not norm_a or not norm_b:
+        return 0.0
+    return dot / (norm_a * norm_b)
+
+
+class BM25Index:
+    """针对一组文档（单个角色的笔记）构建的 BM25 倒排统计，构建后只读"""
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_terms = [Counter(tokenize(doc)) for doc in documents]
+        self.doc_lengths = [sum(terms.values()) for terms in self.doc_terms]
+        total_docs = len(self.doc_terms)
+        self.avg_doc_length = (sum(self.doc_lengths) / total_docs) if total_docs else 0.0
+
+        doc_freq: Counter = Counter()
+        for terms in self.doc_terms:
+            doc_freq.update(terms.keys())
+        self.idf = {
+            term: math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for term, df in doc_freq.items()
+        }
+
+    def scores(self, query: str) -> List[float]:
+        """返回每篇文档针对 query 的 BM25 分数，顺序与构建时的文档顺序一致"""
+        query_terms = [t for t in set(tokenize(query)) if t in self.idf]
+        results = [0.0] * len(self.doc_terms)
+        if not query_terms or not self.avg_doc_length:
+            return results
+
+        for i, terms in enumerate(self.doc_terms):
+            length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / self.avg_doc_length)
+            score = 0.0
+            for term in query_terms:
+                tf = terms.get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + length_norm)
+            results[i] = score
+        return results
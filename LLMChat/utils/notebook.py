@@ -1,12 +1,20 @@
 import json
 import os
-from typing import List, Dict, Optional, DefaultDict
+from typing import List, Dict, Optional, DefaultDict, Tuple
 import time
 from collections import defaultdict
 
+from config import CONFIG
+from utils.text import estimate_tokens
+from utils.note_index import BM25Index, EmbeddingFunction, cosine_similarity
+
 # 默认的角色键，用于存储未指定角色时的笔记
 DEFAULT_ROLE_KEY = "__global__"
 
+# 笔记注入模式：all 为注入全部笔记，relevant 为按当前对话检索相关笔记
+NOTE_RETRIEVAL_MODE_ALL = "all"
+NOTE_RETRIEVAL_MODE_RELEVANT = "relevant"
+
 class AINotebook:
     def __init__(self, notebook_file: str = os.path.join("data", "notebook_by_role.json")):
         """
@@ -18,6 +26,24 @@ class AINotebook:
         # 使用 defaultdict 简化角色笔记列表的初始化
         # self.notes 的结构: Dict[角色名_str, List[笔记_Dict]]
         self.notes: DefaultDict[str, List[Dict]] = defaultdict(list)
+        # 每个角色的笔记版本号，笔记变更时递增，用于判断检索索引是否过期
+        self._versions: DefaultDict[str, int] = defaultdict(int)
+        # 检索索引缓存: 角色 -> (版本号, BM25 索引)
+        self._index_cache: Dict[str, Tuple[int, BM25Index]] = {}
+        # 可选的本地向量化函数及其在打分中的权重
+        self._embedding_func: Optional[EmbeddingFunction] = None
+        self._embedding_weight = 0.5
+        # 笔记向量缓存: (角色, 笔记ID, 内容) -> 向量
+        self._embedding_cache: Dict[Tuple[str, int, str], List[float]] = {}
+        # 检索统计，用于观察按需注入节省的 token
+        self.retrieval_stats = {
+            "requests": 0,
+            "notes_total": 0,
+            "notes_injected": 0,
+            "tokens_full": 0,
+            "tokens_injected": 0,
+            "tokens_saved": 0,
+        }
         self._ensure_notebook_file()
         self._load_notes()
     
@@ -53,6 +79,13 @@ class AINotebook:
             print(f"[错误] 加载笔记本时发生未知错误: {e}")
             self.notes = defaultdict(list) # 出错时重置为空
     
+    def _mark_changed(self, role: str):
+        """标记角色笔记已变更，使该角色的检索索引失效"""
+        self._versions[role] += 1
+        self._index_cache.pop(role, None)
+        if self._embedding_cache:
+            self._embedding_cache = {k: v for k, v in self._embedding_cache.items() if k[0] != role}
+
     def _save_notes(self):
         """保存所有角色的笔记"""
         try:
@@ -90,6 +123,7 @@ class AINotebook:
                 "created_at": int(time.time())
             }
             self.notes[role].append(note)
+            self._mark_changed(role)
             self._save_notes()
             print(f"[信息] 已为角色 '{role}' 添加笔记 (ID: {note_id})")
             return note["id"]
@@ -112,6 +146,7 @@ class AINotebook:
             self.notes[role] = [note for note in notes_list if note.get("id") != note_id]
             
             if len(self.notes[role]) < original_length:
+                self._mark_changed(role)
                 self._save_notes()
                 print(f"[信息] 已从角色 '{role}' 删除笔记 (ID: {note_id})")
                 return True
@@ -131,31 +166,156 @@ class AINotebook:
         """
         return self.notes[role]
     
-    def get_notes_as_context(self, role: str = DEFAULT_ROLE_KEY) -> str:
+    def pin_note(self, note_id: int, role: str = DEFAULT_ROLE_KEY, pinned: bool = True) -> bool:
+        """
+        置顶或取消置顶指定笔记。置顶笔记在检索模式下始终注入。
+
+        :param note_id: 笔记 ID (特定于角色列表)。
+        :param role: 笔记所属的角色。默认为全局笔记。
+        :param pinned: True 为置顶，False 为取消置顶。
+        :return: 是否找到并更新了该笔记。
+        """
+        for note in self.notes[role]:
+            if note.get("id") == note_id:
+                note["pinned"] = pinned
+                self._mark_changed(role)
+                self._save_notes()
+                print(f"[信息] 已{'置顶' if pinned else '取消置顶'}角色 '{role}' 的笔记 (ID: {note_id})")
+                return True
+        print(f"[信息] 在角色 '{role}' 中未找到要置顶的笔记 (ID: {note_id})")
+        return False
+
+    def set_embedding_function(self, embedding_func: Optional[EmbeddingFunction], weight: float = 0.5):
+        """
+        注入本地向量化函数，检索时与 BM25 分数加权融合。传入 None 则仅使用 BM25。
+
+        :param embedding_func: 输入文本返回向量的函数。
+        :param weight: 向量相似度在最终分数中的权重 (0~1)。
+        """
+        self._embedding_func = embedding_func
+        self._embedding_weight = min(max(weight, 0.0), 1.0)
+        self._embedding_cache.clear()
+
+    def _format_note_line(self, note: Dict) -> str:
+        """将单条笔记格式化为上下文中的一行"""
+        content = note.get("content", "内容丢失")
+        created_at_ts = note.get("created_at")
+        created_at_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(created_at_ts)) if created_at_ts else "未知时间"
+        # 使用笔记 ID 方便引用
+        return f"- (ID: {note.get('id', 'N/A')}) {content} (记录于 {created_at_str})\\n"
+
+    def _build_context(self, role: str, notes_list: List[Dict]) -> str:
+        """将笔记列表按创建时间排序后拼接为上下文字符串"""
+        role_display = "全局" if role == DEFAULT_ROLE_KEY else role
+        context = f"以下是为角色 **{role_display}** 记录的重要信息：\\n"
+        # 按创建时间排序可能更有用
+        sorted_notes = sorted(notes_list, key=lambda x: x.get("created_at", 0))
+        for note in sorted_notes:
+            context += self._format_note_line(note)
+        return context.strip()
+
+    def _get_index(self, role: str) -> BM25Index:
+        """获取角色的 BM25 索引，笔记变更后惰性重建"""
+        version = self._versions[role]
+        cached = self._index_cache.get(role)
+        if cached and cached[0] == version:
+            return cached[1]
+        index = BM25Index([note.get("content", "") for note in self.notes[role]])
+        self._index_cache[role] = (version, index)
+        return index
+
+    def _score_notes(self, role: str, query: str) -> List[float]:
+        """计算角色下每条笔记与 query 的相关度分数"""
+        scores = self._get_index(role).scores(query)
+        if not self._embedding_func:
+            return scores
+
+        try:
+            max_bm25 = max(scores) if scores else 0.0
+            query_vec = self._embedding_func(query)
+            fused = []
+            for note, bm25_score in zip(self.notes[role], scores):
+                cache_key = (role, note.get("id", 0), note.get("content", ""))
+                note_vec = self._embedding_cache.get(cache_key)
+                if note_vec is None:
+                    note_vec = list(self._embedding_func(note.get("content", "")))
+                    self._embedding_cache[cache_key] = note_vec
+                normalized_bm25 = bm25_score / max_bm25 if max_bm25 else 0.0
+                similarity = cosine_similarity(query_vec, note_vec)
+                fused.append((1 - self._embedding_weight) * normalized_bm25 + self._embedding_weight * similarity)
+            return fused
+        except Exception as e:
+            print(f"[错误] 笔记向量检索失败，回退为 BM25: {e}")
+            return scores
+
+    def _select_relevant_notes(self, role: str, query: Optional[str], top_k: int, max_tokens: int) -> List[Dict]:
+        """按 置顶 > 相关度 > 最近记录 的优先级挑选笔记；置顶笔记总是注入，token 上限只约束其余笔记"""
+        notes_list = self.notes[role]
+        pinned = [note for note in notes_list if note.get("pinned")]
+        candidates = [note for note in notes_list if not note.get("pinned")]
+
+        ranked: List[Dict] = []
+        if query and candidates:
+            scores = self._score_notes(role, query)
+            scored = [(score, note) for score, note in zip(scores, notes_list) if not note.get("pinned") and score > 0]
+            scored.sort(key=lambda item: item[0], reverse=True)
+            ranked = [note for _, note in scored[:top_k]]
+        if not ranked:
+            # 没有查询或没有命中时，退化为注入最近的笔记
+            ranked = sorted(candidates, key=lambda x: x.get("created_at", 0), reverse=True)[:top_k]
+
+        selected: List[Dict] = list(pinned)
+        used_tokens = sum(estimate_tokens(self._format_note_line(note)) for note in pinned)
+        for note in ranked:
+            note_tokens = estimate_tokens(self._format_note_line(note))
+            if selected and used_tokens + note_tokens > max_tokens:
+                continue
+            selected.append(note)
+            used_tokens += note_tokens
+        return selected
+
+    def get_notes_as_context(self, role: str = DEFAULT_ROLE_KEY, query: Optional[str] = None, record_stats: bool = True) -> str:
         """
         将指定角色的笔记转换为系统提示的上下文格式。
 
+        配置 notebook.retrieval_mode 为 "relevant" 时，只注入置顶笔记和与 query 最相关的 top_k 条笔记；
+        置顶笔记总是全部注入，相关笔记受 notebook.max_tokens 限制。否则注入该角色的全部笔记。
+
         :param role: 要生成上下文的角色。默认为全局笔记。
+        :param query: 当前轮次的用户输入，用于检索相关笔记。
+        :param record_stats: 是否将本次检索计入 retrieval_stats。
         :return: 格式化后的上下文字符串，如果没有笔记则为空字符串。
         """
         notes_list = self.notes[role]
         if not notes_list:
             return ""
-        
-        role_display = "全局" if role == DEFAULT_ROLE_KEY else role
-        context = f"以下是为角色 **{role_display}** 记录的重要信息：\\n"
-        # 按创建时间排序可能更有用
-        sorted_notes = sorted(notes_list, key=lambda x: x.get("created_at", 0))
 
-        for note in sorted_notes:
-            content = note.get("content", "内容丢失")
-            created_at_ts = note.get("created_at")
-            created_at_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(created_at_ts)) if created_at_ts else "未知时间"
-            # 使用笔记 ID 方便引用
-            context += f"- (ID: {note.get('id', 'N/A')}) {content} (记录于 {created_at_str})\\n"
-            
-        return context.strip()
-    
+        notebook_config = CONFIG.get("notebook", {})
+        if notebook_config.get("retrieval_mode", NOTE_RETRIEVAL_MODE_ALL) != NOTE_RETRIEVAL_MODE_RELEVANT:
+            return self._build_context(role, notes_list)
+
+        top_k = notebook_config.get("top_k", 8)
+        max_tokens = notebook_config.get("max_tokens", 1200)
+        selected = self._select_relevant_notes(role, query, top_k, max_tokens)
+        context = self._build_context(role, selected)
+
+        if not record_stats:
+            return context
+
+        # 统计按需注入节省的 token
+        tokens_full = estimate_tokens(self._build_context(role, notes_list)) if len(selected) < len(notes_list) else estimate_tokens(context)
+        tokens_injected = estimate_tokens(context)
+        stats = self.retrieval_stats
+        stats["requests"] += 1
+        stats["notes_total"] += len(notes_list)
+        stats["notes_injected"] += len(selected)
+        stats["tokens_full"] += tokens_full
+        stats["tokens_injected"] += tokens_injected
+        stats["tokens_saved"] += tokens_full - tokens_injected
+        print(f"[Debug] 笔记检索: 角色 '{role}' 注入 {len(selected)}/{len(notes_list)} 条，"
+              f"约 {tokens_injected}/{tokens_full} tokens (累计节省 {stats['tokens_saved']} tokens)")
+        return context
+
     def clear_notes_for_role(self, role: str = DEFAULT_ROLE_KEY):
         """
         清空指定角色的所有笔记。
@@ -165,6 +325,7 @@ class AINotebook:
         if role in self.notes:
             original_count = len(self.notes[role])
             del self.notes[role] # 直接移除该角色的条目
+            self._mark_changed(role)
             self._save_notes()
             print(f"[信息] 已清空角色 '{role}' 的 {original_count} 条笔记。")
         else:
@@ -173,6 +334,8 @@ class AINotebook:
     def clear_all_notes(self):
         """清空所有角色的所有笔记"""
         total_cleared = sum(len(notes) for notes in self.notes.values())
+        for role in list(self.notes.keys()):
+            self._mark_changed(role)
         self.notes = defaultdict(list)
         self._save_notes()
         print(f"[信息] 已清空所有角色的共 {total_cleared} 条笔记。")
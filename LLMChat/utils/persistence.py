@@ -0,0 +1,89 @@
+"""
+通用持久化工具
+- atomic_write_json: 先写临时文件再原子替换，避免进程中途退出留下半截 JSON
+- WriteBehindFlusher: 合并一段时间内的多次修改，延迟后一次性落盘（write-behind）
+- flush_all: 进程退出或重启前刷新所有待写入的数据
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, List, Optional
+
+
+def atomic_write_json(file_path: str, data: Any, indent: Optional[int] = 2):
+    """将 data 以 JSON 格式原子地写入 file_path，失败时抛出异常且不破坏原文件"""
+    directory = os.path.dirname(file_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+_flushers: List["WriteBehindFlusher"] = []
+_flushers_lock = threading.Lock()
+
+
+class WriteBehindFlusher:
+    """
+    延迟合并写入器：调用 mark_dirty() 只做标记，首次标记后 delay 秒内的所有修改
+    合并为一次 flush_func() 调用。写入失败时保留脏标记，等待下一次刷新重试。
+    """
+
+    def __init__(self, name: str, flush_func: Callable[[], None], delay: float = 2.0):
+        self.name = name
+        self.flush_func = flush_func
+        self.delay = delay
+        self._dirty = False
+        self._timer: Optional[threading.Timer] = None
+        self._state_lock = threading.Lock()
+        # 保证同一时刻只有一个线程在执行 flush_func
+        self._flush_lock = threading.Lock()
+        with _flushers_lock:
+            _flushers.append(self)
+
+    def mark_dirty(self):
+        """标记数据已修改，必要时启动延迟刷新定时器"""
+        with self._state_lock:
+            self._dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """立即写入待刷新的数据；没有修改时什么也不做"""
+        with self._flush_lock:
+            with self._state_lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._dirty:
+                    return
+                self._dirty = False
+            try:
+                self.flush_func()
+            except Exception as e:
+                print(f"[ERROR] 写入 {self.name} 失败，将在下次刷新时重试: {e}")
+                with self._state_lock:
+                    self._dirty = True
+
+
+def flush_all():
+    """立即刷新所有 WriteBehindFlusher 中待写入的数据"""
+    with _flushers_lock:
+        flushers = list(_flushers)
+    for flusher in flushers:
+        flusher.flush()
+
+
+atexit.register(flush_all)
@@ -4,6 +4,9 @@ from typing import Dict, List, Optional, Tuple, Any
 import time
 import random
 import string
+import threading
+
+from utils.persistence import atomic_write_json, WriteBehindFlusher
 
 # 激活角色状态存储
 # key: (chat_id: str, chat_type: str), value: role_name: str (None for default)
@@ -15,6 +18,7 @@ role_switch_flags: Dict[tuple[str, str], bool] = {}
 # 文件路径
 ROLES_FILE = os.path.join("data", "roles.json")
 PENDING_ROLES_FILE = os.path.join("data", "pending_roles.json")
+ACTIVE_ROLES_FILE = os.path.join("data", "active_roles.json")
 
 def _ensure_file(file_path: str, default_content: Any = {}):
     """确保 JSON 文件和目录存在"""
@@ -46,13 +50,138 @@ def _save_json(file_path: str, data: Any):
     except IOError as e:
         print(f"[ERROR] 保存 JSON 文件失败: {file_path}, Error: {e}")
 
+# 激活角色状态持久化
+# 文件中的 key 为 "chat_type:chat_id"，重启后恢复各聊天的角色，避免按错误的角色 key 加载历史
+def _state_key_to_str(state_key: Tuple[str, str]) -> str:
+    chat_id, chat_type = state_key
+    return f"{chat_type}:{chat_id}"
+
+def _state_key_from_str(key: str) -> Optional[Tuple[str, str]]:
+    chat_type, sep, chat_id = key.partition(":")
+    return (chat_id, chat_type) if sep and chat_id else None
+
+def _write_role_state():
+    """将激活角色和角色切换标志写入文件"""
+    data = {
+        "active_roles": {_state_key_to_str(k): v for k, v in list(active_roles.items()) if v},
+        "role_switch_flags": [_state_key_to_str(k) for k, v in list(role_switch_flags.items()) if v],
+    }
+    atomic_write_json(ACTIVE_ROLES_FILE, data)
+
+def _restore_role_state():
+    """启动时从文件恢复激活角色和角色切换标志"""
+    if not os.path.exists(ACTIVE_ROLES_FILE):
+        return
+    data = _load_json(ACTIVE_ROLES_FILE, default_return={})
+    for key, role_name in data.get("active_roles", {}).items():
+        state_key = _state_key_from_str(key)
+        if state_key and isinstance(role_name, str) and role_name:
+            active_roles[state_key] = role_name
+    for key in data.get("role_switch_flags", []):
+        state_key = _state_key_from_str(key)
+        if state_key:
+            role_switch_flags[state_key] = True
+    if active_roles or role_switch_flags:
+        print(f"[INFO] 已恢复 {len(active_roles)} 个聊天的激活角色，{len(role_switch_flags)} 个待处理的角色切换标志")
+
+# 角色状态变化频繁，合并 2 秒内的修改后再落盘
+_role_state_flusher = WriteBehindFlusher("激活角色状态", _write_role_state, delay=2.0)
+
+def _render_role_selection_prompt(role_names: List[str]) -> str:
+    """生成包含角色列表和切换指令的系统提示片段"""
+    if not role_names:
+        return "" # 没有自定义角色时，不添加任何提示
+
+    prompt = "\n\n角色切换指令\n"
+    prompt += "你可以根据对话内容、氛围或自己的状态（比如快睡觉了、受到攻击、不开心或者...），在合适的时机切换到不同的角色来回应。"
+    prompt += "可用角色列表：\n"
+    prompt += " - 默认(Saki&Nya)\n"
+    prompt += "\n".join(f" - {name}" for name in role_names)
+    prompt += "\n\n切换角色时，请在你的回复中（单独一行或与其他内容一起）使用以下内部标记：\n"
+    prompt += "`[setrole:角色名称]` 或 `[setrole:default]`\n"
+    prompt += "例如：要切换到角色'默认（Saki&Nya）'，使用 `[setrole:default]`\n"
+    prompt += "切换是内部操作，用户不会看到这个标记。请自然地完成角色转换。"
+    prompt += "请不要过于频繁地切换角色。"
+    prompt += "\n"
+    return prompt
+
+class RoleCatalog:
+    """
+    角色目录的内存缓存。
+    首次访问时从 roles.json 加载，之后仅在文件 mtime 变化（外部编辑）或通过
+    save_roles 修改时重新加载，同时预先渲染好角色切换提示片段。
+    """
+
+    # 两次检查文件 mtime 的最小间隔（秒），避免每条消息都 stat 一次文件
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, roles_file: str):
+        self.roles_file = roles_file
+        self.roles: Dict[str, str] = {}
+        self.selection_prompt = ""
+        self._mtime: Optional[int] = None
+        self._loaded = False
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _file_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.roles_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _set_roles(self, roles: Dict[str, str]):
+        self.roles = dict(roles)
+        self.selection_prompt = _render_role_selection_prompt(list(self.roles.keys()))
+
+    def _refresh_if_stale(self):
+        now = time.monotonic()
+        if self._loaded and now - self._last_check < self.CHECK_INTERVAL:
+            return
+        with self._lock:
+            self._last_check = now
+            mtime = self._file_mtime()
+            if self._loaded and mtime == self._mtime:
+                return
+            self._set_roles(_load_json(self.roles_file, default_return={}))
+            self._mtime = self._file_mtime()
+            if self._loaded:
+                print(f"[INFO] 检测到角色文件变化，已重新加载 {len(self.roles)} 个角色")
+            self._loaded = True
+
+    def get_roles(self) -> Dict[str, str]:
+        """返回缓存中的角色字典（只读，调用方不要修改）"""
+        self._refresh_if_stale()
+        return self.roles
+
+    def get_selection_prompt(self) -> str:
+        """返回预先渲染好的角色切换提示片段"""
+        self._refresh_if_stale()
+        return self.selection_prompt
+
+    def update(self, roles: Dict[str, str]):
+        """角色写入文件后调用，直接用新数据刷新缓存"""
+        with self._lock:
+            self._set_roles(roles)
+            self._mtime = self._file_mtime()
+            self._last_check = time.monotonic()
+            self._loaded = True
+
+    def invalidate(self):
+        """丢弃缓存，下次访问时从文件重新加载"""
+        with self._lock:
+            self._loaded = False
+
+role_catalog = RoleCatalog(ROLES_FILE)
+
 def load_roles() -> Dict[str, str]:
-    """加载所有角色，返回一个 名字->Prompt 的字典"""
-    return _load_json(ROLES_FILE, default_return={})
+    """加载所有角色，返回一个 名字->Prompt 的字典（缓存的副本，可自由修改）"""
+    return dict(role_catalog.get_roles())
 
 def save_roles(roles: Dict[str, str]):
-    """保存角色字典到文件"""
+    """保存角色字典到文件，并同步刷新角色目录缓存"""
     _save_json(ROLES_FILE, roles)
+    role_catalog.update(roles)
 
 def add_role(name: str, prompt: str) -> bool:
     """添加一个新角色。如果名字已存在则失败。"""
@@ -101,8 +230,7 @@ def delete_role(name: str) -> bool:
 
 def get_role_names() -> List[str]:
     """获取所有角色的名称列表"""
-    roles = load_roles()
-    return list(roles.keys())
+    return list(role_catalog.get_roles().keys())
 
 def set_active_role(chat_id: str, chat_type: str, role_name: Optional[str]):
     """设置当前聊天的激活角色，并在角色实际更改时设置切换标志。"""
@@ -119,14 +247,14 @@ def set_active_role(chat_id: str, chat_type: str, role_name: Optional[str]):
             if old_role is not None: # 确保是从一个非默认角色切换到默认
                  role_switch_flags[state_key] = True
                  print(f"[DEBUG] Role switch flag set for {state_key} (to default)")
+            _role_state_flusher.mark_dirty()
         else:
             # 本来就是默认，无需操作也无需设置 flag
             print(f"[INFO] Chat ({chat_id}, {chat_type}) 当前已是默认角色，无需切换。")
         return True # 切换到默认总是"成功"的
 
     # 处理切换到特定角色的情况
-    roles = load_roles()
-    if normalized_new_role_name not in roles:
+    if normalized_new_role_name not in role_catalog.get_roles():
         print(f"[ERROR] 尝试设置的角色 '{normalized_new_role_name}' 不存在。")
         return False # 指示设置失败
 
@@ -134,6 +262,7 @@ def set_active_role(chat_id: str, chat_type: str, role_name: Optional[str]):
     if old_role != normalized_new_role_name:
         active_roles[state_key] = normalized_new_role_name
         role_switch_flags[state_key] = True
+        _role_state_flusher.mark_dirty()
         print(f"[INFO] Chat ({chat_id}, {chat_type}) 已切换到角色: {normalized_new_role_name}")
         print(f"[DEBUG] Role switch flag set for {state_key} (to {normalized_new_role_name})")
     else:
@@ -151,28 +280,12 @@ def get_active_role_prompt(chat_id: str, chat_type: str) -> Optional[str]:
     """获取当前激活角色的 Prompt"""
     role_name = get_active_role(chat_id, chat_type)
     if role_name:
-        roles = load_roles()
-        return roles.get(role_name) # 如果角色被删了，这里会返回 None
+        return role_catalog.get_roles().get(role_name) # 如果角色被删了，这里会返回 None
     return None
 
 def get_role_selection_prompt() -> str:
-    """生成包含角色列表和切换指令的系统提示片段"""
-    role_names = get_role_names()
-    if not role_names:
-        return "" # 没有自定义角色时，不添加任何提示
-    
-    prompt = "\n\n角色切换指令\n"
-    prompt += "你可以根据对话内容、氛围或自己的状态（比如快睡觉了、受到攻击、不开心或者...），在合适的时机切换到不同的角色来回应。"
-    prompt += "可用角色列表：\n"
-    prompt += " - 默认(Saki&Nya)\n"
-    prompt += "\n".join(f" - {name}" for name in role_names)
-    prompt += "\n\n切换角色时，请在你的回复中（单独一行或与其他内容一起）使用以下内部标记：\n"
-    prompt += "`[setrole:角色名称]` 或 `[setrole:default]`\n"
-    prompt += "例如：要切换到角色'默认（Saki&Nya）'，使用 `[setrole:default]`\n"
-    prompt += "切换是内部操作，用户不会看到这个标记。请自然地完成角色转换。"
-    prompt += "请不要过于频繁地切换角色。"
-    prompt += "\n"
-    return prompt
+    """获取包含角色列表和切换指令的系统提示片段（角色目录变化时才重新生成）"""
+    return role_catalog.get_selection_prompt()
 
 # 待审核角色管理
 def _load_pending_roles() -> Dict[str, Dict]:
@@ -263,8 +376,11 @@ def check_and_clear_role_switch_flag(chat_id: str, chat_type: str) -> bool:
     switched = role_switch_flags.pop(state_key, False)
     if switched:
         print(f"[DEBUG] Consumed role switch flag for {state_key}")
+        _role_state_flusher.mark_dirty()
     return switched
 
 # 初始化时确保文件存在
 _ensure_file(ROLES_FILE)
-_ensure_file(PENDING_ROLES_FILE) 
\ No newline at end of file
+_ensure_file(PENDING_ROLES_FILE)
+# 恢复上次运行时各聊天的激活角色
+_restore_role_state() 
\ No newline at end of file
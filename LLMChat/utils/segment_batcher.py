@@ -0,0 +1,145 @@
+"""
+回复分段合并
+AI 回复按行流式返回，每行单独发送会产生大量 API 调用和打字延迟。
+batch_segments 在分段流和发送之间合并连续的短文本分段：
+- [send] 是硬边界：llm_api 会把 [send] 之前的分段标记为 HardBoundary，合并不会跨过它；
+  [send] 前没有新内容时 llm_api 会发出空的 HardBoundary，只表示"在此断开"，本身不发送
+- 带有功能标签（[reply]、[music:]、[poke:] 等）的分段不参与合并，单独发送
+- 合并后的消息不超过 max_chars 个字符
+- 第一个分段到达后最多等待 max_delay 秒，之后即使后续分段还没生成也立即发送
+"""
+import queue
+import random
+import re
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from config import CONFIG
+
+
+class HardBoundary(str):
+    """以 [send] 结尾的回复分段，合并时必须在它之后断开；空字符串表示单独的断开标记"""
+
+
+DEFAULT_BATCHING = {
+    "enabled": True,
+    "max_chars": 200,  # 合并后单条消息的最大字符数
+    "short_chars": 60,  # 只有不超过该长度的分段才会被合并
+    "max_delay": 1.5,  # 第一个分段最多等待多少秒再发送
+    "typing_delay": [1.0, 3.0],  # 两条消息之间模拟打字的随机延迟范围（秒）
+}
+
+# 需要由解析器单独处理的标签，包含这些标签的分段不参与合并
+_TAG_RE = re.compile(r"\[(?:reply|music|note|poke|emoji|setrole|event|event_end|longtext)\b")
+
+_END = object()
+
+
+def get_batching_options() -> dict:
+    options = dict(DEFAULT_BATCHING)
+    options.update(CONFIG["qqbot"].get("batching") or {})
+    return options
+
+
+def typing_delay() -> float:
+    """返回一次模拟打字的随机延迟（秒）"""
+    low, high = get_batching_options()["typing_delay"]
+    return random.uniform(low, high)
+
+
+def _is_mergeable(segment: str, short_chars: int) -> bool:
+    return len(segment) <= short_chars and not _TAG_RE.search(segment)
+
+
+def _prefetch(segments: Iterable[str]) -> "queue.Queue":
+    """在后台线程中消费分段生成器，使合并阶段可以带超时地等待下一个分段"""
+    q: "queue.Queue" = queue.Queue()
+
+    def produce():
+        try:
+            for segment in segments:
+                q.put((segment, None))
+        except Exception as e:
+            q.put((None, e))
+        finally:
+            q.put((_END, None))
+
+    threading.Thread(target=produce, daemon=True).start()
+    return q
+
+
+def batch_segments(segments: Iterable[str], options: Optional[dict] = None) -> Iterator[str]:
+    """
+    合并连续的短文本分段，返回新的分段迭代器。
+    上游生成器抛出的异常会在当前缓冲的内容发送之后重新抛出。
+    """
+    options = options or get_batching_options()
+    if not options.get("enabled", True):
+        # 不合并时每个分段本来就单独发送，空的断开标记直接丢弃
+        yield from (segment for segment in segments if segment)
+        return
+
+    max_chars = options["max_chars"]
+    short_chars = options["short_chars"]
+    max_delay = options["max_delay"]
+    q = _prefetch(segments)
+
+    buffer: List[str] = []
+    buffer_len = 0
+    deadline = 0.0
+
+    def flush() -> Optional[str]:
+        nonlocal buffer, buffer_len
+        if not buffer:
+            return None
+        merged = "\n".join(buffer)
+        buffer, buffer_len = [], 0
+        return merged
+
+    while True:
+        try:
+            timeout = max(0.0, deadline - time.monotonic()) if buffer else None
+            item: Tuple = q.get(timeout=timeout)
+        except queue.Empty:
+            # 等待超时：先把已缓冲的内容发出去
+            yield flush()
+            continue
+
+        segment, error = item
+        if segment is _END:
+            break
+        if error is not None:
+            merged = flush()
+            if merged:
+                yield merged
+            raise error
+
+        if isinstance(segment, HardBoundary) and not segment:
+            # 单独的 [send] 断开标记：发出已缓冲的内容，不与后续分段合并
+            merged = flush()
+            if merged:
+                yield merged
+            continue
+
+        if not _is_mergeable(segment, short_chars):
+            merged = flush()
+            if merged:
+                yield merged
+            yield segment
+            continue
+
+        # 加入当前分段会超出长度上限时先发送已缓冲的内容
+        if buffer and buffer_len + 1 + len(segment) > max_chars:
+            yield flush()
+        if not buffer:
+            deadline = time.monotonic() + max_delay
+        buffer.append(segment)
+        buffer_len += len(segment) + (1 if len(buffer) > 1 else 0)
+
+        if isinstance(segment, HardBoundary):
+            yield flush()
+
+    merged = flush()
+    if merged:
+        yield merged
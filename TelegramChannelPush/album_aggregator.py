@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# on_album(按 id 排序的相册消息列表, add 时传入的上下文)
+AlbumCallback = Callable[[List[Any], Any], Awaitable[None]]
+
+
+class AlbumAggregator:
+    """
+    按 grouped_id 在内存中收集相册消息。
+    Telegram 会把相册拆成多条几乎同时到达的 NewMessage，
+    最后一条到达后静默 quiet_period 秒（或自第一条起超过 max_wait 秒）即视为完整，整体交给 on_album 处理一次。
+    """
+
+    def __init__(self, on_album: AlbumCallback, quiet_period: float = 1.0, max_wait: float = 5.0):
+        self.on_album = on_album
+        self.quiet_period = quiet_period
+        self.max_wait = max_wait
+        # grouped_id -> {"messages": [...], "context": ..., "first_seen": float, "task": asyncio.Task}
+        self._albums: Dict[int, Dict[str, Any]] = {}
+
+    def is_pending(self, grouped_id: int) -> bool:
+        """该相册是否已有消息在等待聚合"""
+        return grouped_id in self._albums
+
+    def add(self, message, context: Any = None):
+        """加入一条相册消息；context 只在相册的第一条消息时记录。必须在事件循环中调用"""
+        album = self._albums.get(message.grouped_id)
+        if album is None:
+            album = self._albums[message.grouped_id] = {
+                "messages": [], "context": context, "first_seen": time.monotonic(), "task": None,
+            }
+        elif album["task"] is not None:
+            album["task"].cancel()
+        album["messages"].append(message)
+
+        waited = time.monotonic() - album["first_seen"]
+        delay = max(0.0, min(self.quiet_period, self.max_wait - waited))
+        album["task"] = asyncio.get_running_loop().create_task(self._flush_later(message.grouped_id, delay))
+
+    async def _flush_later(self, grouped_id: int, delay: float):
+        await asyncio.sleep(delay)
+        album = self._albums.pop(grouped_id, None)
+        if album is None:
+            return
+        messages = sorted(album["messages"], key=lambda m: m.id)
+        logger.info(f"🔄 正在处理相册 [Group ID: {grouped_id}]，共 {len(messages)} 条消息。")
+        try:
+            await self.on_album(messages, album["context"])
+        except Exception as e:
+            logger.error(f"处理相册 [Group ID: {grouped_id}] 出错: {e}")
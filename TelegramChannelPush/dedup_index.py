@@ -0,0 +1,203 @@
+"""
+本地近似去重索引。
+对 text_for_llm 做字符 shingle 后计算 MinHash 签名，并按 LSH 分桶：
+- 与已转发消息估算相似度超过 duplicate_threshold 时直接判为重复，不再调用 LLM
+- 其余情况只返回最相近的几条历史摘要，交给 LLM 参考
+
+可选通过 embedding_hook（"模块:函数"，函数接收文本返回向量）接入本地 embedding 模型，
+此时额外用余弦相似度判断语义重复、排序相近摘要。
+"""
+import hashlib
+import importlib
+import logging
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_NORMALIZE_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+DEFAULT_DEDUP_CONFIG = {
+    "enabled": True,
+    "num_perm": 64,  # MinHash 签名长度
+    "shingle_size": 3,  # 字符 shingle 长度，对中文 2~3 较合适
+    "min_shingles": 5,  # shingle 数少于该值的文本（纯图片、纯链接、纯表情等）不参与本地去重，直接交给 LLM
+    "duplicate_threshold": 0.8,  # 估算相似度达到该值直接判为重复
+    "related_threshold": 0.2,  # 低于该值的历史摘要不提供给 LLM
+    "max_related": 3,  # 最多提供给 LLM 的相近摘要数
+    "embedding_hook": "",
+    "embedding_threshold": 0.92,
+}
+
+
+def _normalize(text: str) -> str:
+    return _NORMALIZE_RE.sub("", text.lower())
+
+
+def _shingles(text: str, size: int) -> set:
+    text = _normalize(text)
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _stable_hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "big")
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def load_embedding_hook(path: str) -> Optional[Callable[[str], List[float]]]:
+    """按 "模块:函数" 加载 embedding 函数，加载失败时返回 None 并只使用 MinHash"""
+    if not path:
+        return None
+    module_name, _, func_name = path.partition(":")
+    try:
+        return getattr(importlib.import_module(module_name), func_name or "embed")
+    except (ImportError, AttributeError) as e:
+        logging.error(f"Failed to load embedding hook '{path}': {e}")
+        return None
+
+
+class DedupIndex:
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, rows_per_band: int = 2,
+                 embedding_hook: Optional[Callable[[str], List[float]]] = None, seed: int = 1,
+                 min_shingles: int = 5):
+        self.num_perm = num_perm - num_perm % rows_per_band
+        self.shingle_size = shingle_size
+        self.min_shingles = max(1, min_shingles)
+        self.rows_per_band = rows_per_band
+        self.embedding_hook = embedding_hook
+        rng = random.Random(seed)
+        # 每个排列 h -> (a * h + b) mod p
+        self._perms = [(rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+                       for _ in range(self.num_perm)]
+        self._entries: Dict[int, Dict[str, Any]] = {}
+        # LSH 分桶：(band 序号, band 内签名) -> 条目 id 集合
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], set] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def indexable(self, text: str) -> bool:
+        """
+        文本是否有足够的 shingle 参与去重。
+        归一化后几乎为空的文本签名全部相同，彼此相似度恒为 1，不能用来判断重复。
+        """
+        return len(_shingles(text, self.shingle_size)) >= self.min_shingles
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        hashes = [_stable_hash(s) for s in _shingles(text, self.shingle_size)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes) for a, b in self._perms)
+
+    def _bands(self, signature: Tuple[int, ...]):
+        rows = self.rows_per_band
+        for band in range(self.num_perm // rows):
+            yield band, signature[band * rows:(band + 1) * rows]
+
+    def _embed(self, text: str) -> Optional[List[float]]:
+        if self.embedding_hook is None:
+            return None
+        try:
+            return list(self.embedding_hook(text))
+        except Exception as e:
+            logging.error(f"Embedding hook failed: {e}")
+            return None
+
+    def add(self, text: str, summary: str, timestamp: Optional[float] = None) -> Optional[int]:
+        """加入一条已转发消息，返回条目 id；不可索引的文本（见 indexable）直接忽略并返回 None"""
+        if not self.indexable(text):
+            return None
+        signature = self.signature(text)
+        embedding = self._embed(text)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {
+                "timestamp": timestamp if timestamp is not None else time.time(),
+                "summary": summary,
+                "signature": signature,
+                "embedding": embedding,
+            }
+            for key in self._bands(signature):
+                self._buckets.setdefault(key, set()).add(entry_id)
+        return entry_id
+
+    def update(self, entry_id: int, summary: str, timestamp: Optional[float] = None) -> bool:
+        """更新条目的摘要和时间戳（如预占条目在审议通过后写入正式摘要），条目不存在时返回 False"""
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return False
+            entry["summary"] = summary
+            entry["timestamp"] = timestamp if timestamp is not None else time.time()
+            return True
+
+    def remove(self, entry_id: int) -> bool:
+        """移除条目，条目不存在时返回 False"""
+        with self._lock:
+            return self._remove_locked(entry_id)
+
+    def _remove_locked(self, entry_id: int) -> bool:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return False
+        for key in self._bands(entry["signature"]):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+        return True
+
+    def prune(self, max_age_seconds: float, now: Optional[float] = None) -> int:
+        """移除超出时间窗口的条目，返回移除数量"""
+        cutoff = (now if now is not None else time.time()) - max_age_seconds
+        with self._lock:
+            expired = [i for i, e in self._entries.items() if e["timestamp"] < cutoff]
+            for entry_id in expired:
+                self._remove_locked(entry_id)
+        return len(expired)
+
+    def query(self, text: str) -> List[Dict[str, Any]]:
+        """
+        返回相近的历史条目，按相似度从高到低排序。
+        每项包含 summary、similarity（MinHash 估算的 Jaccard）和 cosine（未配置 embedding 时为 None）。
+        不可索引的文本（见 indexable）总是返回空列表。
+        """
+        if not self.indexable(text):
+            return []
+        signature = self.signature(text)
+        embedding = self._embed(text)
+        with self._lock:
+            if embedding is not None:
+                # 语义相近的文本字面上可能几乎不重合，配置了 embedding 时扫描窗口内全部条目
+                candidate_ids = set(self._entries)
+            else:
+                candidate_ids = set()
+                for key in self._bands(signature):
+                    candidate_ids.update(self._buckets.get(key, ()))
+            candidates = [self._entries[i] for i in candidate_ids]
+
+        results = []
+        for entry in candidates:
+            similarity = sum(a == b for a, b in zip(signature, entry["signature"])) / self.num_perm
+            cosine = None
+            if embedding is not None and entry["embedding"] is not None:
+                cosine = _cosine(embedding, entry["embedding"])
+            results.append({"summary": entry["summary"], "timestamp": entry["timestamp"],
+                            "similarity": similarity, "cosine": cosine})
+        results.sort(key=lambda r: r["cosine"] if r["cosine"] is not None else r["similarity"], reverse=True)
+        return results
@@ -0,0 +1,87 @@
+import asyncio
+import base64
+import io
+import logging
+from typing import Any, Dict, List, Optional
+
+try:
+    from PIL import Image  # 已列入 requirements.txt；缺失时启动警告，不做缩放/重新压缩
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IMAGE_OPTIONS = {
+    "max_concurrent_downloads": 4,
+    "max_dimension": 1920,  # 长边超过该像素时缩放，0 表示不缩放
+    "jpeg_quality": 85,
+    "max_image_bytes": 2 * 1024 * 1024,  # 单张图片（处理后）的大小上限，超出则丢弃
+    "max_total_bytes": 8 * 1024 * 1024,  # 一条推送中全部图片的大小上限，超出部分丢弃
+}
+
+
+def load_image_options(config: Dict[str, Any]) -> Dict[str, Any]:
+    options = {**DEFAULT_IMAGE_OPTIONS, **config.get("images", {})}
+    if Image is None and options["max_dimension"]:
+        logger.warning("未安装 Pillow（见 requirements.txt），图片将按原样推送（不缩放、不重新压缩）。")
+    return options
+
+
+def _shrink(data: bytes, options: Dict[str, Any]) -> bytes:
+    """长边超过 max_dimension 或体积超过上限时缩放并重新压缩为 JPEG；失败时返回原图"""
+    max_dimension = options["max_dimension"]
+    if Image is None or not max_dimension:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            if max(img.size) <= max_dimension and len(data) <= options["max_image_bytes"]:
+                return data
+            img.thumbnail((max_dimension, max_dimension))
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            out = io.BytesIO()
+            img.save(out, format="JPEG", quality=options["jpeg_quality"], optimize=True)
+    except Exception as e:
+        logger.warning(f"图片缩放失败，使用原图: {e}")
+        return data
+    return out.getvalue() if out.tell() < len(data) else data
+
+
+def _encode(data: bytes, options: Dict[str, Any]) -> Optional[str]:
+    data = _shrink(data, options)
+    if len(data) > options["max_image_bytes"]:
+        logger.warning(f"图片大小 {len(data) / 1024:.0f} KiB 超过上限，已丢弃。")
+        return None
+    return base64.b64encode(data).decode()
+
+
+async def download_images_as_base64(messages: List[Any], options: Dict[str, Any]) -> List[str]:
+    """
+    并发下载消息（相册时为全部成员）中的图片，按消息顺序返回 base64 列表。
+    下载并发数受 max_concurrent_downloads 限制，缩放和编码在线程中进行，不阻塞事件循环。
+    """
+    semaphore = asyncio.Semaphore(max(1, int(options["max_concurrent_downloads"])))
+
+    async def _dl(m):
+        try:
+            async with semaphore:
+                b = await m.download_media(file=bytes)
+            return await asyncio.to_thread(_encode, b, options)
+        except Exception as e:
+            logger.error(f"下载图片失败: {e}")
+            return None
+
+    results = await asyncio.gather(*[_dl(m) for m in messages if m.photo])
+
+    imgs: List[str] = []
+    total = 0
+    for img in results:
+        if not img:
+            continue
+        size = len(img) * 3 // 4
+        if total + size > options["max_total_bytes"]:
+            logger.warning(f"图片总大小超过上限，仅推送前 {len(imgs)} 张。")
+            break
+        imgs.append(img)
+        total += size
+    return imgs
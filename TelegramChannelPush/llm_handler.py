@@ -1,16 +1,181 @@
 import json
 import logging
+import os
+import threading
 import time
-from datetime import datetime, timedelta
+from collections import deque
 from pathlib import Path
-from typing import List, Tuple, Dict, Any
+from typing import List, Optional, Tuple, Dict, Any
 
 import jwt
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from dedup_index import DEFAULT_DEDUP_CONFIG, DedupIndex, load_embedding_hook
 
 SCRIPT_DIR = Path(__file__).parent.resolve()
 CONFIG_PATH = SCRIPT_DIR / "config.json"
-HISTORY_PATH = SCRIPT_DIR / "forward_history.json"
+HISTORY_PATH = SCRIPT_DIR / "forward_history.jsonl"
+LEGACY_HISTORY_PATH = SCRIPT_DIR / "forward_history.json"
+
+# LLM 请求的默认参数，可在 config.json 的 llm_request 中整体覆盖，或在 llm_configs 的单个模型中覆盖
+DEFAULT_LLM_REQUEST_CONFIG = {
+    "connect_timeout": 10,
+    "read_timeout": 90,
+    "max_retries": 2,  # 连接失败及 429/5xx 时的重试次数
+    "backoff_factor": 1.0,
+    "pool_maxsize": 4,
+}
+ZHIPU_TOKEN_TTL = 3600
+ZHIPU_TOKEN_REFRESH_MARGIN = 300  # 过期前多少秒重新生成
+# 审议中的消息预占去重位置的最长时间，超时（如调用方未记录结果）后自动释放
+RESERVATION_TIMEOUT = 600
+
+
+class LatencyStats:
+    """按任务统计 LLM 请求耗时，保留最近的样本用于计算分位数"""
+
+    def __init__(self, max_samples: int = 500):
+        self.max_samples = max_samples
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, task_name: str, seconds: float, ok: bool):
+        with self._lock:
+            stats = self._tasks.setdefault(task_name, {
+                "count": 0, "errors": 0, "total": 0.0, "max": 0.0,
+                "samples": deque(maxlen=self.max_samples),
+            })
+            stats["count"] += 1
+            stats["errors"] += 0 if ok else 1
+            stats["total"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            stats["samples"].append(seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        result = {}
+        with self._lock:
+            for task_name, stats in self._tasks.items():
+                samples = sorted(stats["samples"])
+                pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+                result[task_name] = {
+                    "count": stats["count"],
+                    "errors": stats["errors"],
+                    "mean_ms": stats["total"] / stats["count"] * 1000,
+                    "p50_ms": pick(0.5),
+                    "p95_ms": pick(0.95),
+                    "max_ms": stats["max"] * 1000,
+                }
+        return result
+
+    def format(self) -> str:
+        lines = [
+            f"{task}: {s['count']} 次 (失败 {s['errors']}), 平均 {s['mean_ms']:.0f}ms, "
+            f"p50 {s['p50_ms']:.0f}ms, p95 {s['p95_ms']:.0f}ms, 最大 {s['max_ms']:.0f}ms"
+            for task, s in self.snapshot().items()
+        ]
+        return "\n".join(lines) if lines else "暂无LLM请求"
+
+
+class ForwardHistory:
+    """
+    已转发消息的历史记录。
+    内存中按时间顺序保存在 deque 中，磁盘上是只追加的 JSONL 日志；
+    过期条目从队头弹出，日志中的过期行累积到一定数量后整体压缩重写。
+    """
+
+    def __init__(self, path: Path, window_hours: float, compact_min_stale: int = 64):
+        self.path = path
+        self.window_seconds = window_hours * 3600
+        self.compact_min_stale = compact_min_stale
+        self.entries: deque = deque()
+        self._stale_lines = 0  # 日志中已过期或损坏、等待压缩的行数
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path.exists() and LEGACY_HISTORY_PATH.exists():
+            self._migrate_legacy()
+        if not self.path.exists():
+            return
+
+        cutoff = time.time() - self.window_seconds
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    self._stale_lines += 1
+                    continue
+                if not isinstance(item, dict):
+                    # 合法 JSON 但不是记录对象（如 [] 或 "x"），与损坏行一样跳过，等待压缩时清除
+                    self._stale_lines += 1
+                    continue
+                if item.get("timestamp", 0) < cutoff:
+                    self._stale_lines += 1
+                else:
+                    self.entries.append(item)
+        # 日志按追加顺序写入，正常情况下已按时间排序；手工编辑过的文件在这里纠正
+        if any(a["timestamp"] > b["timestamp"] for a, b in zip(self.entries, list(self.entries)[1:])):
+            self.entries = deque(sorted(self.entries, key=lambda item: item["timestamp"]))
+        self._maybe_compact()
+
+    def _migrate_legacy(self):
+        """把旧版 forward_history.json（整体 JSON 数组）迁移为 JSONL 日志"""
+        try:
+            with open(LEGACY_HISTORY_PATH, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.error(f"Failed to read legacy history file, skipping migration: {e}")
+            return
+        self.entries = deque(sorted(legacy, key=lambda item: item.get("timestamp", 0)))
+        self._compact()
+        self.entries.clear()
+        LEGACY_HISTORY_PATH.unlink(missing_ok=True)
+        logging.info(f"Migrated {len(legacy)} history entries to {self.path.name}.")
+
+    def _prune(self, now: float):
+        cutoff = now - self.window_seconds
+        while self.entries and self.entries[0].get("timestamp", 0) < cutoff:
+            self.entries.popleft()
+            self._stale_lines += 1
+
+    def _compact(self):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for item in self.entries:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._stale_lines = 0
+
+    def _maybe_compact(self):
+        # 过期行超过有效行数时才重写，保证压缩的摊还代价与追加同阶
+        if self._stale_lines >= max(self.compact_min_stale, len(self.entries)):
+            self._compact()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """返回时间窗口内的全部条目"""
+        with self._lock:
+            self._prune(time.time())
+            self._maybe_compact()
+            return list(self.entries)
+
+    def append(self, summary: str, original_text: str, timestamp: float = None):
+        item = {
+            "timestamp": timestamp if timestamp is not None else time.time(),
+            "summary": summary,
+            "original_text": original_text,
+        }
+        with self._lock:
+            self._prune(item["timestamp"])
+            self.entries.append(item)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            self._maybe_compact()
+        return item
 
 
 class LLMFilter:
@@ -23,61 +188,91 @@ class LLMFilter:
         self.enabled = True
         self.llm_configs = config.get("llm_configs", {})
         self.task_mapping = config.get("task_model_mapping", {})
+        self.request_config = {**DEFAULT_LLM_REQUEST_CONFIG, **config.get("llm_request", {})}
+        # 每个 API 地址一个带连接池和重试的 Session，复用 keep-alive 连接
+        self._sessions: Dict[str, requests.Session] = {}
+        # 智谱 API Key -> (JWT, 过期时间)
+        self._zhipu_tokens: Dict[str, Tuple[str, float]] = {}
+        self._session_lock = threading.Lock()
+        self.latency_stats = LatencyStats()
         self.base_prompt = self.llm_filter_config.get("base_prompt")
         self.user_like_prompt = self.llm_filter_config.get("user_like_prompt", "")
         self.user_dislike_prompt = self.llm_filter_config.get("user_dislike_prompt", "")
         self.deduplication_window_hours = self.llm_filter_config.get("deduplication_window_hours", 24)
+        # 在筛选请求中同时生成摘要，省去单独的摘要请求；模型未返回摘要时回退为两次调用
+        self.combined_summary = self.llm_filter_config.get("combined_summary", True)
 
-        self._initialize_history()
+        self.history = ForwardHistory(HISTORY_PATH, self.deduplication_window_hours)
+        # 并发审议时，去重检查与预占在同一把锁内完成，避免两条同时到达的转载都通过筛选
+        self._reserve_lock = threading.Lock()
+        # 已通过本地去重、正在等待AI决策或摘要的消息：{"text", "entry_id", "timestamp"}
+        self._reservations: List[Dict[str, Any]] = []
 
-    def _initialize_history(self):
-        """如果历史文件不存在，则创建一个空的列表文件。"""
-        if not HISTORY_PATH.exists():
-            with open(HISTORY_PATH, "w", encoding="utf-8") as f:
-                json.dump([], f)
+        self.dedup_config = {**DEFAULT_DEDUP_CONFIG, **self.llm_filter_config.get("dedup", {})}
+        self.dedup_index = None
+        if self.dedup_config["enabled"]:
+            self.dedup_index = DedupIndex(
+                num_perm=int(self.dedup_config["num_perm"]),
+                shingle_size=int(self.dedup_config["shingle_size"]),
+                min_shingles=int(self.dedup_config["min_shingles"]),
+                embedding_hook=load_embedding_hook(self.dedup_config["embedding_hook"]),
+            )
+            for item in self._load_and_clean_history():
+                self.dedup_index.add(item.get("original_text") or item.get("summary", ""),
+                                     item.get("summary", ""), item.get("timestamp", 0))
+            logging.info(f"Dedup index loaded with {len(self.dedup_index)} entries.")
 
     def _load_and_clean_history(self) -> List[Dict[str, Any]]:
-        """加载历史记录并移除超出时间窗口的条目。"""
-        if not HISTORY_PATH.exists():
-            return []
-
-        with open(HISTORY_PATH, "r", encoding="utf-8") as f:
-            try:
-                history = json.load(f)
-            except json.JSONDecodeError:
-                history = []
-
-        now = datetime.now()
-        window = timedelta(hours=self.deduplication_window_hours)
-        
-        fresh_history = [
-            item for item in history 
-            if now - datetime.fromtimestamp(item.get("timestamp", 0)) <= window
-        ]
-
-        if len(fresh_history) < len(history):
-            self._save_history(fresh_history)
-            
-        return fresh_history
-    
-    def _save_history(self, history: List[Dict[str, Any]]):
-        """将历史记录保存到文件。"""
-        with open(HISTORY_PATH, "w", encoding="utf-8") as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
+        """返回时间窗口内的历史记录（过期条目已从内存中移除）。"""
+        return self.history.snapshot()
 
     def _generate_zhipu_token(self, api_key: str) -> str:
-        """生成JWT"""
+        """生成JWT，有效期内复用缓存，临近过期时重新生成"""
+        now = time.time()
+        cached = self._zhipu_tokens.get(api_key)
+        if cached and cached[1] - now > ZHIPU_TOKEN_REFRESH_MARGIN:
+            return cached[0]
+
         try:
             id, secret = api_key.split('.')
         except ValueError:
             raise ValueError("Invalid ZhipuAI API Key format.")
 
+        expires_at = int(now) + ZHIPU_TOKEN_TTL
         payload = {
             "api_key": id,
-            "exp": int(time.time()) + 3600,  # 1 hour expiration
-            "timestamp": int(time.time()),
+            "exp": expires_at,  # 1 hour expiration
+            "timestamp": int(now),
         }
-        return jwt.encode(payload, secret, algorithm="HS256", headers={"alg": "HS256", "sign_type": "SIGN"})
+        token = jwt.encode(payload, secret, algorithm="HS256", headers={"alg": "HS256", "sign_type": "SIGN"})
+        self._zhipu_tokens[api_key] = (token, expires_at)
+        return token
+
+    def _request_options(self, model_config: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: model_config.get(key, default) for key, default in self.request_config.items()}
+
+    def _get_session(self, api_base: str, options: Dict[str, Any]) -> requests.Session:
+        with self._session_lock:
+            session = self._sessions.get(api_base)
+            if session is None:
+                # 只重试连接失败和可重试的状态码；POST 不是幂等的，读超时时请求可能已被处理，不再重发
+                retry = Retry(
+                    total=int(options["max_retries"]),
+                    connect=int(options["max_retries"]),
+                    read=0,
+                    other=0,
+                    backoff_factor=float(options["backoff_factor"]),
+                    status_forcelist=(429, 500, 502, 503, 504),
+                    allowed_methods=frozenset(["POST"]),
+                    respect_retry_after_header=True,
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(pool_maxsize=int(options["pool_maxsize"]), max_retries=retry)
+                session = requests.Session()
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[api_base] = session
+            return session
 
     def _call_llm(self, task_name: str, payload: Dict[str, Any]) -> Dict[str, Any]:
         """调用LLM API并返回JSON结果。"""
@@ -89,7 +284,9 @@ class LLMFilter:
 
         provider = model_config.get("provider")
         api_key = model_config.get("api_key")
-        endpoint = f"{model_config.get('api_base')}/chat/completions"
+        api_base = model_config.get('api_base')
+        endpoint = f"{api_base}/chat/completions"
+        options = self._request_options(model_config)
         
         headers = {"Content-Type": "application/json"}
         if provider == "zhipuai":
@@ -100,34 +297,137 @@ class LLMFilter:
         # 将模型名称注入到payload中
         payload["model"] = model_config.get("model")
 
+        started = time.monotonic()
+        ok = False
         try:
-            response = requests.post(
+            response = self._get_session(api_base, options).post(
                 endpoint, 
                 headers=headers, 
                 json=payload,
-                timeout=90
+                timeout=(options["connect_timeout"], options["read_timeout"])
             )
             response.raise_for_status()
-            return response.json()
+            result = response.json()
+            ok = True
+            return result
         except requests.exceptions.RequestException as e:
             logging.error(f"LLM API request for task '{task_name}' failed: {e}")
             if e.response is not None:
                 logging.error(f"LLM Response Body: {e.response.text}")
                 return {"error": str(e), "details": e.response.text}
             return {"error": str(e)}
+        finally:
+            elapsed = time.monotonic() - started
+            self.latency_stats.record(task_name, elapsed, ok)
+            logging.debug(f"LLM task '{task_name}' took {elapsed * 1000:.0f}ms (ok={ok})")
+
+    def _find_related_summaries(self, message_text: str) -> Tuple[List[str], str]:
+        """
+        在本地去重索引中查找相近的已转发消息。
+        返回 (提供给 LLM 的相近摘要, 重复原因)；重复原因非空时说明已判定为重复。
+        """
+        self.dedup_index.prune(self.deduplication_window_hours * 3600)
+        matches = self.dedup_index.query(message_text)
+        if matches:
+            best = matches[0]
+            if best["similarity"] >= self.dedup_config["duplicate_threshold"]:
+                return [], f"与已转发消息重复（相似度 {best['similarity']:.2f}）：{best['summary']}"
+            if best["cosine"] is not None and best["cosine"] >= self.dedup_config["embedding_threshold"]:
+                return [], f"与已转发消息语义重复（余弦相似度 {best['cosine']:.2f}）：{best['summary']}"
+
+        related = [
+            m["summary"] for m in matches
+            if (m["cosine"] if m["cosine"] is not None else m["similarity"]) >= self.dedup_config["related_threshold"]
+        ]
+        return related[:int(self.dedup_config["max_related"])], ""
 
     def should_forward(self, message_text: str) -> Tuple[bool, str]:
         """
         核心决策函数：判断消息是否应被转发。
         返回 (是否转发, 原因)。
+        只发送筛选提示词，不要求模型生成摘要；需要摘要时请使用 filter_and_summarize。
+        """
+        should, reason, _ = self._filter(message_text, with_summary=False)
+        return should, reason
+
+    def filter_and_summarize(self, message_text: str) -> Tuple[bool, str, Optional[str]]:
         """
+        判断消息是否应被转发，combined_summary 开启时在同一次请求中生成摘要。
+        返回 (是否转发, 原因, 摘要)；摘要为 None 时需由 generate_and_add_summary 单独生成。
+        通过筛选的消息会预占去重位置，直到 generate_and_add_summary 记录摘要；
+        因此并发审议的两条转载中，后到的一条会被判为重复。
+        """
+        return self._filter(message_text, with_summary=self.combined_summary, reserve=True)
+
+    def _filter(self, message_text: str, with_summary: bool, reserve: bool = False) -> Tuple[bool, str, Optional[str]]:
         if not self.enabled:
-            return True, "AI filter is disabled."
+            return True, "AI filter is disabled.", None
 
-        history = self._load_and_clean_history()
-        recent_summaries = [item.get("summary", "") for item in history]
-        
-        summary_block = "【重要参考】这是过去24小时内已转发的新闻摘要，请避免转发任何与以下内容高度相似或重复的新闻：\n"
+        with self._reserve_lock:
+            self._expire_reservations()
+            if self.dedup_index is not None and self.dedup_index.indexable(message_text):
+                # 明显重复的消息在本地直接拒绝，其余只把最相近的几条摘要交给模型参考
+                recent_summaries, duplicate_reason = self._find_related_summaries(message_text)
+                if duplicate_reason:
+                    return False, duplicate_reason, None
+                summary_scope = "已转发的、与本条最相近的新闻摘要"
+            else:
+                # 未启用本地索引，或文本太短（纯图片、纯链接、纯表情等）无法可靠比较时，由模型参考全部摘要判断
+                history = self._load_and_clean_history()
+                recent_summaries = [item.get("summary", "") for item in history]
+                recent_summaries += [_pending_summary(r["text"]) for r in self._reservations if r["text"].strip()]
+                summary_scope = "已转发的新闻摘要"
+            reservation = self._reserve(message_text) if reserve else None
+
+        try:
+            should, reason, summary = self._decide(message_text, recent_summaries, summary_scope, with_summary)
+        except BaseException:
+            if reservation is not None:
+                self._release(reservation)
+            raise
+        if not should and reservation is not None:
+            self._release(reservation)
+        return should, reason, summary
+
+    def _reserve(self, message_text: str) -> Dict[str, Any]:
+        """在去重索引中为审议中的消息预占位置；调用方需持有 _reserve_lock"""
+        entry_id = None
+        if self.dedup_index is not None:
+            entry_id = self.dedup_index.add(message_text, _pending_summary(message_text))
+        reservation = {"text": message_text, "entry_id": entry_id, "timestamp": time.time()}
+        self._reservations.append(reservation)
+        return reservation
+
+    def _release(self, reservation: Dict[str, Any]):
+        """撤销预占（消息被拒绝或摘要生成失败）"""
+        with self._reserve_lock:
+            self._drop_reservation(reservation)
+
+    def _drop_reservation(self, reservation: Dict[str, Any]):
+        if reservation in self._reservations:
+            self._reservations.remove(reservation)
+        if reservation["entry_id"] is not None and self.dedup_index is not None:
+            self.dedup_index.remove(reservation["entry_id"])
+
+    def _take_reservation(self, message_text: str) -> Optional[Dict[str, Any]]:
+        """取出该消息的预占记录；调用方需持有 _reserve_lock"""
+        for reservation in self._reservations:
+            if reservation["text"] == message_text:
+                self._reservations.remove(reservation)
+                return reservation
+        return None
+
+    def _expire_reservations(self):
+        """释放超时未记录结果的预占；调用方需持有 _reserve_lock"""
+        cutoff = time.time() - RESERVATION_TIMEOUT
+        for reservation in [r for r in self._reservations if r["timestamp"] < cutoff]:
+            logging.warning(f"Reservation expired without a recorded summary: {reservation['text'][:50]}")
+            self._drop_reservation(reservation)
+
+    def _decide(self, message_text: str, recent_summaries: List[str], summary_scope: str,
+                with_summary: bool) -> Tuple[bool, str, Optional[str]]:
+        """把用户偏好与参考摘要拼成提示词，请求AI决策"""
+        summary_block = f"【重要参考】这是过去24小时内{summary_scope}，请避免转发任何与以下内容高度相似或重复的新闻：\n"
         if recent_summaries:
             summary_block += "\n".join(f"- {s}" for s in recent_summaries)
         else:
@@ -139,10 +439,42 @@ class LLMFilter:
             f"- 厌恶：{self.user_dislike_prompt}" if self.user_dislike_prompt else "",
             summary_block,
             f"【待审议新闻】请分析以下这条新消息：\n---\n{message_text}\n---",
-            "【你的任务】综合以上所有信息，判断是否应该转发【待审议新闻】。你的回答必须是一个JSON对象，且仅包含两个键：\n1. 'decision': string类型，值必须是 'yes' 或 'no'。\n2. 'reason': string类型，用中文简要说明你做出该决策的原因。"
         ]
-        
-        final_prompt = "\n\n".join(filter(None, prompt_parts))
+
+        if with_summary:
+            decision_data, error = self._request_decision(prompt_parts, with_summary=True)
+            if decision_data is None and error is None:
+                logging.warning("Combined filter response could not be parsed, falling back to decision-only request.")
+                decision_data, error = self._request_decision(prompt_parts, with_summary=False)
+        else:
+            decision_data, error = self._request_decision(prompt_parts, with_summary=False)
+
+        if error is not None:
+            return False, error, None
+        if decision_data is None:
+            return False, "AI response parsing failed.", None
+
+        decision = decision_data.get("decision")
+        reason = decision_data.get("reason", "No reason provided.")
+        summary = decision_data.get("summary")
+        summary = summary.strip() if isinstance(summary, str) and summary.strip() else None
+
+        if decision == "yes":
+            return True, reason, summary
+        else:
+            return False, reason, None
+
+    def _request_decision(self, prompt_parts: List[str], with_summary: bool) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        发送筛选请求。返回 (解析后的JSON, API错误原因)；
+        两者都为 None 表示请求成功但响应无法解析。
+        """
+        if with_summary:
+            task = "【你的任务】综合以上所有信息，判断是否应该转发【待审议新闻】。你的回答必须是一个JSON对象，且仅包含三个键：\n1. 'decision': string类型，值必须是 'yes' 或 'no'。\n2. 'reason': string类型，用中文简要说明你做出该决策的原因。\n3. 'summary': string类型，将【待审议新闻】浓缩为一句25字以内的中文摘要，只保留核心事件与主题，用于后续的重复内容检查。"
+        else:
+            task = "【你的任务】综合以上所有信息，判断是否应该转发【待审议新闻】。你的回答必须是一个JSON对象，且仅包含两个键：\n1. 'decision': string类型，值必须是 'yes' 或 'no'。\n2. 'reason': string类型，用中文简要说明你做出该决策的原因。"
+
+        final_prompt = "\n\n".join(filter(None, prompt_parts + [task]))
 
         payload = {
             "messages": [{"role": "user", "content": final_prompt}],
@@ -153,30 +485,32 @@ class LLMFilter:
         llm_response = self._call_llm("filtering", payload)
         
         if "error" in llm_response:
-            return False, f"AI API call failed: {llm_response.get('details', llm_response['error'])}"
+            return None, f"AI API call failed: {llm_response.get('details', llm_response['error'])}"
             
         try:
             # 智谱AI和OpenAI的响应结构在此处兼容
             choice = llm_response.get("choices", [{}])[0]
             content = choice.get("message", {}).get("content", "{}")
             decision_data = json.loads(content)
-            
-            decision = decision_data.get("decision")
-            reason = decision_data.get("reason", "No reason provided.")
-
-            if decision == "yes":
-                return True, reason
-            else:
-                return False, reason
-        except (json.JSONDecodeError, KeyError, IndexError, AttributeError) as e:
+            if not isinstance(decision_data, dict):
+                raise ValueError("response is not a JSON object")
+            return decision_data, None
+        except (json.JSONDecodeError, ValueError, KeyError, IndexError, AttributeError) as e:
             logging.error(f"Failed to parse LLM response for filtering: {llm_response}, error: {e}")
-            return False, "AI response parsing failed."
+            return None, None
 
-    def generate_and_add_summary(self, message_text: str):
-        """为通过筛选的消息生成摘要并添加到历史记录中。"""
+    def generate_and_add_summary(self, message_text: str, summary: Optional[str] = None):
+        """
+        为通过筛选的消息生成摘要并添加到历史记录中。
+        已有摘要（来自 filter_and_summarize 的合并请求）时直接记录，不再调用LLM。
+        """
         if not self.enabled:
             return
 
+        if summary:
+            self._record_summary(message_text, summary)
+            return
+
         prompt = f"请将以下科技新闻浓缩为一句25字以内的中文摘要，只保留核心事件与主题，用于后续的重复内容检查。\n\n原文：\n---\n{message_text}\n---\n\n摘要："
         
         payload = {
@@ -184,23 +518,36 @@ class LLMFilter:
             "temperature": 0.2,
         }
         
+        summary_text = ""
         try:
             response = self._call_llm("summarization", payload)
             summary_text = response["choices"][0]["message"]["content"].strip()
-
-            if summary_text:
-                history = self._load_and_clean_history()
-                history.append({
-                    "timestamp": time.time(),
-                    "summary": summary_text,
-                    "original_text": message_text
-                })
-                self._save_history(history)
-                logging.info(f"New summary added to history: {summary_text}")
-
         except (requests.exceptions.RequestException, json.JSONDecodeError, KeyError, IndexError) as e:
             logging.error(f"Failed to generate or save summary: {e}")
 
+        if summary_text:
+            self._record_summary(message_text, summary_text)
+        else:
+            with self._reserve_lock:
+                reservation = self._take_reservation(message_text)
+                if reservation is not None:
+                    self._drop_reservation(reservation)
+
+    def _record_summary(self, message_text: str, summary_text: str):
+        with self._reserve_lock:
+            reservation = self._take_reservation(message_text)
+            self.history.append(summary_text, message_text)
+            if self.dedup_index is not None:
+                # 审议前已预占的条目直接写入正式摘要，否则新增条目
+                entry_id = reservation["entry_id"] if reservation is not None else None
+                if entry_id is None or not self.dedup_index.update(entry_id, summary_text):
+                    self.dedup_index.add(message_text, summary_text)
+        logging.info(f"New summary added to history: {summary_text}")
+
+def _pending_summary(message_text: str) -> str:
+    """审议中消息在摘要列表里的占位文本"""
+    return f"（审议中）{' '.join(message_text.split())[:50]}"
+
 def load_llm_filter() -> LLMFilter:
     with open(CONFIG_PATH, "r", encoding="utf-8") as f:
         config = json.load(f)
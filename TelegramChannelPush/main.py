@@ -1,11 +1,10 @@
 import asyncio
-import base64
 import copy
 import json
 import logging
 import re
 from datetime import timezone
-from typing import List, Any
+from typing import Any, Dict, List, Optional, Tuple
 from pathlib import Path
 
 import pytz
@@ -13,8 +12,11 @@ import socks
 from telethon import TelegramClient, events
 from telethon.tl.types import MessageMediaPoll, PeerChannel
 
+from album_aggregator import AlbumAggregator
+from image_processor import download_images_as_base64, load_image_options
 from llm_handler import load_llm_filter
-from post_extension import load_config, send_msg_to_group
+from pipeline import StagedPipeline
+from post_extension import get_outbox, load_config, send_msg_to_group
 from text_formatter import process_markdown_links_and_add_references
 
 # ────────────────── 配置 ──────────────────
@@ -53,31 +55,8 @@ logging.basicConfig(
 logging.getLogger("telethon").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-# ────────────────── 图片下载为 base64 ──────────────────
-async def download_images_as_base64(message, current_channel_username: str) -> List[str]:
-    imgs: List[str] = []
-
-    async def _dl(m):
-        if m.photo:
-            try:
-                b = await m.download_media(file=bytes)
-                imgs.append(base64.b64encode(b).decode())
-            except Exception as e:
-                logger.error(f"下载图片失败: {e}")
-
-    if message.grouped_id:
-        try:
-            # 明确从当前消息所在的频道获取
-            recent_messages = await client.get_messages(current_channel_username, limit=20)
-            grouped = [m for m in recent_messages if m.grouped_id == message.grouped_id]
-            for m in grouped:
-                await _dl(m)
-        except Exception as e:
-            logger.error(f"处理相册消息失败: {e}")
-    else:
-        await _dl(message)
-
-    return imgs
+# 图片下载与压缩参数（见 config.json 的 images）
+image_options = load_image_options(config)
 
 # ────────────────── keep-alive ──────────────────
 async def keep_alive():
@@ -92,9 +71,133 @@ async def keep_alive():
             logger.warning(f"⚠️  keep-alive: connection issue, attempting to reconnect... Details: {e}")
         await asyncio.sleep(60)
 
+# ────────────────── 处理管线 ──────────────────
+# ingest（事件处理/相册聚合）→ filter（AI 筛选与摘要）→ enrich（格式化与图片下载）→ deliver（推送）
+# 每个阶段并发处理多个频道的消息，同一频道的消息按到达顺序推送
+
+async def filter_stage(post: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """汇总文本并调用AI筛选；被过滤时返回 None"""
+    messages = post["messages"]
+    msg = messages[-1]
+
+    # ───── 相册处理：汇总文本 + entities ─────
+    if len(messages) > 1:
+        segments, merged_entities, shift = [], [], 0
+        for m in messages:
+            txt = m.message or ""
+            segments.append(txt)
+            if m.entities:
+                for ent in m.entities:
+                    ent_cp = copy.copy(ent)
+                    if hasattr(ent_cp, "offset"): ent_cp.offset += shift
+                    merged_entities.append(ent_cp)
+            shift += len(txt) + len("\n") if txt else 0
+        raw_text, active_entities = "\n".join(segments), merged_entities
+    else:
+        raw_text = msg.message or ""
+        active_entities = msg.entities or []
+    
+    raw_text = raw_text.strip()
+    has_photo = any(m.photo for m in messages)
+    if not raw_text and not has_photo:
+        logger.info(f"➡️ 消息 [ID: {msg.id}] 文本和图片均为空，已跳过。")
+        return None
+
+    # 🧠 为AI分析准备"干净"的文本副本，移除URL和特殊字符以规避安全策略
+    text_for_llm = re.sub(r'https?://\S+', '', raw_text)
+    text_for_llm = re.sub(r'[@#\[\]\(\)\{\}]', '', text_for_llm)
+
+    # 调用AI进行筛选
+    should, reason, summary = await asyncio.to_thread(llm_filter.filter_and_summarize, text_for_llm)
+    if not should:
+        logger.info(f"🚫 AI决策：已过滤消息 [ID: {msg.id}]。原因: {reason}")
+        return None
+    
+    logger.info(f"✅ AI决策：消息 [ID: {msg.id}] 通过筛选。原因: {reason}")
+
+    # AI决策通过后，为其生成并添加摘要到历史记录
+    await asyncio.to_thread(llm_filter.generate_and_add_summary, text_for_llm, summary)
+
+    post["raw_text"], post["entities"] = raw_text, active_entities
+    return post
+
+
+async def enrich_stage(post: Dict[str, Any]) -> Dict[str, Any]:
+    """格式化文本、转换时间并下载图片"""
+    messages = post["messages"]
+    msg = messages[-1]
+
+    # 文本格式化与清理 (使用原始raw_text以保证链接格式正确)
+    removal_strings = config.get("removal_strings", [])
+    raw_text_cleaned_tail = re.sub(r"(\s*\n+\s*\S*\s*\n*\s*)$", "", post["raw_text"]).rstrip()
+    body, refs = process_markdown_links_and_add_references(
+        raw_text_cleaned_tail, entities=post["entities"], removal_strings=removal_strings
+    )
+    post["text"] = f"{body}\n\n{refs}" if refs else body
+
+    # 时间处理
+    utc_dt = msg.date.replace(tzinfo=timezone.utc)
+    cn_dt  = utc_dt.astimezone(pytz.timezone("Asia/Shanghai"))
+    post["time_str"] = cn_dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    # 图片处理
+    post["images"] = await download_images_as_base64(messages, image_options)
+    return post
+
+
+async def deliver_stage(post: Dict[str, Any]):
+    """推送到 NapCat"""
+    msg = post["messages"][-1]
+    channel = post["channel"]
+    logger.info(f"🚀 准备向NapCat推送消息 [ID: {msg.id}]...")
+    await asyncio.to_thread(
+        send_msg_to_group, post["text"], post["time_str"], post["images"], channel,
+        idempotency_key=f"tg:{channel}:{msg.id}",
+    )
+
+
+pipeline_cfg = config.get("pipeline", {})
+pipeline = StagedPipeline(
+    stages=[
+        ("filter", filter_stage, pipeline_cfg.get("filter_concurrency", 4)),
+        ("enrich", enrich_stage, pipeline_cfg.get("enrich_concurrency", 4)),
+    ],
+    deliver=("deliver", deliver_stage, pipeline_cfg.get("deliver_concurrency", 2)),
+    queue_size=pipeline_cfg.get("queue_size", 100),
+    max_in_flight=pipeline_cfg.get("max_in_flight", 200),
+)
+
+
+async def submit_post(messages: List[Any], current_channel_username: str):
+    """提交一条普通消息"""
+    await pipeline.submit(current_channel_username, {"messages": messages, "channel": current_channel_username})
+
+
+async def submit_album(messages: List[Any], reservation: Tuple[str, int]):
+    """相册聚合完成后填入第一条消息到达时预留的顺序，按 id 排序的全部成员作为一条推送"""
+    current_channel_username, seq = reservation
+    await pipeline.fill(current_channel_username, seq, {"messages": messages, "channel": current_channel_username})
+
+# ────────────────── 运行统计 ──────────────────
+async def log_stats():
+    """按 stats_interval（秒，默认 1 小时）定期输出各任务的 LLM 请求耗时和发件箱积压情况"""
+    interval = config.get("stats_interval", 3600)
+    if not interval:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        if llm_filter.enabled:
+            logger.info(f"📊 LLM 请求耗时统计:\n{llm_filter.latency_stats.format()}")
+        logger.info(f"📮 发件箱: {get_outbox().stats()}")
+        logger.info(f"🧵 处理管线: {pipeline.stats()}")
+
 # ────────────────── 主逻辑 ──────────────────
 async def main():
     logger.info("🚀 机器人启动中...")
+    # 启动发件箱，上次运行未投递成功的推送会在后台继续重试
+    outbox_stats = get_outbox().stats()
+    if outbox_stats["pending"]:
+        logger.info(f"📮 发件箱中有 {outbox_stats['pending']} 条待投递推送，将在后台重试。")
     await client.start(phone_number)
     
     # 解析并获取所有频道的实体
@@ -107,6 +210,8 @@ async def main():
         logger.error(f"❌ 解析频道实体失败，请检查 'channel_usernames' 配置: {e}")
         return
 
+    album_aggregator = AlbumAggregator(submit_album, quiet_period=config.get("album_quiet_period", 1.0))
+
     @client.on(events.NewMessage(chats=channel_entities))
     async def handler(event):
         msg = event.message
@@ -125,80 +230,17 @@ async def main():
             logger.info(f"➡️ 消息 [ID: {msg.id}] 为投票或空消息，已跳过。")
             return
 
-        # ───── 相册处理：仅在最后一条时汇总文本 + entities ─────
-        raw_text = ""
-        active_entities = []
-        is_album_leader = True
-
+        # 相册的各条消息先在内存中聚合，静默片刻后整体处理一次；
+        # 第一条消息到达时就在管线中预留顺序，聚合期间到达的后续消息仍排在相册之后推送
         if msg.grouped_id:
-            try:
-                recent = await client.get_messages(current_channel_username, limit=20)
-                grouped = [m for m in recent if m.grouped_id == msg.grouped_id]
-
-                if msg.id != max(m.id for m in grouped):
-                    is_album_leader = False
-                    logger.info(f"➡️ 消息 [ID: {msg.id}] 是相册的一部分但非最后一条，等待聚合处理。")
-                    return
-
-                logger.info(f"🔄 正在处理相册 [Group ID: {msg.grouped_id}]，共 {len(grouped)} 条消息。")
-                grouped.sort(key=lambda m: m.id)
-                segments, merged_entities, shift = [], [], 0
-                for m in grouped:
-                    txt = m.message or ""
-                    segments.append(txt)
-                    if m.entities:
-                        for ent in m.entities:
-                            ent_cp = copy.copy(ent)
-                            if hasattr(ent_cp, "offset"): ent_cp.offset += shift
-                            merged_entities.append(ent_cp)
-                    shift += len(txt) + len("\n") if txt else 0
-                raw_text, active_entities = "\n".join(segments), merged_entities
-            except Exception as e:
-                logger.error(f"处理相册 [Group ID: {msg.grouped_id}] 出错: {e}")
-                return
-        else:
-            raw_text = msg.message or ""
-            active_entities = msg.entities or []
-        
-        raw_text = raw_text.strip()
-        if not raw_text and not msg.photo:
-            logger.info(f"➡️ 消息 [ID: {msg.id}] 文本和图片均为空，已跳过。")
-            return
-
-        # 🧠 为AI分析准备"干净"的文本副本，移除URL和特殊字符以规避安全策略
-        text_for_llm = re.sub(r'https?://\S+', '', raw_text)
-        text_for_llm = re.sub(r'[@#\[\]\(\)\{\}]', '', text_for_llm)
-
-        # 调用AI进行筛选
-        should, reason = await asyncio.to_thread(llm_filter.should_forward, text_for_llm)
-        if not should:
-            logger.info(f"🚫 AI决策：已过滤消息 [ID: {msg.id}]。原因: {reason}")
+            logger.info(f"➡️ 消息 [ID: {msg.id}] 是相册 [Group ID: {msg.grouped_id}] 的一部分，等待聚合处理。")
+            reservation = None
+            if not album_aggregator.is_pending(msg.grouped_id):
+                reservation = (current_channel_username, pipeline.reserve(current_channel_username))
+            album_aggregator.add(msg, reservation)
             return
-        
-        logger.info(f"✅ AI决策：消息 [ID: {msg.id}] 通过筛选。原因: {reason}")
-
-        # AI决策通过后，为其生成并添加摘要到历史记录
-        await asyncio.to_thread(llm_filter.generate_and_add_summary, text_for_llm)
-
-        # 文本格式化与清理 (使用原始raw_text以保证链接格式正确)
-        removal_strings = config.get("removal_strings", [])
-        raw_text_cleaned_tail = re.sub(r"(\s*\n+\s*\S*\s*\n*\s*)$", "", raw_text).rstrip()
-        body, refs = process_markdown_links_and_add_references(
-            raw_text_cleaned_tail, entities=active_entities, removal_strings=removal_strings
-        )
-        text_for_send = f"{body}\n\n{refs}" if refs else body
-
-        # 时间处理
-        utc_dt = msg.date.replace(tzinfo=timezone.utc)
-        cn_dt  = utc_dt.astimezone(pytz.timezone("Asia/Shanghai"))
-        time_str = cn_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-        # 图片处理
-        images = await download_images_as_base64(msg, current_channel_username)
 
-        # 推送到 NapCat
-        logger.info(f"🚀 准备向NapCat推送消息 [ID: {msg.id}]...")
-        await asyncio.to_thread(send_msg_to_group, text_for_send, time_str, images, current_channel_username)
+        await submit_post([msg], current_channel_username)
 
     logger.info(f"✅ 正在监听 {len(channel_entities)} 个频道: {', '.join([f'@{c.username}' for c in channel_entities])}（Ctrl+C 退出）")
     await client.run_until_disconnected()
@@ -208,6 +250,7 @@ if __name__ == "__main__":
     try:
         with client:
             client.loop.create_task(keep_alive())
+            client.loop.create_task(log_stats())
             client.loop.run_until_complete(main())
     except KeyboardInterrupt:
         logger.info("✅ 程序已手动退出。Bye!")
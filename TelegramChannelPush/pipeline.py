@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 阶段处理函数：返回处理后的条目，返回 None 表示丢弃（如被过滤）
+StageFunc = Callable[[Any], Awaitable[Optional[Any]]]
+
+
+class _Stage:
+    def __init__(self, name: str, func: StageFunc, concurrency: int, queue_size: int):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.next: Optional["_Stage"] = None
+
+
+class StagedPipeline:
+    """
+    分阶段并发处理管线，例如 filter → enrich → deliver。
+    - 每个阶段有独立的有界队列和并发数，慢的 LLM 请求不会拖住其他频道
+    - 同一个 key（频道）的条目按提交顺序交付：前面的条目完成或被丢弃之前，后面的条目在交付阶段等待
+    - 在途条目总数受 max_in_flight 限制，submit 在管线满时等待，形成背压
+    - reserve 可以先占住一个交付顺序（如相册的第一条消息到达时），稍后再用 fill 提交内容；
+      预留的条目不占用 max_in_flight 名额，避免排在它后面的条目占满名额后 fill 无法进入
+    """
+
+    def __init__(self, stages: List[Tuple[str, StageFunc, int]], deliver: Tuple[str, StageFunc, int],
+                 queue_size: int = 100, max_in_flight: int = 200):
+        self._stages = [_Stage(name, func, concurrency, queue_size) for name, func, concurrency in stages]
+        for stage, following in zip(self._stages, self._stages[1:]):
+            stage.next = following
+        self._deliver_name, self._deliver_func, deliver_concurrency = deliver
+        self._deliver_concurrency = max(1, deliver_concurrency)
+        self._max_in_flight = max_in_flight
+        # key -> {"seq": 下一个提交序号, "next": 下一个待交付序号, "ready": {序号: 条目或 None},
+        #         "tail": 最后一个交付任务, "reserved": 通过 reserve 预留、不占用名额的序号}
+        self._lanes: Dict[Any, Dict[str, Any]] = {}
+        self._workers: List[asyncio.Task] = []
+        self._delivering = 0
+        self._started = False
+
+    def start(self):
+        """创建各阶段的 worker；必须在事件循环中调用"""
+        if self._started:
+            return
+        self._started = True
+        self._slots = asyncio.Semaphore(self._max_in_flight)
+        self._deliver_sem = asyncio.Semaphore(self._deliver_concurrency)
+        loop = asyncio.get_running_loop()
+        for stage in self._stages:
+            for _ in range(stage.concurrency):
+                self._workers.append(loop.create_task(self._worker(stage)))
+
+    async def submit(self, key: Any, item: Any):
+        """按 key 提交一个条目；管线已满时等待"""
+        self.start()
+        await self._slots.acquire()
+        seq = self._next_seq(key)
+        await self._enqueue(key, seq, item)
+
+    def reserve(self, key: Any) -> int:
+        """为 key 预留下一个交付顺序并返回序号，之后必须用 fill 提交（item 为 None 表示放弃）；必须在事件循环中调用"""
+        self.start()
+        seq = self._next_seq(key)
+        self._lanes[key]["reserved"].add(seq)
+        return seq
+
+    async def fill(self, key: Any, seq: int, item: Optional[Any]):
+        """提交 reserve 预留的条目；同一频道在它之后提交的条目会等它交付后再交付"""
+        if item is None:
+            self._complete(key, seq, None)
+            return
+        await self._enqueue(key, seq, item)
+
+    def _next_seq(self, key: Any) -> int:
+        lane = self._lanes.setdefault(key, {"seq": 0, "next": 0, "ready": {}, "tail": None, "reserved": set()})
+        seq = lane["seq"]
+        lane["seq"] += 1
+        return seq
+
+    async def _enqueue(self, key: Any, seq: int, item: Any):
+        if self._stages:
+            await self._stages[0].queue.put((key, seq, item))
+        else:
+            self._complete(key, seq, item)
+
+    def _release(self, key: Any, seq: int):
+        """条目离开管线：预留的条目不占名额，其余释放一个名额"""
+        reserved = self._lanes[key]["reserved"]
+        if seq in reserved:
+            reserved.discard(seq)
+        else:
+            self._slots.release()
+
+    async def _worker(self, stage: _Stage):
+        while True:
+            key, seq, item = await stage.queue.get()
+            try:
+                result = await stage.func(item)
+            except Exception as e:
+                logger.error(f"管线阶段 {stage.name} 处理出错: {e}", exc_info=True)
+                result = None
+            try:
+                if result is not None and stage.next is not None:
+                    await stage.next.queue.put((key, seq, result))
+                else:
+                    self._complete(key, seq, result)
+            finally:
+                stage.queue.task_done()
+
+    def _complete(self, key: Any, seq: int, item: Optional[Any]):
+        """记录条目已走完前置阶段（item 为 None 表示已丢弃），并按序安排交付"""
+        lane = self._lanes[key]
+        lane["ready"][seq] = item
+        while lane["next"] in lane["ready"]:
+            ready_seq = lane["next"]
+            ready_item = lane["ready"].pop(ready_seq)
+            lane["next"] += 1
+            if ready_item is None:
+                self._release(key, ready_seq)
+                continue
+            lane["tail"] = asyncio.get_running_loop().create_task(
+                self._deliver(lane["tail"], key, ready_seq, ready_item)
+            )
+
+    async def _deliver(self, previous: Optional[asyncio.Task], key: Any, seq: int, item: Any):
+        try:
+            if previous is not None:
+                # 同一频道的上一条交付完成后才开始，保证顺序；上一条失败不影响本条
+                await asyncio.gather(previous, return_exceptions=True)
+            async with self._deliver_sem:
+                self._delivering += 1
+                try:
+                    await self._deliver_func(item)
+                finally:
+                    self._delivering -= 1
+        except Exception as e:
+            logger.error(f"管线阶段 {self._deliver_name} 处理出错: {e}", exc_info=True)
+        finally:
+            self._release(key, seq)
+
+    def stats(self) -> Dict[str, Any]:
+        """各阶段队列长度，以及等待按序交付的条目数"""
+        data = {f"{stage.name}_queued": stage.queue.qsize() for stage in self._stages}
+        data["waiting_for_order"] = sum(len(lane["ready"]) for lane in self._lanes.values())
+        data["reserved"] = sum(len(lane["reserved"]) for lane in self._lanes.values())
+        data[f"{self._deliver_name}_active"] = self._delivering
+        return data
@@ -1,14 +1,22 @@
 import json
 import random
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Sequence, Union
+from typing import Any, Dict, List, Optional, Sequence, Union
 
 import requests
+from requests.adapters import HTTPAdapter
 
 # 路径自适应
 SCRIPT_DIR = Path(__file__).parent.resolve()
 
+# 发件箱与 GithubCommitPush 共用，位于仓库根目录的 common/
+sys.path.insert(0, str(SCRIPT_DIR.parent / "common"))
+from outbox import Outbox
+
 # ────────────────── 读取配置 ──────────────────
 def load_config(path: str = "config.json"):
     config_path = SCRIPT_DIR / path
@@ -19,6 +27,24 @@ config = load_config()
 post_url: str = config.get("napcat_url", "")
 post_token: str = config.get("napcat_token", "")
 post_group_ids: List[str] = config.get("napcat_group_ids", [])
+max_concurrency: int = config.get("napcat_max_concurrency", 5)  # 同时推送的群数
+group_interval: float = config.get("napcat_group_interval", 1.0)  # 同一个群两次推送的最小间隔（秒）
+request_timeout: float = config.get("napcat_timeout", 15)
+
+# 复用 keep-alive 连接；线程池负责向多个群并发推送
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=max(1, max_concurrency)))
+_session.mount("https://", HTTPAdapter(pool_maxsize=max(1, max_concurrency)))
+_executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="napcat-push")
+
+# 群号 -> 允许下一次推送的时间
+_group_next_send: Dict[str, float] = {}
+_group_lock = threading.Lock()
+
+# 持久化发件箱，首次推送时创建并启动后台重试线程
+OUTBOX_PATH = SCRIPT_DIR / "outbox.db"
+_outbox: Optional[Outbox] = None
+_outbox_lock = threading.Lock()
 
 
 # ────────────────── 工具函数 ──────────────────
@@ -29,11 +55,56 @@ def _normalize_text(text: Union[str, Sequence[str]]) -> str:
     return text or ""
 
 
+def _wait_for_group_slot(gid: str):
+    """按群限速：同一个群的两次推送至少间隔 group_interval 秒（附带少量抖动）"""
+    with _group_lock:
+        now = time.monotonic()
+        send_at = max(now, _group_next_send.get(gid, 0.0))
+        _group_next_send[gid] = send_at + group_interval + random.uniform(0, group_interval / 2)
+    if send_at > now:
+        time.sleep(send_at - now)
+
+
+def _post_to_group(gid: str, message_list: List[Dict[str, Any]]) -> bool:
+    """向单个群推送一次，返回是否成功；失败后的退避重试由发件箱负责"""
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {post_token}",
+    }
+    body = {"group_id": gid, "message": message_list}
+    _wait_for_group_slot(gid)
+    try:
+        r = _session.post(post_url, headers=headers, json=body, timeout=request_timeout)
+        r.raise_for_status()
+    except requests.exceptions.RequestException as exc:
+        print(f"发送到群 {gid} 失败：{exc}")
+        return False
+    print(f"已向群 {gid} 发送，状态 {r.status_code}，返回 {r.text}")
+    return True
+
+
+def get_outbox() -> Outbox:
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox(
+                OUTBOX_PATH, _post_to_group, executor=_executor,
+                max_attempts=config.get("outbox_max_attempts", 8),
+                base_delay=config.get("outbox_retry_base_delay", 10),
+            )
+            _outbox.start()
+        return _outbox
+
+
 # ────────────────── 主发送函数 ──────────────────
-def send_msg_to_group(text, time_str: str, base64_list: List[str], source_channel: str):
+def send_msg_to_group(text, time_str: str, base64_list: List[str], source_channel: str,
+                      idempotency_key: Optional[str] = None):
     """
     将整理后的 Telegram 内容推送到 NapCat（QQ 机器人）。
     text 可以是 str，或 (正文, 引用) 的 tuple/list。
+    idempotency_key 相同的推送对每个群只投递一次（如 "频道:消息ID"）。
+    推送先写入发件箱再立即投递，失败的由后台按指数退避重试。
+    返回本次立即投递的 群号 -> 是否成功。
     """
     text = _normalize_text(text)
     if text and not text.endswith("\n"):
@@ -61,18 +132,7 @@ def send_msg_to_group(text, time_str: str, base64_list: List[str], source_channe
     }
 
     message_list = images_part + [text_part]
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {post_token}",
-    }
 
-    # 依次推送到多个群
-    for gid in post_group_ids:
-        body = {"group_id": gid, "message": message_list}
-        try:
-            r = requests.post(post_url, headers=headers, json=body)
-            r.raise_for_status()
-            print(f"已向群 {gid} 发送，状态 {r.status_code}，返回 {r.text}")
-            time.sleep(random.uniform(1.0, 3.0))  # 简单限速
-        except Exception as exc:
-            print(f"发送到群 {gid} 失败：{exc}")
+    # 写入发件箱后并发推送到多个群（每个群单独限速、重试）
+    outbox = get_outbox()
+    return outbox.process(outbox.enqueue(idempotency_key, post_group_ids, message_list))
@@ -92,11 +92,11 @@ async def simulate_message_handler(mock_msg: MagicMock, llm_filter: Any, config:
     text_for_llm = re.sub(r'[@#\[\]\(\)\{\}]', '', text_for_llm)
     text_for_llm = re.sub(r'\*|\_', '', text_for_llm)
 
-    should, reason = await asyncio.to_thread(llm_filter.should_forward, text_for_llm)
+    should, reason, summary = await asyncio.to_thread(llm_filter.filter_and_summarize, text_for_llm)
     if not should:
         return "filter", reason
 
-    await asyncio.to_thread(llm_filter.generate_and_add_summary, text_for_llm)
+    await asyncio.to_thread(llm_filter.generate_and_add_summary, text_for_llm, summary)
 
     removal_strings = config.get("removal_strings", [])
     raw_text_cleaned_tail = re.sub(r"(\s*\n+\s*\S*\s*\n*\s*)$", "", raw_text).rstrip()
@@ -108,6 +108,49 @@ async def simulate_message_handler(mock_msg: MagicMock, llm_filter: Any, config:
     return "pass", text_for_send
 
 
+def reset_history():
+    """删除转发历史文件，确保测试之间互不影响"""
+    script_dir = Path(__file__).parent.resolve()
+    for history_name in ("forward_history.jsonl", "forward_history.json"):
+        (script_dir / history_name).unlink(missing_ok=True)
+
+
+def run_dedup_checks() -> bool:
+    """
+    本地去重索引的离线检查（不调用AI）：
+    两条不同的空文本消息（纯图片、纯表情）不应被本地索引判为重复，而应交给AI判断。
+    """
+    reset_history()
+    llm_filter = load_llm_filter()
+    if llm_filter.dedup_index is None:
+        logger.info("ℹ️  本地去重索引未启用，跳过去重检查。")
+        return True
+
+    llm_calls = []
+
+    def fake_call_llm(task_name, payload):
+        llm_calls.append(task_name)
+        return {"choices": [{"message": {"content": '{"decision": "yes", "reason": "测试", "summary": "测试图片"}'}}]}
+
+    llm_filter._call_llm = fake_call_llm
+    ok = True
+    # 纯图片消息（文本为空）转发后，另一条纯表情消息不应被判为重复
+    for text in ("", "🎉🎉🎉"):
+        should, reason, summary = llm_filter.filter_and_summarize(text)
+        if not should:
+            logger.error(f"❌ [失败] 空文本消息 {text!r} 被过滤: {reason}")
+            ok = False
+        llm_filter.generate_and_add_summary(text, summary)
+    if len(llm_calls) != 2 or len(llm_filter.dedup_index) != 0:
+        logger.error(f"❌ [失败] 空文本消息应交给AI判断且不进入本地索引 (AI调用 {len(llm_calls)} 次，索引 {len(llm_filter.dedup_index)} 条)")
+        ok = False
+
+    if ok:
+        logger.info("✅ [通过] 空文本消息未被本地去重索引误判为重复")
+    reset_history()
+    return ok
+
+
 async def run_test_suite():
     """
     运行完整的测试用例集。
@@ -116,13 +159,11 @@ async def run_test_suite():
     
     config = load_config()
 
-    # --- 修正: 直接构造并删除历史文件路径 ---
+    run_dedup_checks()
+
     # 为了确保测试的独立性，直接定位并删除历史记录文件
-    script_dir = Path(__file__).parent.resolve()
-    history_file_path = script_dir / "forward_history.json"
-    history_file_path.unlink(missing_ok=True) 
+    reset_history()
     logger.info("🧹 已清空旧的转发历史记录，确保测试环境纯净。")
-    # --- 修正结束 ---
 
     llm_filter = load_llm_filter()
 
@@ -0,0 +1,229 @@
+"""
+推送发件箱：基于 SQLite 的持久化投递队列。
+- 每条 (幂等键, 群号) 投递先落盘再发送，NapCat 不可用或进程重启都不会丢消息
+- 失败的投递按指数退避由后台线程重试，超过最大次数后标记为 dead
+- 同一幂等键 + 群号只会投递一次（如 Telegram 频道+消息 ID、GitHub commit sha）
+
+TelegramChannelPush 与 GithubCommitPush 共用本模块，两者的 post_extension.py 会把 common/ 加入 sys.path 后导入。
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional
+
+# deliver(群号, 消息段列表) -> 是否成功
+DeliverFunc = Callable[[str, Any], bool]
+
+# 消息内容按幂等键只存一份（一条带图片的推送可达数 MB），各群的投递记录通过 payload_key 引用；
+# deliveries.payload 仅用于兼容旧版本内联存储的记录，新记录为空
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payloads (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key TEXT NOT NULL UNIQUE,
+    group_id TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '',
+    payload_key TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_deliveries_due ON deliveries (status, next_attempt_at);
+"""
+
+# 投递记录连同共享的消息内容；旧记录的 payload_key 为空，使用内联的 payload
+_SELECT_DELIVERIES = (
+    "SELECT d.id, d.group_id, COALESCE(p.payload, d.payload), d.attempts, d.payload_key "
+    "FROM deliveries d LEFT JOIN payloads p ON p.key = d.payload_key"
+)
+
+
+class Outbox:
+    def __init__(self, db_path: str, deliver: DeliverFunc, executor: Optional[Executor] = None,
+                 max_attempts: int = 8, base_delay: float = 10.0, max_delay: float = 1800.0,
+                 poll_interval: float = 5.0, retention: float = 7 * 86400):
+        self.deliver = deliver
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.retention = retention  # 已完成记录保留多久（用于去重）
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(deliveries)")}
+        if "payload_key" not in columns:
+            # 旧版本的数据库：补上引用列，已有记录继续使用内联的 payload
+            self._conn.execute("ALTER TABLE deliveries ADD COLUMN payload_key TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_payload ON deliveries (payload_key)")
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 正在投递中的记录，避免后台线程与即时投递重复发送
+        self._in_flight: set = set()
+
+    def enqueue(self, key: Optional[str], group_ids: List[str], payload: Any) -> List[int]:
+        """
+        为每个群写入一条待投递记录，返回新记录的 id。
+        消息内容只写入一次，由各群的记录共同引用。
+        key 为 None 时不做去重；已存在的 (key, 群号) 会被跳过。
+        """
+        key = key or uuid.uuid4().hex
+        data = json.dumps(payload, ensure_ascii=False)
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for group_id in group_ids:
+                    cur = self._conn.execute(
+                        "INSERT OR IGNORE INTO deliveries (idem_key, group_id, payload, payload_key, created_at, next_attempt_at) "
+                        "VALUES (?, ?, '', ?, ?, ?)",
+                        (f"{key}:{group_id}", str(group_id), key, now, now),
+                    )
+                    if cur.rowcount:
+                        ids.append(cur.lastrowid)
+                    else:
+                        print(f"[outbox] 跳过重复投递：{key} -> 群 {group_id}")
+                if ids:
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO payloads (key, payload, created_at) VALUES (?, ?, ?)",
+                        (key, data, now),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def process(self, ids: Optional[List[int]] = None) -> Dict[str, bool]:
+        """
+        立即投递指定记录（ids 为 None 时投递全部到期记录），返回 群号 -> 是否成功。
+        有 executor 时并发投递。
+        """
+        now = time.time()
+        with self._lock:
+            if ids is None:
+                rows = self._conn.execute(
+                    f"{_SELECT_DELIVERIES} WHERE d.status = 'pending' AND d.next_attempt_at <= ? ORDER BY d.id LIMIT 100",
+                    (now,),
+                ).fetchall()
+            elif ids:
+                marks = ",".join("?" * len(ids))
+                rows = self._conn.execute(
+                    f"{_SELECT_DELIVERIES} WHERE d.status = 'pending' AND d.id IN ({marks}) ORDER BY d.id",
+                    ids,
+                ).fetchall()
+            else:
+                rows = []
+            rows = [row for row in rows if row[0] not in self._in_flight]
+            self._in_flight.update(row[0] for row in rows)
+
+        if self.executor is not None:
+            futures = [(row, self.executor.submit(self._attempt, row)) for row in rows]
+            return {row[1]: future.result() for row, future in futures}
+        return {row[1]: self._attempt(row) for row in rows}
+
+    def _attempt(self, row) -> bool:
+        delivery_id, group_id, payload, attempts, payload_key = row
+        try:
+            try:
+                ok, error = bool(self.deliver(group_id, json.loads(payload))), None
+            except Exception as e:
+                ok, error = False, str(e)
+            self._record_result(delivery_id, group_id, payload_key, attempts + 1, ok, error)
+            return ok
+        finally:
+            with self._lock:
+                self._in_flight.discard(delivery_id)
+
+    def _record_result(self, delivery_id: int, group_id: str, payload_key: Optional[str],
+                       attempts: int, ok: bool, error: Optional[str]):
+        now = time.time()
+        with self._lock:
+            if ok:
+                # 投递成功后清空消息内容，只保留幂等键用于去重；所有群都投递成功后删除共享的消息内容
+                self._conn.execute(
+                    "UPDATE deliveries SET status = 'done', attempts = ?, payload = '', last_error = NULL WHERE id = ?",
+                    (attempts, delivery_id),
+                )
+                if payload_key is not None:
+                    self._conn.execute(
+                        "DELETE FROM payloads WHERE key = ? AND NOT EXISTS "
+                        "(SELECT 1 FROM deliveries WHERE payload_key = ? AND status != 'done')",
+                        (payload_key, payload_key),
+                    )
+            elif attempts >= self.max_attempts:
+                self._conn.execute(
+                    "UPDATE deliveries SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?",
+                    (attempts, error, delivery_id),
+                )
+                print(f"[outbox] 投递到群 {group_id} 已失败 {attempts} 次，放弃重试")
+            else:
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+                self._conn.execute(
+                    "UPDATE deliveries SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                    (attempts, now + delay, error, delivery_id),
+                )
+                print(f"[outbox] 投递到群 {group_id} 失败，{delay:.0f} 秒后第 {attempts + 1} 次尝试")
+
+    def stats(self) -> Dict[str, Any]:
+        """队列深度与最久待投递消息的等待时间（秒）"""
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM deliveries GROUP BY status").fetchall())
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) FROM deliveries WHERE status = 'pending'"
+            ).fetchone()[0]
+        return {
+            "pending": counts.get("pending", 0),
+            "done": counts.get("done", 0),
+            "dead": counts.get("dead", 0),
+            "oldest_pending_age": round(time.time() - oldest, 1) if oldest else 0.0,
+        }
+
+    def purge(self):
+        """删除超出保留时间的已完成/已放弃记录，以及不再被引用的消息内容"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM deliveries WHERE status != 'pending' AND created_at < ?",
+                (time.time() - self.retention,),
+            )
+            self._conn.execute(
+                "DELETE FROM payloads WHERE NOT EXISTS "
+                "(SELECT 1 FROM deliveries WHERE deliveries.payload_key = payloads.key AND status != 'done')"
+            )
+
+    def start(self):
+        """启动后台重试线程（重复调用无副作用）"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True, name="outbox")
+            self._thread.start()
+
+    def wakeup(self):
+        self._wakeup.set()
+
+    def _run(self):
+        last_purge = 0.0
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self.process()
+                if time.time() - last_purge > 3600:
+                    self.purge()
+                    last_purge = time.time()
+            except Exception as e:
+                print(f"[outbox] 后台投递出错：{e}")